@@ -0,0 +1,62 @@
+# benchmarks/common.py
+
+
+import datetime
+import os
+import random
+import tempfile
+import time
+
+from project import app, db
+from project.models import Task, User
+
+
+# shared helpers for the benchmark scripts
+#
+# every benchmark runs against its own throwaway SQLite file so it never
+# touches flasktaskr.db
+
+
+def use_scratch_database(name='bench.db'):
+    path = os.path.join(tempfile.mkdtemp(prefix='flasktaskr-bench-'), name)
+    app.config['TESTING'] = True
+    app.config['WTF_CSRF_ENABLED'] = False
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + path
+    db.create_all()
+    return path
+
+
+def seed(users=10, tasks=1000, closed_ratio=0.5, chunk_size=10000, seed_value=42):
+    rng = random.Random(seed_value)
+    db.engine.execute(User.__table__.insert(), [
+        dict(name='user{0:06d}'.format(i), email='user{0}@example.com'.format(i),
+             password='python', role='user')
+        for i in range(users)
+    ])
+    start = datetime.date(2016, 1, 1)
+    remaining = tasks
+    while remaining > 0:
+        size = min(chunk_size, remaining)
+        db.engine.execute(Task.__table__.insert(), [
+            dict(
+                name='Task {0}'.format(rng.randint(0, 10 ** 9)),
+                due_date=start + datetime.timedelta(days=rng.randint(0, 3650)),
+                priority=rng.randint(1, 10),
+                posted_date=start,
+                status=Task.CLOSED if rng.random() < closed_ratio else Task.OPEN,
+                user_id=rng.randint(1, users),
+            )
+            for _ in range(size)
+        ])
+        remaining -= size
+
+
+def timed(func, repeat=20):
+    # best of `repeat`, in milliseconds
+    best = None
+    for _ in range(repeat):
+        started = time.time()
+        func()
+        elapsed = (time.time() - started) * 1000.0
+        best = elapsed if best is None else min(best, elapsed)
+    return best
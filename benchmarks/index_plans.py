@@ -0,0 +1,60 @@
+# benchmarks/index_plans.py
+#
+# usage: python -m benchmarks.index_plans [number of tasks]
+
+
+import sys
+
+from sqlalchemy import text
+
+from project import db
+from project.models import Task
+from project.schema import create_missing_indexes
+
+from .common import seed, timed, use_scratch_database
+
+
+QUERIES = [
+    ('open listing page', """
+        SELECT task_id, name, due_date FROM tasks
+        WHERE status = :status
+        ORDER BY due_date, task_id
+        LIMIT 26"""),
+    ('open listing, next page', """
+        SELECT task_id, name, due_date FROM tasks
+        WHERE status = :status
+          AND due_date >= :due_date
+          AND (due_date > :due_date OR task_id > :task_id)
+        ORDER BY due_date, task_id
+        LIMIT 26"""),
+    ('tasks of one user', """
+        SELECT task_id FROM tasks
+        WHERE user_id = :user_id AND status = :status"""),
+]
+
+PARAMS = dict(status=Task.OPEN, due_date='2020-06-01', task_id=0, user_id=3)
+
+
+def report(label):
+    print(label)
+    for name, sql in QUERIES:
+        plan = db.session.execute(text('EXPLAIN QUERY PLAN ' + sql), PARAMS).fetchall()
+        elapsed = timed(lambda: db.session.execute(text(sql), PARAMS).fetchall())
+        print('  {0:<26} {1:8.3f} ms  {2}'.format(
+            name, elapsed, '; '.join(row[3] for row in plan)))
+
+
+def main(tasks):
+    use_scratch_database()
+    for index in Task.__table__.indexes:
+        index.drop(db.engine)
+    seed(users=100, tasks=tasks)
+
+    report('without indexes ({0} tasks):'.format(tasks))
+    create_missing_indexes(db.engine, db.metadata)
+    db.session.execute('ANALYZE')
+    report('with indexes:')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200000)
@@ -0,0 +1,301 @@
+# benchmarks/load.py
+#
+# usage: python -m benchmarks.load [--users N] [--tasks N] [--requests N]
+#                                  [--concurrency N] [--mode client|server|both]
+#                                  [--output results.json] [--compare old.json]
+#
+# seeds a scratch database, then drives login, listing, add, complete and
+# delete through the Flask test client and/or a real threaded WSGI server.
+# Reports p50/p95/p99 latency and throughput per route, writes them as JSON,
+# and with --compare exits non-zero when a route got slower than --tolerance
+
+
+import argparse
+import datetime
+import json
+import platform
+import sqlite3
+import sys
+import threading
+import time
+
+try:
+    from urllib.error import HTTPError
+    from urllib.parse import urlencode
+    from urllib.request import HTTPCookieProcessor, HTTPRedirectHandler, build_opener
+except ImportError:
+    from urllib import urlencode
+    from urllib2 import HTTPCookieProcessor, HTTPError, HTTPRedirectHandler, build_opener
+
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+from project import app, db
+from project.models import Task, User
+from project.users.passwords import hash_password
+
+from .common import seed, use_scratch_database
+
+SCENARIOS = ('login', 'listing', 'add', 'complete', 'delete')
+
+
+#################
+#### drivers ####
+#################
+
+class ClientDriver(object):
+
+    def __init__(self):
+        self.client = app.test_client()
+
+    def request(self, method, path, data=None):
+        response = self.client.open(path, method=method, data=data)
+        return response.status_code
+
+
+class NoRedirects(HTTPRedirectHandler):
+
+    # redirects are part of the answer, not a second request to time
+    def http_error_302(self, req, fp, code, msg, headers):
+        return fp
+    http_error_301 = http_error_303 = http_error_307 = http_error_302
+
+
+class ServerDriver(object):
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.opener = build_opener(HTTPCookieProcessor(), NoRedirects())
+
+    def request(self, method, path, data=None):
+        body = urlencode(data).encode('ascii') if data is not None else None
+        try:
+            response = self.opener.open(self.base_url + path, body)
+        except HTTPError as error:
+            return error.code
+        response.read()
+        return response.getcode()
+
+
+class QuietHandler(WSGIRequestHandler):
+
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+def start_server():
+    server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=QuietHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server, 'http://127.0.0.1:{0}'.format(server.server_port)
+
+
+###################
+#### scenarios ####
+###################
+
+class Worker(object):
+
+    # one simulated user: its own driver (cookies) and its own tasks
+
+    def __init__(self, driver, user_id, open_ids, closed_ids):
+        self.driver = driver
+        self.name = 'user{0:06d}'.format(user_id - 1)
+        self.open_ids = open_ids
+        self.closed_ids = closed_ids
+        self.latencies = dict((name, []) for name in SCENARIOS)
+        self.errors = dict((name, 0) for name in SCENARIOS)
+
+    def login(self):
+        return self.driver.request('POST', '/', dict(name=self.name, password='python'))
+
+    def timed(self, scenario, action):
+        started = time.time()
+        status = action()
+        self.latencies[scenario].append(time.time() - started)
+        if status >= 400:
+            self.errors[scenario] += 1
+
+    def run(self, scenario, count):
+        if scenario == 'login':
+            for _ in range(count):
+                self.timed('login', self.login)
+                self.driver.request('GET', '/logout/')
+            self.login()
+            return
+        for i in range(count):
+            if scenario == 'listing':
+                action = lambda: self.driver.request('GET', '/tasks/')
+            elif scenario == 'add':
+                action = lambda: self.driver.request('POST', '/add/', dict(
+                    name='Load test task', due_date='12/31/2030', priority='5'))
+            elif scenario == 'complete':
+                task_id = self.open_ids.pop()
+                action = lambda: self.driver.request('GET', '/complete/{0}/'.format(task_id))
+            else:
+                task_id = self.closed_ids.pop()
+                action = lambda: self.driver.request('GET', '/delete/{0}/'.format(task_id))
+            self.timed(scenario, action)
+
+
+def percentile(ordered, fraction):
+    # nearest-rank percentile of an already sorted list
+    index = max(int(round(fraction * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(index, len(ordered) - 1)]
+
+
+def summarize(workers, scenario, elapsed):
+    latencies = sorted(l for worker in workers for l in worker.latencies[scenario])
+    if not latencies:
+        return None
+    return dict(
+        requests=len(latencies),
+        errors=sum(worker.errors[scenario] for worker in workers),
+        mean_ms=round(1000.0 * sum(latencies) / len(latencies), 3),
+        p50_ms=round(1000.0 * percentile(latencies, 0.50), 3),
+        p95_ms=round(1000.0 * percentile(latencies, 0.95), 3),
+        p99_ms=round(1000.0 * percentile(latencies, 0.99), 3),
+        requests_per_second=round(len(latencies) / elapsed, 1),
+    )
+
+
+def task_ids(user_id, status):
+    rows = db.session.query(Task.task_id).filter_by(user_id=user_id, status=status)
+    return [task_id for task_id, in rows]
+
+
+def run_mode(make_driver, users, requests, concurrency):
+    workers = []
+    # workers sharing a user split its tasks so none completes another's
+    shares = (concurrency + users - 1) // users
+    for i in range(concurrency):
+        user_id = i % users + 1
+        open_ids = task_ids(user_id, Task.OPEN)[i // users::shares]
+        closed_ids = task_ids(user_id, Task.CLOSED)[i // users::shares]
+        worker = Worker(make_driver(), user_id, open_ids, closed_ids)
+        worker.login()
+        workers.append(worker)
+    db.session.remove()
+
+    results = {}
+    for scenario in SCENARIOS:
+        per_worker = requests // concurrency
+        if scenario == 'complete':
+            per_worker = min([per_worker] + [len(w.open_ids) for w in workers])
+        elif scenario == 'delete':
+            per_worker = min([per_worker] + [len(w.closed_ids) for w in workers])
+        threads = [threading.Thread(target=worker.run, args=(scenario, per_worker))
+                   for worker in workers]
+        started = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        results[scenario] = summarize(workers, scenario, time.time() - started)
+    return results
+
+
+###################
+#### reporting ####
+###################
+
+def print_results(mode, results):
+    print('\n{0}'.format(mode))
+    print('{0:>10} {1:>8} {2:>7} {3:>9} {4:>9} {5:>9} {6:>9}'.format(
+        'route', 'requests', 'errors', 'p50 ms', 'p95 ms', 'p99 ms', 'req/s'))
+    for scenario in SCENARIOS:
+        row = results.get(scenario)
+        if row is None:
+            print('{0:>10} {1:>8}'.format(scenario, 'skipped'))
+            continue
+        print('{0:>10} {1:>8} {2:>7} {3:>9.2f} {4:>9.2f} {5:>9.2f} {6:>9.1f}'.format(
+            scenario, row['requests'], row['errors'], row['p50_ms'], row['p95_ms'],
+            row['p99_ms'], row['requests_per_second']))
+
+
+def compare(results, baseline, tolerance):
+    # returns the routes whose p95 grew, or throughput fell, by more than tolerance
+    regressions = []
+    print('\nagainst baseline ({0:.0%} tolerance)'.format(tolerance))
+    for mode in sorted(results):
+        for scenario in SCENARIOS:
+            new = results[mode].get(scenario)
+            old = baseline.get(mode, {}).get(scenario)
+            if not new or not old:
+                continue
+            p95 = new['p95_ms'] / old['p95_ms'] - 1 if old['p95_ms'] else 0
+            rps = new['requests_per_second'] / old['requests_per_second'] - 1 \
+                if old['requests_per_second'] else 0
+            slower = p95 > tolerance or -rps > tolerance
+            print('{0:>7} {1:>10} p95 {2:+7.1%}  req/s {3:+7.1%}{4}'.format(
+                mode, scenario, p95, rps, '  REGRESSION' if slower else ''))
+            if slower:
+                regressions.append((mode, scenario))
+    return regressions
+
+
+def main(args):
+    use_scratch_database()
+    if args.hash_method:
+        app.config['PASSWORD_HASH_METHOD'] = args.hash_method
+    print('seeding {0} users and {1} tasks...'.format(args.users, args.tasks))
+    seed(users=args.users, tasks=args.tasks)
+    db.engine.execute(User.__table__.update().values(password=hash_password('python')))
+    app.config['LOGIN_LIMIT_ENABLED'] = False
+
+    results = {}
+    if args.mode in ('client', 'both'):
+        results['client'] = run_mode(ClientDriver, args.users, args.requests, args.concurrency)
+        print_results('test client', results['client'])
+    if args.mode in ('server', 'both'):
+        server, base_url = start_server()
+        try:
+            results['server'] = run_mode(
+                lambda: ServerDriver(base_url), args.users, args.requests, args.concurrency)
+        finally:
+            server.shutdown()
+        print_results('wsgi server ({0})'.format(base_url), results['server'])
+
+    report = dict(
+        meta=dict(
+            timestamp=datetime.datetime.utcnow().isoformat(),
+            python=platform.python_version(),
+            sqlite=sqlite3.sqlite_version,
+            users=args.users,
+            tasks=args.tasks,
+            requests=args.requests,
+            concurrency=args.concurrency,
+            password_hash_method=app.config['PASSWORD_HASH_METHOD'],
+        ),
+        results=results,
+    )
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print('\nwrote {0}'.format(args.output))
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        if compare(results, baseline, args.tolerance):
+            return 1
+    return 0
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description='Load test the flasktaskr routes.')
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--tasks', type=int, default=10000)
+    parser.add_argument('--requests', type=int, default=200,
+                        help='requests per route, split across the workers')
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--mode', choices=('client', 'server', 'both'), default='both')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--compare', help='JSON results of an earlier run')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    parser.add_argument('--hash-method', help='override PASSWORD_HASH_METHOD, '
+                        'e.g. pbkdf2:sha256:1000 to keep login out of the way')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    sys.exit(main(parse_args(sys.argv[1:])))
@@ -0,0 +1,41 @@
+# benchmarks/login_throughput.py
+#
+# usage: python -m benchmarks.login_throughput [seconds] [iterations...]
+#
+# logs in through the test client for a few seconds at each PBKDF2 work
+# factor and reports logins per second
+
+
+import sys
+import time
+
+from project import app, db
+from project.models import User
+from project.users.passwords import hash_password
+
+from .common import use_scratch_database
+
+
+def main(seconds, costs):
+    use_scratch_database()
+    client = app.test_client()
+    print('{0:>10} {1:>12} {2:>12}'.format('iterations', 'logins/s', 'ms/login'))
+    for cost in costs:
+        app.config['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256:{0}'.format(cost)
+        db.session.query(User).delete()
+        db.session.add(User('bench-user', 'bench@example.com', hash_password('python'), 'user'))
+        db.session.commit()
+        logins = 0
+        started = time.time()
+        while time.time() - started < seconds:
+            client.post('/', data=dict(name='bench-user', password='python'))
+            client.get('/logout/')
+            logins += 1
+        elapsed = time.time() - started
+        print('{0:>10} {1:>12.1f} {2:>12.2f}'.format(
+            cost, logins / elapsed, elapsed * 1000.0 / logins))
+
+
+if __name__ == '__main__':
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 3
+    main(seconds, [int(arg) for arg in sys.argv[2:]] or [1000, 10000, 50000, 150000])
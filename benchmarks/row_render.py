@@ -0,0 +1,54 @@
+# benchmarks/row_render.py
+#
+# usage: python -m benchmarks.row_render [sizes...]
+#
+# times a full render of the tasks page listing every task on one page,
+# with the row fragment cache off, cold and warm
+
+
+import sys
+
+from flask import session
+
+from project import app
+from project.tasks.forms import AddTaskForm
+from project.tasks.views import render_tasks
+
+from .common import seed, timed, use_scratch_database
+
+
+def render_page(size):
+    with app.test_request_context('/tasks/?per_page={0}'.format(size)):
+        session['logged_in'] = True
+        session['user_id'] = 1
+        session['role'] = 'user'
+        render_tasks(AddTaskForm())
+
+
+def main(sizes):
+    print('{0:>8} {1:>12} {2:>12} {3:>12}'.format('tasks', 'no cache', 'cold', 'warm'))
+    for size in sizes:
+        use_scratch_database()
+        seed(users=50, tasks=size)
+        app.config['TASKS_MAX_PER_PAGE'] = size
+        app.extensions['task_cache'].clear()
+        row_cache = app.extensions['task_row_cache']
+        row_cache.max_entries = 2 * size
+
+        # warm the listing cache so only rendering is measured
+        app.config['TASK_ROW_CACHE'] = False
+        render_page(size)
+        repeat = max(1, 10000 // size)
+        uncached = timed(lambda: render_page(size), repeat)
+
+        app.config['TASK_ROW_CACHE'] = True
+        row_cache.clear()
+        cold = timed(lambda: (row_cache.clear(), render_page(size)), repeat)
+        render_page(size)
+        warm = timed(lambda: render_page(size), repeat)
+        print('{0:>8} {1:>9.1f} ms {2:>9.1f} ms {3:>9.1f} ms'.format(
+            size, uncached, cold, warm))
+
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or [1000, 10000, 100000])
@@ -0,0 +1,104 @@
+# benchmarks/search.py
+#
+# usage: python -m benchmarks.search [tasks] [vocabulary size]
+#
+# seeds tasks whose names are random words (zipf-like, so a few words are
+# common and most are rare), then times searches for rare, mid-frequency and
+# common words and a two-word query, through search_tasks() and through
+# /tasks/search/
+
+
+import datetime
+import random
+import sys
+import time
+
+from project import app, db
+from project.models import Task, User
+from project.search import search_index, search_tasks
+
+from .common import use_scratch_database
+
+
+def seed_names(tasks, vocabulary, rng, chunk_size=50000):
+    words = ['w{0}x{1}'.format(i, rng.randint(100, 999)) for i in range(vocabulary)]
+    # zipf-like weights: word i is picked with probability ~ 1 / (i + 1)
+    cumulative, total = [], 0.0
+    for i in range(vocabulary):
+        total += 1.0 / (i + 1)
+        cumulative.append(total)
+
+    def pick():
+        target = rng.random() * total
+        low, high = 0, vocabulary - 1
+        while low < high:
+            middle = (low + high) // 2
+            if cumulative[middle] < target:
+                low = middle + 1
+            else:
+                high = middle
+        return words[low]
+
+    db.engine.execute(User.__table__.insert(), [
+        dict(name='bench', email='bench@example.com', password='python', role='user')])
+    start = datetime.date(2016, 1, 1)
+    remaining = tasks
+    while remaining > 0:
+        size = min(chunk_size, remaining)
+        db.engine.execute(Task.__table__.insert(), [
+            dict(name=' '.join(pick() for _ in range(rng.randint(2, 5))),
+                 due_date=start, priority=1, posted_date=start, status=Task.OPEN, user_id=1)
+            for _ in range(size)
+        ])
+        remaining -= size
+    return words
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    return [samples[min(int(len(samples) * p), len(samples) - 1)] for p in (0.5, 0.95)]
+
+
+def main(tasks, vocabulary):
+    use_scratch_database()
+    rng = random.Random(42)
+    started = time.time()
+    words = seed_names(tasks, vocabulary, rng)
+    print('seeded {0} tasks in {1:.1f}s ({2} index)'.format(
+        tasks, time.time() - started, type(search_index()).__name__))
+
+    queries = [
+        ('common word', words[0]),
+        ('mid word', words[vocabulary // 50]),
+        ('rare word', words[-1]),
+        ('two words', '{0} {1}'.format(words[1], words[2])),
+        ('prefix', words[vocabulary // 10][:4] + '*'),
+    ]
+    client = app.test_client()
+    client.post('/', data=dict(name='bench', password='python'))
+    print('{0:<12} {1:>8} {2:>10} {3:>10} {4:>10} {5:>10}'.format(
+        'query', 'matches', 'fn p50', 'fn p95', 'http p50', 'http p95'))
+    for label, query in queries:
+        matches = db.engine.execute(
+            "SELECT count(*) FROM tasks_fts WHERE tasks_fts MATCH ?",
+            ' '.join('"{0}"{1}'.format(word.rstrip('*'), '*' if word.endswith('*') else '')
+                     for word in query.split())
+        ).scalar() if type(search_index()).__name__ == 'Fts5Index' else '-'
+        direct, http = [], []
+        for _ in range(30):
+            with app.test_request_context():
+                t = time.time()
+                search_tasks(query)
+                direct.append((time.time() - t) * 1000)
+                db.session.remove()
+            t = time.time()
+            client.get('/tasks/search/', query_string=dict(q=query))
+            http.append((time.time() - t) * 1000)
+        print('{0:<12} {1:>8} {2:>10.2f} {3:>10.2f} {4:>10.2f} {5:>10.2f}'.format(
+            label, matches, *(percentiles(direct) + percentiles(http))))
+
+
+if __name__ == '__main__':
+    tasks = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    vocabulary = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+    main(tasks, vocabulary)
@@ -0,0 +1,90 @@
+# benchmarks/sqlite_concurrency.py
+#
+# usage: python -m benchmarks.sqlite_concurrency [readers] [writers] [seconds]
+#
+# runs reader and writer processes against the same SQLite file, once with
+# SQLite's defaults and once with SQLITE_PRAGMAS, and reports throughput and
+# "database is locked" errors for each
+
+
+import datetime
+import multiprocessing
+import sys
+import time
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+
+from project import app
+from project.models import Task
+
+from .common import seed, use_scratch_database
+
+
+LISTING = text("""
+    SELECT task_id, name, due_date FROM tasks
+    WHERE status = :status ORDER BY due_date, task_id LIMIT 26""")
+INSERT = text("""
+    INSERT INTO tasks (name, due_date, priority, posted_date, status, user_id)
+    VALUES ('Benchmark task', :due_date, 5, :due_date, :status, 1)""")
+COMPLETE = text("""
+    UPDATE tasks SET status = :closed WHERE task_id = :task_id""")
+
+
+def worker(uri, role, seconds, results):
+    # the connect hook applies app.config['SQLITE_PRAGMAS'] to every
+    # connection this engine opens
+    engine = create_engine(uri)
+    ops = errors = 0
+    deadline = time.time() + seconds
+    today = datetime.date.today()
+    while time.time() < deadline:
+        try:
+            with engine.begin() as conn:
+                if role == 'reader':
+                    conn.execute(LISTING, status=Task.OPEN).fetchall()
+                else:
+                    result = conn.execute(INSERT, due_date=today, status=Task.OPEN)
+                    conn.execute(COMPLETE, closed=Task.CLOSED, task_id=result.lastrowid)
+            ops += 1
+        except OperationalError:
+            errors += 1
+    results.put((role, ops, errors))
+
+
+def run(label, pragmas, readers, writers, seconds):
+    app.config['SQLITE_PRAGMAS'] = pragmas
+    use_scratch_database()
+    seed(users=10, tasks=20000)
+    uri = app.config['SQLALCHEMY_DATABASE_URI']
+    results = multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(target=worker, args=(uri, role, seconds, results))
+        for role in ['reader'] * readers + ['writer'] * writers
+    ]
+    for process in processes:
+        process.start()
+    totals = {'reader': [0, 0], 'writer': [0, 0]}
+    for _ in processes:
+        role, ops, errors = results.get()
+        totals[role][0] += ops
+        totals[role][1] += errors
+    for process in processes:
+        process.join()
+    print('{0}:'.format(label))
+    for role in ('reader', 'writer'):
+        ops, errors = totals[role]
+        print('  {0}s: {1:8.1f} ops/s  {2} locked errors'.format(
+            role, ops / float(seconds), errors))
+
+
+def main(readers, writers, seconds):
+    tuned = app.config['SQLITE_PRAGMAS']
+    run('SQLite defaults', [], readers, writers, seconds)
+    run('SQLITE_PRAGMAS', tuned, readers, writers, seconds)
+
+
+if __name__ == '__main__':
+    args = [int(arg) for arg in sys.argv[1:4]]
+    args += [4, 2, 5][len(args):]
+    main(*args)
@@ -5,11 +5,16 @@ from datetime import date
 
 from project import db
 from project.models import Task, User
+from project.schema import add_missing_columns, create_missing_indexes
 
 
 # create the database and the db table
 db.create_all()
 
+# bring tables that already existed up to date with the models
+add_missing_columns(db.engine, db.metadata)
+create_missing_indexes(db.engine, db.metadata)
+
 # insert dummy data
 #db.session.add(User('admin', 'ad@min.com', 'admin', 'admin'))
 #db.session.add(Task("Finish this tutorial", date(2016, 1, 13), 10, date(2016, 2, 10), 1, 1))
@@ -0,0 +1,32 @@
+# db_export.py
+
+
+import argparse
+import sys
+
+from project import db
+from project.exporter import export_tasks
+from project.models import User
+
+
+# stream tasks out as CSV or JSON Lines, in constant memory
+# usage: python db_export.py [--user NAME] [--format csv|jsonl] [--gzip] [-o FILE]
+parser = argparse.ArgumentParser(description='Export tasks.')
+parser.add_argument('--user', help='only this user\'s tasks')
+parser.add_argument('--format', choices=('csv', 'jsonl'), default='csv')
+parser.add_argument('--gzip', action='store_true')
+parser.add_argument('-o', '--output', help='defaults to stdout')
+args = parser.parse_args()
+
+user_id = None
+if args.user:
+    user = User.query.filter_by(name=args.user).first()
+    if user is None:
+        sys.exit('no such user: {0}'.format(args.user))
+    user_id = user.id
+
+out = open(args.output, 'wb') if args.output else getattr(sys.stdout, 'buffer', sys.stdout)
+for chunk in export_tasks(args.format, user_id, args.gzip):
+    out.write(chunk)
+out.flush()
+db.session.remove()
@@ -0,0 +1,15 @@
+# db_hash_passwords.py
+
+
+import sys
+
+from project.users.passwords import hash_plaintext_passwords
+
+
+# replace every plaintext password with a hash, using all CPU cores
+# usage: python db_hash_passwords.py [batch size] [processes]
+batch_size = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+processes = int(sys.argv[2]) if len(sys.argv) > 2 else None
+
+count = hash_plaintext_passwords(batch_size, processes)
+print('hashed {0} password(s)'.format(count))
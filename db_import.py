@@ -0,0 +1,46 @@
+# db_import.py
+
+
+import argparse
+import sys
+import time
+
+from project.importer import CHUNK_SIZE, import_tasks, import_users, open_input, read_records
+
+
+# bulk load users or tasks from CSV or JSON Lines
+# usage: python db_import.py users|tasks FILE [--format csv|jsonl]
+#                            [--chunk-size N] [--defer-indexes]
+parser = argparse.ArgumentParser(description='Bulk import users or tasks.')
+parser.add_argument('kind', choices=('users', 'tasks'))
+parser.add_argument('path', help="CSV or JSON Lines file, or '-' for stdin")
+parser.add_argument('--format', choices=('csv', 'jsonl'),
+                    help='defaults to jsonl for .jsonl / .ndjson files, csv otherwise')
+parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+parser.add_argument('--defer-indexes', action='store_true',
+                    help='drop the task indexes during the load and rebuild them after')
+args = parser.parse_args()
+
+fmt = args.format or ('jsonl' if args.path.endswith(('.jsonl', '.ndjson')) else 'csv')
+lines = sys.stdin if args.path == '-' else open_input(args.path)
+records = read_records(lines, fmt)
+started = time.time()
+
+
+def progress(result):
+    elapsed = time.time() - started
+    sys.stderr.write('\r{0} imported, {1} rejected, {2:.0f} rows/s'.format(
+        result.imported, result.rejected, result.imported / max(elapsed, 0.001)))
+
+
+if args.kind == 'users':
+    result = import_users(records, args.chunk_size, progress)
+else:
+    result = import_tasks(records, args.chunk_size, progress, args.defer_indexes)
+sys.stderr.write('\n')
+
+print('imported {0} {1} in {2:.1f}s'.format(result.imported, args.kind, time.time() - started))
+for number, reason in result.errors:
+    print('record {0}: {1}'.format(number, reason))
+if result.rejected > len(result.errors):
+    print('... and {0} more rejected record(s)'.format(result.rejected - len(result.errors)))
@@ -0,0 +1,15 @@
+# db_indexes.py
+
+
+from project import db
+from project.schema import create_missing_indexes
+
+
+# build any indexes declared on the models that the database doesn't have yet
+created = create_missing_indexes(db.engine, db.metadata)
+
+if created:
+    for name in created:
+        print('created index {0}'.format(name))
+else:
+    print('all indexes already exist')
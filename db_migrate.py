@@ -1,63 +1,62 @@
 # db_migrate.py
 
 
-from views import db
-from _config import DATABASE_PATH
-
-import sqlite3
-#from datetime import datetime
-
-#with sqlite3.connect(DATABASE_PATH) as connection:
-#
-#    # get a cursor object used to execute SQL commands
-#    c = connection.cursor()
-#
-#    # temporarily change the name of tasks table
-#    c.execute("""ALTER TABLE tasks RENAME TO old_tasks""")
-#
-#    # recreate a new tasks table with updated schema
-#    db.create_all()
-#
-#    # retrieve data from old_tasks table
-#    c.execute("""SELECT name, due_date, priority, status
-#                FROM old_tasks ORDER BY task_id ASC""")
-#
-#    # save all rows as a list of tuples; set posted_date to now and user_id to 1
-#    data = [(row[0], row[1], row[2], row[3], datetime.now(), 1) for row in c.fetchall()]
-#
-#    # insert data to tasks table
-#    c.executemany("""INSERT INTO tasks
-#                (name, due_date, priority, status, posted_date, user_id)
-#                VALUES (?, ?, ?, ?, ?, ?)""", data)
-#
-#    # delete old_tasks table
-#    c.execute("DROP TABLE old_tasks")
-
-
-with sqlite3.connect(DATABASE_PATH) as connection:
-
-    # get a cursor object used to execute SQL commands
-    c = connection.cursor()
-
-    # temporarily change the name of tasks table
-    c.execute("""ALTER TABLE users RENAME TO old_users""")
-
-    # recreate a new tasks table with updated schema
-    db.create_all()
-
-    # retrieve data from old_tasks table
-    c.execute("""SELECT name, email, password
-                FROM old_users
-                ORDER BY id
-                ASC""")
-
-    # save all rows as a list of tuples; set posted_date to now and user_id to 1
-    data = [(row[0], row[1], row[2], 'user') for row in c.fetchall()]
-
-    # insert data to tasks table
-    c.executemany("""INSERT INTO users
-                (name, email, password, role)
-                VALUES (?, ?, ?, ?)""", data)
-
-    # delete old_tasks table
-    c.execute("DROP TABLE old_users")
\ No newline at end of file
+import argparse
+import sys
+
+from project import db
+from project.migrations import MigrationRunner, dry_run
+
+
+# apply versioned migrations (see project/migrations.py)
+# usage: python db_migrate.py [status | up [--to VERSION] | dry-run] [--batch-size N]
+parser = argparse.ArgumentParser(description='Apply database migrations.')
+parser.add_argument('command', nargs='?', default='up', choices=('status', 'up', 'dry-run'))
+parser.add_argument('--to', type=int, help='stop after this version')
+parser.add_argument('--batch-size', type=int, help='rows per transaction')
+args = parser.parse_args()
+
+
+def progress(migration, step, done, total, elapsed):
+    rate = done / elapsed if elapsed else 0
+    line = '\r  {0}: {1}'.format(migration.version, step.description)
+    if total:
+        eta = (total - done) / rate if rate else 0
+        line += ' {0}/{1} rows ({2:.0%}), {3:.0f} rows/s, eta {4:.0f}s'.format(
+            min(done, total), total, min(done, total) / float(total), rate, eta)
+    sys.stderr.write(line)
+    sys.stderr.flush()
+
+
+def print_timings(timings):
+    sys.stderr.write('\n')
+    for version, description, rows, seconds in timings:
+        print('{0:>4}  {1:<50} {2:>10} {3:>9.2f}s'.format(
+            version, description, '' if rows is None else rows, seconds))
+    print('total {0:.2f}s'.format(sum(timing[3] for timing in timings)))
+
+
+runner = MigrationRunner(db.engine, batch_size=args.batch_size, progress=progress)
+
+if args.command == 'status':
+    states = runner.states()
+    for migration in runner.migrations:
+        state = states.get(migration.version)
+        if state is None:
+            status = 'pending'
+        elif state.applied is None:
+            status = 'interrupted at step {0}, checkpoint {1}'.format(state.step, state.checkpoint)
+        else:
+            status = 'applied {0:%Y-%m-%d %H:%M}'.format(state.applied)
+        print('{0:>4}  {1:<30} {2}'.format(migration.version, migration.name, status))
+
+elif args.command == 'dry-run':
+    print('timing pending migrations on a copy of the database...')
+    print_timings(dry_run(db.engine, args.batch_size, progress))
+
+else:
+    applied = runner.run(args.to)
+    if applied:
+        print_timings(runner.timings)
+    else:
+        print('nothing to migrate')
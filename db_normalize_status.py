@@ -0,0 +1,10 @@
+# db_normalize_status.py
+
+
+from project import db
+from project.schema import normalize_task_status
+
+
+# convert task statuses stored as '1' / '0' text to integers in one pass
+count = normalize_task_status(db.engine)
+print('normalized {0} task(s)'.format(count))
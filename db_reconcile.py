@@ -0,0 +1,27 @@
+# db_reconcile.py
+
+
+import argparse
+import sys
+import time
+
+from project import db
+from project.counters import reconcile_counts
+
+
+# recount every user's open / closed / overdue tasks and correct task_counts
+# usage: python db_reconcile.py [--check]
+parser = argparse.ArgumentParser(description='Rebuild the per-user task counts.')
+parser.add_argument('--check', action='store_true',
+                    help='only report drift, and exit non-zero if there is any')
+args = parser.parse_args()
+
+started = time.time()
+drift = reconcile_counts(db.engine, fix=not args.check)
+for user_id, stored, actual in drift:
+    print('user {0}: stored {1}, counted {2} (open, closed, overdue)'.format(
+        user_id, stored if stored is not None else 'nothing', actual))
+print('{0} user(s) drifted{1}; took {2:.1f}s'.format(
+    len(drift), '' if args.check or not drift else ', fixed', time.time() - started))
+if args.check and drift:
+    sys.exit(1)
@@ -0,0 +1,41 @@
+# db_worker.py
+
+
+import argparse
+import json
+
+from sqlalchemy import func
+
+from project import db
+from project.jobs import HANDLERS, enqueue, run_one, run_workers
+from project.models import Job
+
+
+# run background jobs (see project/jobs.py)
+# usage: python db_worker.py run [--workers N]   # until ctrl-c / SIGTERM
+#        python db_worker.py drain                # run due jobs here, then exit
+#        python db_worker.py enqueue KIND [--payload JSON]
+#        python db_worker.py status
+parser = argparse.ArgumentParser(description='Run or inspect background jobs.')
+parser.add_argument('command', choices=('run', 'drain', 'enqueue', 'status'))
+parser.add_argument('kind', nargs='?', choices=sorted(HANDLERS))
+parser.add_argument('--workers', type=int, help='worker processes (default JOBS_WORKERS)')
+parser.add_argument('--payload', default='{}', help='JSON payload for enqueue')
+args = parser.parse_args()
+
+if args.command == 'run':
+    run_workers(args.workers)
+elif args.command == 'drain':
+    ran = 0
+    while run_one() is not None:
+        ran += 1
+    print('{0} job(s) run'.format(ran))
+elif args.command == 'enqueue':
+    if args.kind is None:
+        parser.error('enqueue needs a job kind')
+    job = enqueue(args.kind, json.loads(args.payload))
+    db.session.commit()
+    print('queued job {0}'.format(job.id))
+else:
+    for status, count in db.session.query(Job.status, func.count()).group_by(Job.status):
+        print('{0:<8} {1}'.format(status, count))
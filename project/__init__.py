@@ -8,9 +8,45 @@ app = Flask(__name__)
 app.config.from_pyfile('_config.py')
 db = SQLAlchemy(app)
 
+# cache for the task listings (see TASK_CACHE in _config.py)
+from project.cache import LocalCache, make_cache
+app.extensions['task_cache'] = make_cache(app.config)
+app.extensions['task_row_cache'] = LocalCache(
+    max_entries=app.config['TASK_ROW_CACHE_MAX_ENTRIES'],
+    default_ttl=app.config['TASK_ROW_CACHE_TTL']
+)
+
+# cache of the logged-in user's id / role / active flag (see project/auth.py)
+app.extensions['principal_cache'] = LocalCache(
+    max_entries=app.config['AUTH_CACHE_MAX_ENTRIES'],
+    default_ttl=app.config['AUTH_CACHE_TTL']
+)
+
+# login attempt limits (see LOGIN_LIMIT_* in _config.py)
+from project.ratelimit import make_login_limiter
+app.extensions['login_limiter'] = make_login_limiter(app.config)
+
+# per-connection database settings
+from project import database
+
+# full-text index over task names, created alongside the tasks table
+from project import search
+
+# server-side sessions (see SESSION_BACKEND in _config.py)
+if app.config['SESSION_BACKEND'] != 'cookie':
+    from project.sessions import make_session_interface
+    app.session_interface = make_session_interface(app.config)
+
+# request timing, SQL and template instrumentation (see PROFILING_* in _config.py)
+from project.profiling import Metrics
+app.extensions['metrics'] = Metrics(app.config['PROFILING_SLOW_QUERY_SAMPLES'])
+from project import profiling
+
 from project.users.views import users_blueprint
 from project.tasks.views import tasks_blueprint
+from project.api.views import api_blueprint
 
 # register our blueprints
 app.register_blueprint(users_blueprint)
-app.register_blueprint(tasks_blueprint)
\ No newline at end of file
+app.register_blueprint(tasks_blueprint)
+app.register_blueprint(api_blueprint)
\ No newline at end of file
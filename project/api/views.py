@@ -0,0 +1,239 @@
+# project/api/views.py
+
+
+#################
+#### imports ####
+#################
+
+import datetime
+import json
+from flask import jsonify, request, send_from_directory, stream_with_context, url_for, \
+    Blueprint, Response
+from flask_wtf.csrf import generate_csrf, validate_csrf
+from sqlalchemy.orm import joinedload
+
+from project import app, db
+from project.auth import api_login_required, current_principal, is_admin
+from project.counters import task_added
+from project.jobs import enqueue, job_to_dict
+from project.listing import RANGES, ListingError, parse_listing
+from project.models import Job, Task
+from project.tasks.views import commit_task_changes, complete_tasks, delete_tasks, task_exists, \
+    task_writable, writable_task
+
+
+################
+#### config ####
+################
+
+api_blueprint = Blueprint('api', __name__, url_prefix='/api')
+
+
+##########################
+#### helper functions ####
+##########################
+
+def json_error(message, status):
+    response = jsonify(error=message)
+    response.status_code = status
+    return response
+
+def task_to_dict(task):
+    return dict(
+        task_id=task.task_id,
+        name=task.name,
+        due_date=task.due_date.isoformat(),
+        priority=task.priority,
+        posted_date=task.posted_date.isoformat() if task.posted_date else None,
+        status='open' if task.status == Task.OPEN else 'closed',
+        poster=task.poster.name if task.poster else None
+    )
+
+LISTING_ARGS = ('owner', 'sort', 'order') + tuple(RANGES)
+
+def listing_query(status, args):
+    # owner, sort, order and the range filters go through the listing
+    # builder, whose indexes all lead with the status
+    if status is not None:
+        return parse_listing(args, Task.OPEN if status == 'open' else Task.CLOSED).query()
+    if any(args.get(name) for name in LISTING_ARGS):
+        raise ListingError("Filters and sorting need status 'open' or 'closed'.")
+    return db.session.query(Task).options(joinedload(Task.poster)).order_by(
+        Task.task_id.asc())
+
+def stream_tasks(query):
+    # rows are fetched in batches from a server-side cursor (where the driver
+    # supports one) and written out one JSON document per line, so memory use
+    # doesn't depend on how many tasks there are
+    query = query.execution_options(stream_results=True).yield_per(
+        app.config['API_STREAM_BATCH_SIZE'])
+    for task in query:
+        yield json.dumps(task_to_dict(task)) + '\n'
+
+# jobs an admin may start through the API
+MAINTENANCE_JOBS = ('rebuild_search_index', 'reconcile_counts')
+
+def job_accepted(job):
+    # 202 with a link to poll for the outcome
+    db.session.commit()
+    response = jsonify(job_to_dict(job))
+    response.status_code = 202
+    response.headers['Location'] = url_for('api.get_job', job_id=job.id)
+    return response
+
+def visible_job(job_id):
+    # admins see every job, everyone else their own
+    job = db.session.query(Job).get(job_id)
+    if job is None or (not is_admin() and job.user_id != current_principal().id):
+        return None
+    return job
+
+def parse_new_task(data):
+    try:
+        name = data['name'].strip()
+        due_date = datetime.datetime.strptime(data['due_date'], '%Y-%m-%d').date()
+        priority = int(data['priority'])
+    except (KeyError, AttributeError, TypeError, ValueError):
+        return None
+    if not name or not 1 <= priority <= 10:
+        return None
+    return name, due_date, priority
+
+
+################
+#### routes ####
+################
+
+@api_blueprint.before_request
+def check_csrf_token():
+    # the API is authenticated by the session cookie, which browsers also
+    # send with cross-site requests, so logged-in writes must carry the
+    # token from /api/csrf-token/ in an X-CSRFToken header
+    if request.method in ('GET', 'HEAD', 'OPTIONS') or not app.config['WTF_CSRF_ENABLED']:
+        return None
+    if current_principal() is None:
+        # left to api_login_required
+        return None
+    if not validate_csrf(request.headers.get('X-CSRFToken', '')):
+        return json_error('The CSRF token is missing or invalid.', 400)
+
+@api_blueprint.route('/csrf-token/', methods=['GET'])
+def csrf_token():
+    return jsonify(csrf_token=generate_csrf())
+
+@api_blueprint.route('/tasks/', methods=['GET'])
+@api_login_required
+def list_tasks():
+    status = request.args.get('status')
+    if status not in (None, 'open', 'closed'):
+        return json_error("status must be 'open' or 'closed'.", 400)
+    try:
+        query = listing_query(status, request.args)
+    except ListingError as e:
+        return json_error(str(e), 400)
+    return Response(
+        stream_with_context(stream_tasks(query)),
+        mimetype='application/x-ndjson'
+    )
+
+@api_blueprint.route('/tasks/<int:task_id>/', methods=['GET'])
+@api_login_required
+def get_task(task_id):
+    task = db.session.query(Task).get(task_id)
+    if task is None:
+        return json_error('That task does not exist.', 404)
+    return jsonify(task_to_dict(task))
+
+@api_blueprint.route('/tasks/', methods=['POST'])
+@api_login_required
+def create_task():
+    fields = parse_new_task(request.get_json(silent=True) or {})
+    if fields is None:
+        return json_error(
+            'name, due_date (YYYY-MM-DD) and priority (1-10) are required.', 400)
+    name, due_date, priority = fields
+    task = Task(
+        name,
+        due_date,
+        priority,
+        datetime.datetime.utcnow(),
+        Task.OPEN,
+        current_principal().id
+    )
+    db.session.add(task)
+    db.session.flush()
+    task_added(task)
+    commit_task_changes('open')
+    response = jsonify(task_to_dict(task))
+    response.status_code = 201
+    return response
+
+@api_blueprint.route('/tasks/<int:task_id>/complete/', methods=['POST'])
+@api_login_required
+def complete_task(task_id):
+    if complete_tasks(writable_task(task_id)):
+        commit_task_changes('open', 'closed')
+        return jsonify(task_id=task_id, result='completed')
+    if task_writable(task_id):
+        # already closed
+        return jsonify(task_id=task_id, result='completed')
+    if task_exists(task_id):
+        return json_error('You can only update tasks that belong to you.', 403)
+    return json_error('That task does not exist.', 404)
+
+@api_blueprint.route('/tasks/<int:task_id>/', methods=['DELETE'])
+@api_login_required
+def delete_task(task_id):
+    if delete_tasks(writable_task(task_id)):
+        commit_task_changes('open', 'closed')
+        return jsonify(task_id=task_id, result='deleted')
+    if task_exists(task_id):
+        return json_error('You can only delete tasks that belong to you.', 403)
+    return json_error('That task does not exist.', 404)
+
+@api_blueprint.route('/tasks/export/', methods=['POST'])
+@api_login_required
+def export_tasks_later():
+    # the export is written by a worker; poll the job, then download it
+    data = request.get_json(silent=True) or {}
+    fmt = data.get('format', 'csv')
+    if fmt not in ('csv', 'jsonl'):
+        return json_error("format must be 'csv' or 'jsonl'.", 400)
+    job = enqueue('export_tasks', dict(
+        format=fmt,
+        gzip=bool(data.get('gzip')),
+        user_id=None if is_admin() else current_principal().id
+    ), user_id=current_principal().id)
+    return job_accepted(job)
+
+@api_blueprint.route('/jobs/', methods=['POST'])
+@api_login_required
+def start_job():
+    if not is_admin():
+        return json_error('Only admins can start maintenance jobs.', 403)
+    kind = (request.get_json(silent=True) or {}).get('kind')
+    if kind not in MAINTENANCE_JOBS:
+        return json_error('kind must be one of: {0}.'.format(', '.join(MAINTENANCE_JOBS)), 400)
+    return job_accepted(enqueue(kind, user_id=current_principal().id))
+
+@api_blueprint.route('/jobs/<int:job_id>/', methods=['GET'])
+@api_login_required
+def get_job(job_id):
+    job = visible_job(job_id)
+    if job is None:
+        return json_error('That job does not exist.', 404)
+    data = job_to_dict(job)
+    if job.status == Job.DONE and data['result'] and data['result'].get('file'):
+        data['download'] = url_for('api.download_job', job_id=job.id)
+    return jsonify(data)
+
+@api_blueprint.route('/jobs/<int:job_id>/download/', methods=['GET'])
+@api_login_required
+def download_job(job_id):
+    job = visible_job(job_id)
+    if job is None:
+        return json_error('That job does not exist.', 404)
+    result = job_to_dict(job)['result'] or {}
+    if job.status != Job.DONE or not result.get('file'):
+        return json_error('That job has no file to download yet.', 409)
+    return send_from_directory(app.config['JOBS_OUTPUT_DIR'], result['file'], as_attachment=True)
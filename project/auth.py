@@ -0,0 +1,165 @@
+# project/auth.py
+
+
+from collections import namedtuple
+from functools import wraps
+
+from flask import flash, g, jsonify, redirect, session, url_for
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, object_session
+
+from project import app, db
+from project.models import User
+
+
+# authentication
+#
+# the session only says who is logged in; what they may do comes from a small
+# Principal loaded from the users table. Principals are cached in-process for
+# AUTH_CACHE_TTL seconds and dropped as soon as this process commits a change
+# to the user row, so role changes and bans apply on the next request here
+# and within the ttl in other processes.
+
+Principal = namedtuple('Principal', ['id', 'role', 'active'])
+
+# cached for ids that no longer exist, so they don't hit the database either
+NO_PRINCIPAL = False
+
+
+def principal_cache():
+    return app.extensions['principal_cache']
+
+def load_principal(user_id):
+    cache = principal_cache()
+    principal = cache.get(user_id)
+    if principal is None:
+        row = db.session.query(User.id, User.role, User.active).filter_by(id=user_id).first()
+        principal = Principal(*row) if row is not None else NO_PRINCIPAL
+        cache.set(user_id, principal)
+    return principal or None
+
+def invalidate_principal(user_id):
+    principal_cache().delete(user_id)
+
+def invalidate_all_principals():
+    # for writes that don't say which users they changed
+    principal_cache().clear()
+
+def current_principal():
+    # loaded at most once per request, and only by views that need it
+    if 'principal' not in g:
+        principal = None
+        if 'logged_in' in session and 'user_id' in session:
+            principal = load_principal(session['user_id'])
+            if principal is not None and not principal.active:
+                principal = None
+        g.principal = principal
+    return g.principal
+
+def is_admin():
+    principal = current_principal()
+    return principal is not None and principal.role == 'admin'
+
+def forget_principal():
+    if 'principal' in g:
+        del g.principal
+
+def revoke_sessions(user_id):
+    # logs the user out everywhere; signed cookie sessions can't be revoked
+    store = getattr(app.session_interface, 'store', None)
+    if store is not None:
+        store.revoke_user(user_id)
+
+def regenerate_session():
+    # server-side sessions get a new id; signed cookie sessions have none
+    regenerate = getattr(session, 'regenerate', None)
+    if regenerate is not None:
+        regenerate()
+
+def log_in(user):
+    regenerate_session()
+    session['logged_in'] = True
+    session['user_id'] = user.id
+    forget_principal()
+
+def log_out():
+    session.pop('logged_in', None)
+    session.pop('user_id', None)
+    session.pop('role', None)
+    regenerate_session()
+    forget_principal()
+
+
+def login_required(test):
+    @wraps(test)
+    def wrap(*args, **kwargs):
+        if current_principal() is not None:
+            return test(*args, **kwargs)
+        else:
+            log_out()
+            flash('You need to login first.')
+            return redirect(url_for('users.login'))
+    return wrap
+
+def api_login_required(test):
+    @wraps(test)
+    def wrap(*args, **kwargs):
+        if current_principal() is not None:
+            return test(*args, **kwargs)
+        else:
+            response = jsonify(error='You need to login first.')
+            response.status_code = 401
+            return response
+    return wrap
+
+
+# changed users are forgotten once the change commits: dropping them at flush
+# time would let a request in between cache the old row again. Users who were
+# banned, deleted or given another role also lose their stored sessions then.
+
+EVERY_USER = object()
+
+def changed_users(session):
+    return session.info.setdefault('changed_users', set())
+
+def revoked_users(session):
+    return session.info.setdefault('revoked_users', set())
+
+@event.listens_for(User, 'after_insert')
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def user_changed(mapper, connection, target):
+    changed_users(object_session(target)).add(target.id)
+
+@event.listens_for(User, 'after_update')
+def user_updated(mapper, connection, target):
+    attrs = inspect(target).attrs
+    if attrs.role.history.has_changes() or attrs.active.history.has_changes():
+        revoked_users(object_session(target)).add(target.id)
+
+@event.listens_for(User, 'after_delete')
+def user_deleted(mapper, connection, target):
+    revoked_users(object_session(target)).add(target.id)
+
+@event.listens_for(Session, 'after_bulk_update')
+@event.listens_for(Session, 'after_bulk_delete')
+def users_changed(context):
+    # Query.update() / delete() on users
+    if context.mapper.class_ is User:
+        changed_users(context.session).add(EVERY_USER)
+
+@event.listens_for(Session, 'after_commit')
+def forget_changed_users(session):
+    changed = session.info.pop('changed_users', ())
+    if EVERY_USER in changed:
+        invalidate_all_principals()
+    else:
+        for user_id in changed:
+            invalidate_principal(user_id)
+    for user_id in session.info.pop('revoked_users', ()):
+        revoke_sessions(user_id)
+
+@event.listens_for(Session, 'after_rollback')
+def keep_unchanged_users(session):
+    session.info.pop('changed_users', None)
+    session.info.pop('revoked_users', None)
@@ -0,0 +1,129 @@
+# project/cache.py
+
+
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+
+# result caches
+#
+# both backends share one small interface:
+#
+#   get(key)               -> value, or None on a miss or after the ttl
+#   set(key, value, ttl)   -> stores value for ttl seconds
+#   delete(key)
+#   incr(key) / counter(key)
+#                          -> named counters that are never evicted; cached
+#                             keys embed a counter ("generation") so bumping
+#                             it invalidates every entry built from it at once
+#   clear()
+
+
+class LocalCache(object):
+
+    # in-process cache with a per-entry ttl and least-recently-used eviction
+    # once max_entries is reached
+
+    def __init__(self, max_entries=1024, default_ttl=60):
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self._entries = OrderedDict()
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.time():
+                return None
+            # re-insert to mark it as most recently used
+            self._entries[key] = entry
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires = time.time() + (self.default_ttl if ttl is None else ttl)
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (expires, value)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def incr(self, key):
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+    def counter(self, key):
+        return self._counters.get(key, 0)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._counters.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RedisCache(object):
+
+    # works with any client exposing redis-py's get / set(ex=) / incr /
+    # delete / scan_iter, so a fake can stand in for it in the tests
+
+    def __init__(self, client, prefix='flasktaskr:', default_ttl=60):
+        self.client = client
+        self.prefix = prefix
+        self.default_ttl = default_ttl
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return None if value is None else pickle.loads(value)
+
+    def set(self, key, value, ttl=None):
+        self.client.set(
+            self.prefix + key,
+            pickle.dumps(value, pickle.HIGHEST_PROTOCOL),
+            ex=self.default_ttl if ttl is None else ttl
+        )
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+    def incr(self, key):
+        return int(self.client.incr(self.prefix + 'counter:' + key))
+
+    def counter(self, key):
+        return int(self.client.get(self.prefix + 'counter:' + key) or 0)
+
+    def clear(self):
+        keys = list(self.client.scan_iter(match=self.prefix + '*'))
+        if keys:
+            self.client.delete(*keys)
+
+
+def make_cache(config, prefix='flasktaskr:'):
+    # `prefix` keeps separate caches on one Redis apart, so clearing one
+    # leaves the others alone; no prefix may start with another
+    if config['TASK_CACHE'] == 'redis':
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("TASK_CACHE = 'redis' needs the redis package installed")
+        return RedisCache(
+            redis.StrictRedis.from_url(config['TASK_CACHE_REDIS_URL']),
+            prefix=prefix,
+            default_ttl=config['TASK_CACHE_TTL']
+        )
+    return LocalCache(
+        max_entries=config['TASK_CACHE_MAX_ENTRIES'],
+        default_ttl=config['TASK_CACHE_TTL']
+    )
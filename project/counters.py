@@ -0,0 +1,216 @@
+# project/counters.py
+
+
+import datetime
+
+from sqlalchemy import and_, bindparam, case, event, func, select
+
+from project import db
+from project.models import Task, TaskCount, User
+
+
+# per-user task counts
+#
+# task_counts holds each user's open, closed and overdue totals, so the task
+# page reads them with one primary key lookup instead of counting tasks. A
+# user's row is inserted together with the user, and the views adjust it with
+# an UPDATE in the same transaction as the write it describes. Overdue
+# changes with the calendar rather than with writes, so a row counts the open
+# tasks due before its `overdue_as_of` date; reads add an indexed count of
+# the tasks that have fallen due since, and reconcile_counts() moves the date
+# forward. It also recounts everything in one pass, creates rows for users
+# added behind the app's back, and reports any rows that had drifted, e.g.
+# after raw SQL against tasks.
+
+def today():
+    return datetime.datetime.utcnow().date()
+
+
+def count_query(as_of, user_id=None):
+    # (user_id, open, closed, overdue) per user, straight from tasks
+    tasks = Task.__table__
+    is_open = tasks.c.status == Task.OPEN
+    query = select([
+        tasks.c.user_id,
+        func.sum(case([(is_open, 1)], else_=0)),
+        func.sum(case([(is_open, 0)], else_=1)),
+        func.sum(case([(and_(is_open, tasks.c.due_date < as_of), 1)], else_=0)),
+    ]).where(tasks.c.user_id != None).group_by(tasks.c.user_id)
+    if user_id is not None:
+        query = query.where(tasks.c.user_id == user_id)
+    return query
+
+
+def newly_due(as_of):
+    # the open tasks that fell due between a task_counts row's overdue_as_of
+    # and `as_of`, correlated to that row
+    tasks, counts = Task.__table__, TaskCount.__table__
+    return select([func.count()]).where(and_(
+        tasks.c.user_id == counts.c.user_id,
+        tasks.c.status == Task.OPEN,
+        tasks.c.due_date >= counts.c.overdue_as_of,
+        tasks.c.due_date < as_of,
+    )).as_scalar()
+
+
+def roll_forward(connection, as_of, user_id=None):
+    # adds newly_due() to the overdue counts and moves their date to `as_of`
+    counts = TaskCount.__table__
+    update = counts.update().where(counts.c.overdue_as_of < as_of)
+    if user_id is not None:
+        update = update.where(counts.c.user_id == user_id)
+    connection.execute(
+        update.values(overdue=counts.c.overdue + newly_due(as_of), overdue_as_of=as_of))
+
+
+def adjust(user_id, open=0, closed=0, overdue=0, due_date=None):
+    # `due_date` is that of a new open task, counted as overdue if it falls
+    # before the row's overdue_as_of. A missing row is left to
+    # reconcile_counts(); task_summary() counts tasks until then
+    counts = TaskCount.__table__
+    overdue = counts.c.overdue + overdue
+    if due_date is not None:
+        overdue = overdue + case([(counts.c.overdue_as_of > due_date, 1)], else_=0)
+    db.session.execute(counts.update().where(counts.c.user_id == user_id).values(
+        open=counts.c.open + open, closed=counts.c.closed + closed, overdue=overdue))
+
+
+def task_added(task):
+    # call after the new task has been flushed
+    if task.user_id is not None:
+        adjust(task.user_id, open=1, due_date=task.due_date)
+
+
+def tasks_changing(query):
+    # the tasks `query` is about to complete or delete, grouped by owner and
+    # status: [(user_id, status, tasks, overdue), ...]; read just before the
+    # write, in the same transaction
+    overdue = func.sum(case([(Task.due_date < TaskCount.overdue_as_of, 1)], else_=0))
+    return query.outerjoin(TaskCount, TaskCount.user_id == Task.user_id).with_entities(
+        Task.user_id, Task.status, func.count(Task.task_id), overdue
+    ).group_by(Task.user_id, Task.status).all()
+
+
+def recount(user_ids):
+    # overwrites the users' rows with a fresh count of their tasks
+    as_of = today()
+    counts = TaskCount.__table__
+    found = dict((row[0], tuple(row[1:])) for row in db.session.execute(
+        count_query(as_of).where(Task.__table__.c.user_id.in_(user_ids))))
+    for user_id in user_ids:
+        values = found.get(user_id, (0, 0, 0))
+        db.session.execute(counts.update().where(counts.c.user_id == user_id).values(
+            open=values[0], closed=values[1], overdue=values[2], overdue_as_of=as_of))
+
+
+def changes_applied(changes, rowcount):
+    # False if the write touched fewer tasks than `changes` saw, i.e. another
+    # transaction got to some of them in between; the owners are then
+    # recounted rather than adjusted by numbers that no longer hold
+    if rowcount == sum(tasks for user_id, status, tasks, overdue in changes):
+        return True
+    recount(sorted(set(user_id for user_id, status, tasks, overdue in changes
+                       if user_id is not None)))
+    return False
+
+
+def tasks_completed(changes, completed):
+    # `changes` must only cover open tasks; `completed` is the UPDATE's rowcount
+    if not changes_applied(changes, completed):
+        return
+    for user_id, status, tasks, overdue in changes:
+        if user_id is not None and status == Task.OPEN:
+            adjust(user_id, open=-tasks, closed=tasks, overdue=-(overdue or 0))
+
+
+def tasks_deleted(changes, deleted):
+    # `deleted` is the DELETE's rowcount
+    if not changes_applied(changes, deleted):
+        return
+    for user_id, status, tasks, overdue in changes:
+        if user_id is None:
+            continue
+        if status == Task.OPEN:
+            adjust(user_id, open=-tasks, overdue=-(overdue or 0))
+        else:
+            adjust(user_id, closed=-tasks)
+
+
+def task_summary(user_id):
+    # {'open': ..., 'closed': ..., 'overdue': ...} for the task page header;
+    # reads only, so a page view never writes
+    as_of = today()
+    row = db.session.query(
+        TaskCount.open, TaskCount.closed, TaskCount.overdue, TaskCount.overdue_as_of
+    ).filter(TaskCount.user_id == user_id).first()
+    if row is None:
+        # no row until reconcile_counts() runs; count the tasks themselves
+        found = db.session.execute(count_query(as_of, user_id)).first()
+        values = tuple(found)[1:] if found is not None else (0, 0, 0)
+        return dict(open=values[0], closed=values[1], overdue=values[2])
+    overdue = row.overdue
+    if row.overdue_as_of < as_of:
+        overdue += db.session.query(func.count(Task.task_id)).filter(
+            Task.user_id == user_id,
+            Task.status == Task.OPEN,
+            Task.due_date >= row.overdue_as_of,
+            Task.due_date < as_of
+        ).scalar()
+    return dict(open=row.open, closed=row.closed, overdue=overdue)
+
+
+def reconcile_counts(engine, fix=True):
+    # recounts every user's tasks in one pass and compares the result with
+    # task_counts. Returns [(user_id, stored, actual), ...] for the rows that
+    # differ, each an (open, closed, overdue) tuple (stored is None for a
+    # missing row), and corrects them unless `fix` is False. With `fix` False
+    # nothing is written: stored overdue counts are rolled forward in the
+    # query instead
+    as_of = today()
+    counts = TaskCount.__table__
+    with engine.begin() as connection:
+        if fix:
+            # writing first takes the write lock before anything is read
+            roll_forward(connection, as_of)
+        actual = dict((row[0], tuple(row[1:])) for row in connection.execute(count_query(as_of)))
+        # users without tasks still get a row
+        for row in connection.execute(select([User.__table__.c.id])):
+            actual.setdefault(row.id, (0, 0, 0))
+        overdue = counts.c.overdue + case(
+            [(counts.c.overdue_as_of < as_of, newly_due(as_of))], else_=0)
+        stored = dict((row[0], tuple(row[1:])) for row in connection.execute(
+            select([counts.c.user_id, counts.c.open, counts.c.closed, overdue])))
+        drift = []
+        for user_id in sorted(set(actual) | set(stored)):
+            values = actual.get(user_id, (0, 0, 0))
+            if stored.get(user_id) != values:
+                drift.append((user_id, stored.get(user_id), values))
+        if fix:
+            fix_counts(connection, drift, as_of)
+    return drift
+
+
+def fix_counts(connection, drift, as_of):
+    counts = TaskCount.__table__
+    updates = [dict(counted_user=user_id, counted_open=values[0], counted_closed=values[1],
+                    counted_overdue=values[2], counted_as_of=as_of)
+               for user_id, stored, values in drift if stored is not None]
+    if updates:
+        connection.execute(counts.update().where(
+            counts.c.user_id == bindparam('counted_user')
+        ).values(
+            open=bindparam('counted_open'), closed=bindparam('counted_closed'),
+            overdue=bindparam('counted_overdue'), overdue_as_of=bindparam('counted_as_of')
+        ), updates)
+    inserts = [dict(user_id=user_id, open=values[0], closed=values[1], overdue=values[2],
+                    overdue_as_of=as_of)
+               for user_id, stored, values in drift if stored is None]
+    if inserts:
+        connection.execute(counts.insert(), inserts)
+
+
+@event.listens_for(User, 'after_insert')
+def count_new_user(mapper, connection, target):
+    # created with the user, so later writes never race to insert it
+    connection.execute(TaskCount.__table__.insert().values(
+        user_id=target.id, open=0, closed=0, overdue=0, overdue_as_of=today()))
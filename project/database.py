@@ -0,0 +1,41 @@
+# project/database.py
+
+
+import sqlite3
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import DisconnectionError
+from sqlalchemy.pool import Pool
+
+from project import app
+
+
+# connection setup
+#
+# SQLite keeps most tuning knobs per connection, so they have to be applied
+# every time the pool opens a new one; see SQLITE_PRAGMAS in _config.py.
+# For server databases, DATABASE_POOL_PRE_PING checks pooled connections on
+# checkout; raising DisconnectionError makes the pool reconnect and retry
+
+
+@event.listens_for(Engine, 'connect')
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    for name, value in app.config.get('SQLITE_PRAGMAS', ()):
+        cursor.execute('PRAGMA {0} = {1}'.format(name, value))
+    cursor.close()
+
+
+@event.listens_for(Pool, 'checkout')
+def ping_connection(dbapi_connection, connection_record, connection_proxy):
+    if not app.config.get('DATABASE_POOL_PRE_PING'):
+        return
+    try:
+        cursor = dbapi_connection.cursor()
+        cursor.execute('SELECT 1')
+        cursor.close()
+    except Exception:
+        raise DisconnectionError()
@@ -0,0 +1,99 @@
+# project/exporter.py
+
+
+import csv
+import io
+import json
+import zlib
+
+from project import app, db
+from project.models import Task, User
+
+
+# streaming export of tasks as CSV or JSON Lines
+#
+# rows come from a plain column query read through yield_per (a server-side
+# cursor where the driver has one) and leave as a generator of byte chunks,
+# so memory stays flat however many tasks there are. The columns match what
+# db_import.py reads, so an export can be loaded straight back in.
+
+EXPORT_FIELDS = ('task_id', 'name', 'due_date', 'priority', 'posted_date', 'status', 'poster')
+
+# rows per chunk handed to the response / file
+EXPORT_CHUNK_ROWS = 500
+
+
+def export_query(user_id=None):
+    query = db.session.query(
+        Task.task_id, Task.name, Task.due_date, Task.priority, Task.posted_date,
+        Task.status, User.name
+    ).outerjoin(User, Task.user_id == User.id).order_by(Task.task_id)
+    if user_id is not None:
+        query = query.filter(Task.user_id == user_id)
+    return query.execution_options(stream_results=True).yield_per(
+        app.config['API_STREAM_BATCH_SIZE'])
+
+
+def export_values(row):
+    task_id, name, due_date, priority, posted_date, status, poster = row
+    return (
+        task_id,
+        name,
+        due_date.isoformat(),
+        priority,
+        posted_date.isoformat() if posted_date else None,
+        'open' if status == Task.OPEN else 'closed',
+        poster,
+    )
+
+
+def to_bytes(chunk):
+    return chunk.encode('utf-8') if not isinstance(chunk, bytes) else chunk
+
+
+def csv_chunks(rows):
+    # the python 2 csv module only writes bytes, python 3's only text
+    py2 = str is bytes
+    buffer = io.BytesIO() if py2 else io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_FIELDS)
+    count = 0
+    for row in rows:
+        values = ['' if value is None else value for value in export_values(row)]
+        if py2:
+            values = [to_bytes(value) if isinstance(value, type(u'')) else value
+                      for value in values]
+        writer.writerow(values)
+        count += 1
+        if count % EXPORT_CHUNK_ROWS == 0:
+            yield to_bytes(buffer.getvalue())
+            buffer.seek(0)
+            buffer.truncate()
+    yield to_bytes(buffer.getvalue())
+
+
+def jsonl_chunks(rows):
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(dict(zip(EXPORT_FIELDS, export_values(row)))))
+        if len(lines) == EXPORT_CHUNK_ROWS:
+            yield to_bytes('\n'.join(lines) + '\n')
+            lines = []
+    if lines:
+        yield to_bytes('\n'.join(lines) + '\n')
+
+
+def gzip_chunks(chunks):
+    # wbits 16 + MAX_WBITS writes a gzip header and trailer around the stream
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def export_tasks(fmt='csv', user_id=None, compress=False):
+    rows = export_query(user_id)
+    chunks = csv_chunks(rows) if fmt == 'csv' else jsonl_chunks(rows)
+    return gzip_chunks(chunks) if compress else chunks
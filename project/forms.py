@@ -5,6 +5,8 @@ from flask_wtf import Form
 from wtforms import StringField, DateField, IntegerField, SelectField, PasswordField
 from wtforms.validators import DataRequired, Length, EqualTo, Email
 
+from models import Task
+
 
 class AddTaskForm(Form):
     task_id = IntegerField()
@@ -25,7 +27,7 @@ class AddTaskForm(Form):
             ('9', '9'), ('10', '10')
         ]
     )
-    status = IntegerField('Status')
+    status = IntegerField('Status', default=Task.OPEN)
 
 
 class RegisterForm(Form):
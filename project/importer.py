@@ -0,0 +1,259 @@
+# project/importer.py
+
+
+import csv
+import datetime
+import io
+import itertools
+import json
+
+from sqlalchemy.exc import IntegrityError
+
+from project import db
+from project.auth import invalidate_all_principals
+from project.counters import reconcile_counts
+from project.models import Task, User
+from project.schema import create_missing_indexes
+from project.search import index_tasks_after
+from project.tasks.views import bump_version
+from project.users.passwords import hash_plaintext_passwords, is_hashed
+
+
+# bulk import of users and tasks from CSV or JSON Lines
+#
+# records are read lazily and inserted CHUNK_SIZE at a time with one Core
+# executemany per chunk, each chunk in its own transaction, so memory stays
+# bounded however big the file is. A chunk that breaks a constraint (say a
+# duplicate user) is retried row by row, and only the offending records are
+# rejected. Task posters are given by name and resolved through a
+# name -> id map that is loaded once up front.
+#
+#   users: name, email, password[, role]
+#   tasks: name, due_date, priority, poster[, status, posted_date]
+#          (or user_id instead of poster)
+
+CHUNK_SIZE = 20000
+
+DATE_FORMATS = ('%Y-%m-%d', '%m/%d/%Y')
+
+STATUSES = {
+    'open': Task.OPEN, '1': Task.OPEN,
+    'closed': Task.CLOSED, '0': Task.CLOSED,
+}
+
+
+try:
+    string_types = basestring
+except NameError:
+    string_types = str
+
+
+class RejectedRecord(ValueError):
+    pass
+
+
+def open_input(path):
+    # the python 2 csv module wants bytes; values are decoded in text()
+    if str is bytes:
+        return open(path, 'rb')
+    return io.open(path, newline='', encoding='utf-8')
+
+
+def read_records(lines, fmt):
+    # a line that isn't JSON becomes a RejectedRecord, rejected in its turn
+    if fmt == 'csv':
+        return csv.DictReader(lines)
+    return (parse_line(line) for line in lines if line.strip())
+
+
+def parse_line(line):
+    try:
+        return json.loads(line)
+    except ValueError as error:
+        return RejectedRecord('bad JSON: {0}'.format(error))
+
+
+def text(value):
+    if value is None:
+        return None
+    if isinstance(value, bytes):
+        value = value.decode('utf-8')
+    if not isinstance(value, string_types):
+        raise RejectedRecord('expected text, got {0!r}'.format(value))
+    return value.strip()
+
+
+# strptime dominates the cost of a task row, and real data has few distinct
+# dates, so parsed dates are memoized
+_parsed_dates = {}
+
+def parse_date(value):
+    if isinstance(value, datetime.date):
+        return value
+    if not isinstance(value, string_types):
+        # JSON may hold numbers, lists or objects, which can't be memo keys
+        raise RejectedRecord('bad date {0!r}'.format(value))
+    date = _parsed_dates.get(value)
+    if date is not None:
+        return date
+    for fmt in DATE_FORMATS:
+        try:
+            date = datetime.datetime.strptime(text(value), fmt).date()
+        except ValueError:
+            continue
+        if len(_parsed_dates) < 100000:
+            _parsed_dates[value] = date
+        return date
+    raise RejectedRecord('bad date {0!r}'.format(value))
+
+
+def parse_status(value):
+    if value is None or value == '':
+        return Task.OPEN
+    if isinstance(value, int):
+        value = str(value)
+    status = STATUSES.get(text(value).lower())
+    if status is None:
+        raise RejectedRecord('bad status {0!r}'.format(value))
+    return status
+
+
+def user_row(record):
+    name, email, password = (text(record.get(key)) for key in ('name', 'email', 'password'))
+    if not (name and email and password):
+        raise RejectedRecord('name, email and password are required')
+    return dict(name=name, email=email, password=password,
+                role=text(record.get('role')) or 'user')
+
+
+def task_row(record, user_ids, today):
+    name = text(record.get('name'))
+    if not name:
+        raise RejectedRecord('name is required')
+    if record.get('user_id'):
+        try:
+            user_id = int(record['user_id'])
+        except (TypeError, ValueError):
+            raise RejectedRecord('bad user_id {0!r}'.format(record['user_id']))
+    else:
+        user_id = user_ids.get(text(record.get('poster')))
+        if user_id is None:
+            raise RejectedRecord('unknown poster {0!r}'.format(record.get('poster')))
+    try:
+        priority = int(record.get('priority'))
+    except (TypeError, ValueError):
+        priority = None
+    if priority is None or not 1 <= priority <= 10:
+        raise RejectedRecord('bad priority {0!r}'.format(record.get('priority')))
+    posted = record.get('posted_date')
+    return dict(
+        name=name,
+        due_date=parse_date(record.get('due_date')),
+        priority=priority,
+        posted_date=parse_date(posted) if posted else today,
+        status=parse_status(record.get('status')),
+        user_id=user_id,
+    )
+
+
+class ImportResult(object):
+
+    def __init__(self):
+        self.imported = 0
+        self.rejected = 0
+        # (record number, reason) for the first few bad records
+        self.errors = []
+
+    def reject(self, number, error):
+        self.rejected += 1
+        if len(self.errors) < 20:
+            self.errors.append((number, str(error)))
+
+
+def bulk_insert(table, records, convert, chunk_size=CHUNK_SIZE, progress=None):
+    result = ImportResult()
+    numbered = enumerate(records, 1)
+    while True:
+        chunk = list(itertools.islice(numbered, chunk_size))
+        if not chunk:
+            return result
+        rows = []
+        for number, record in chunk:
+            try:
+                if isinstance(record, RejectedRecord):
+                    raise record
+                if not isinstance(record, dict):
+                    raise RejectedRecord('not an object: {0!r}'.format(record))
+                rows.append((number, convert(record)))
+            except RejectedRecord as error:
+                result.reject(number, error)
+        if rows:
+            try:
+                with db.engine.begin() as connection:
+                    connection.execute(table.insert(), [row for number, row in rows])
+                result.imported += len(rows)
+            except IntegrityError:
+                insert_rows(table, rows, result)
+        if progress is not None:
+            progress(result)
+
+
+def insert_rows(table, rows, result):
+    # one transaction per row, to find the ones a chunk failed on
+    for number, row in rows:
+        try:
+            with db.engine.begin() as connection:
+                connection.execute(table.insert(), row)
+        except IntegrityError as error:
+            result.reject(number, error.orig)
+        else:
+            result.imported += 1
+
+
+def import_users(records, chunk_size=CHUNK_SIZE, progress=None):
+    # plaintext passwords are hashed afterwards, in parallel and in batches
+    plaintext = []
+
+    def convert(record):
+        row = user_row(record)
+        if not plaintext and not is_hashed(row['password']):
+            plaintext.append(True)
+        return row
+
+    result = bulk_insert(User.__table__, records, convert, chunk_size, progress)
+    if plaintext:
+        hash_plaintext_passwords()
+    # Core inserts skip the mapper events that give each user a counts row
+    # and drop cached principals (ids cached as missing may exist now)
+    reconcile_counts(db.engine)
+    invalidate_all_principals()
+    return result
+
+
+def import_tasks(records, chunk_size=CHUNK_SIZE, progress=None, defer_indexes=False):
+    # with defer_indexes the secondary indexes are dropped for the load and
+    # rebuilt once at the end, which beats updating them row by row
+    user_ids = dict(db.session.query(User.name, User.id))
+    # ids only grow, so everything imported lands above this one
+    last_id = db.session.query(db.func.max(Task.task_id)).scalar() or 0
+    db.session.remove()
+    today = datetime.date.today()
+    table = Task.__table__
+    if defer_indexes:
+        for index in table.indexes:
+            index.drop(db.engine)
+    try:
+        result = bulk_insert(
+            table, records, lambda record: task_row(record, user_ids, today),
+            chunk_size, progress)
+    finally:
+        if defer_indexes:
+            create_missing_indexes(db.engine, db.metadata)
+    # Core inserts skip the mapper events that keep task_terms current
+    index_tasks_after(db.engine, last_id)
+    # new rows change the listings, so their version stamp moves too, and
+    # the per-user counts are recounted in one pass rather than row by row
+    bump_version('tasks')
+    db.session.commit()
+    reconcile_counts(db.engine)
+    return result
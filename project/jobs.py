@@ -0,0 +1,299 @@
+# project/jobs.py
+
+
+import datetime
+import json
+import multiprocessing
+import os
+import random
+import signal
+import threading
+import time
+
+from sqlalchemy import and_, select
+
+from project import app, db
+from project.counters import reconcile_counts
+from project.exporter import export_tasks
+from project.models import Job
+from project.search import rebuild_search_index
+
+
+# background jobs
+#
+# the queue is the jobs table, so nothing beyond the database is needed.
+# enqueue() adds a job to the caller's session, which makes it visible to
+# workers only when the request's own transaction commits. db_worker.py runs
+# a pool of worker processes. Each worker claims the oldest due job with a
+# conditional UPDATE, so two workers can't both claim it. A claim hides the
+# job for its `timeout` seconds: a worker that dies mid-job leaves the job to
+# be claimed again once the claim lapses, while a live worker keeps its claim
+# by extending it every third of the timeout. A failed job is retried after an
+# exponential, jittered backoff until it runs out of attempts. Handlers may
+# therefore run more than once, and must be safe to repeat.
+
+HANDLERS = {}
+
+
+class ClaimLost(Exception):
+    # raised by a handler that finds another worker has taken its job over
+    pass
+
+
+def handler(kind):
+    def register(function):
+        HANDLERS[kind] = function
+        return function
+    return register
+
+
+def utcnow():
+    return datetime.datetime.utcnow()
+
+
+def enqueue(kind, payload=None, user_id=None, delay=0, max_attempts=None, timeout=None):
+    if kind not in HANDLERS:
+        raise ValueError('unknown job kind: {0}'.format(kind))
+    now = utcnow()
+    job = Job(
+        kind=kind,
+        payload=json.dumps(payload or {}),
+        user_id=user_id,
+        status=Job.QUEUED,
+        attempts=0,
+        max_attempts=max_attempts or app.config['JOBS_MAX_ATTEMPTS'],
+        timeout=timeout or app.config['JOBS_VISIBILITY_TIMEOUT'],
+        run_at=now + datetime.timedelta(seconds=delay),
+        created=now
+    )
+    db.session.add(job)
+    return job
+
+
+def retry_delay(attempts):
+    # seconds to wait after the `attempts`th failure
+    delay = min(app.config['JOBS_RETRY_BASE_SECONDS'] * 2 ** (attempts - 1),
+                app.config['JOBS_RETRY_MAX_SECONDS'])
+    return delay * random.uniform(0.5, 1.0)
+
+
+def claim(now=None):
+    # returns the claimed job's row (attempts already counted) or None
+    jobs = Job.__table__
+    now = now or utcnow()
+    while True:
+        row = db.engine.execute(select([jobs]).where(and_(
+            jobs.c.status.in_([Job.QUEUED, Job.RUNNING]), jobs.c.run_at <= now
+        )).order_by(jobs.c.run_at).limit(1)).first()
+        if row is None:
+            return None
+        if row.status == Job.RUNNING and row.attempts >= row.max_attempts:
+            # the worker running its last attempt never reported back
+            finish(row, Job.FAILED, now, error='timed out after {0} attempts'.format(row.attempts))
+            continue
+        claimed = db.engine.execute(jobs.update().where(and_(
+            jobs.c.id == row.id, jobs.c.status == row.status, jobs.c.attempts == row.attempts
+        )).values(
+            status=Job.RUNNING,
+            attempts=row.attempts + 1,
+            run_at=now + datetime.timedelta(seconds=row.timeout)
+        )).rowcount
+        if claimed:
+            return db.engine.execute(select([jobs]).where(jobs.c.id == row.id)).first()
+
+
+def finish(job, status, now, result=None, error=None, run_at=None):
+    # only the holder of the current claim (same attempt) may record an outcome
+    jobs = Job.__table__
+    values = dict(status=status, last_error=error)
+    if status in (Job.DONE, Job.FAILED):
+        values['finished'] = now
+        values['result'] = json.dumps(result) if result is not None else None
+    if run_at is not None:
+        values['run_at'] = run_at
+    return db.engine.execute(jobs.update().where(and_(
+        jobs.c.id == job.id, jobs.c.attempts == job.attempts, jobs.c.status == job.status
+    )).values(**values)).rowcount
+
+
+def extend_claim(job):
+    # pushes the lapse of a running job's claim a full timeout away; returns
+    # False once the claim has passed to another attempt
+    jobs = Job.__table__
+    return bool(db.engine.execute(jobs.update().where(and_(
+        jobs.c.id == job.id, jobs.c.attempts == job.attempts, jobs.c.status == Job.RUNNING
+    )).values(run_at=utcnow() + datetime.timedelta(seconds=job.timeout))).rowcount)
+
+
+def holds_claim(job):
+    jobs = Job.__table__
+    row = db.engine.execute(select([jobs.c.status, jobs.c.attempts]).where(
+        jobs.c.id == job.id)).first()
+    return row is not None and row.status == Job.RUNNING and row.attempts == job.attempts
+
+
+def start_heartbeat(job, done):
+    # daemon thread that extends the job's claim until `done` is set
+    def beat():
+        while not done.wait(job.timeout / 3.0):
+            try:
+                if not extend_claim(job):
+                    return
+            except Exception:
+                app.logger.exception('job %s heartbeat failed', job.id)
+    thread = threading.Thread(target=beat, name='job-{0}-heartbeat'.format(job.id))
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+def run_handler(function, job):
+    done = threading.Event()
+    heartbeat = start_heartbeat(job, done)
+    try:
+        return function(job, json.loads(job.payload))
+    finally:
+        done.set()
+        heartbeat.join()
+
+
+def run_one(now=None):
+    # claims and runs one job; returns it, or None when nothing is due
+    job = claim(now)
+    if job is None:
+        return None
+    function = HANDLERS.get(job.kind)
+    with app.app_context():
+        try:
+            if function is None:
+                raise LookupError('unknown job kind: {0}'.format(job.kind))
+            result = run_handler(function, job)
+        except Exception as e:
+            db.session.rollback()
+            app.logger.exception('job %s (%s) failed on attempt %s', job.id, job.kind, job.attempts)
+            error = '{0}: {1}'.format(type(e).__name__, e)
+            now = utcnow() if now is None else now
+            if function is not None and job.attempts < job.max_attempts:
+                finish(job, Job.QUEUED, now, error=error,
+                       run_at=now + datetime.timedelta(seconds=retry_delay(job.attempts)))
+            else:
+                finish(job, Job.FAILED, now, error=error)
+        else:
+            finish(job, Job.DONE, utcnow() if now is None else now, result=result)
+    return job
+
+
+def purge_finished(now=None):
+    # deletes finished jobs older than JOBS_KEEP_SECONDS, with their files
+    jobs = Job.__table__
+    cutoff = (now or utcnow()) - datetime.timedelta(seconds=app.config['JOBS_KEEP_SECONDS'])
+    rows = db.engine.execute(select([jobs.c.id, jobs.c.result]).where(and_(
+        jobs.c.status.in_([Job.DONE, Job.FAILED]), jobs.c.finished < cutoff))).fetchall()
+    for row in rows:
+        filename = (json.loads(row.result) or {}).get('file') if row.result else None
+        if filename:
+            try:
+                os.remove(os.path.join(app.config['JOBS_OUTPUT_DIR'], filename))
+            except OSError:
+                pass
+    if rows:
+        db.engine.execute(jobs.delete().where(jobs.c.id.in_([row.id for row in rows])))
+    return len(rows)
+
+
+def work(stop, parent, poll_seconds=None):
+    # the loop of one worker process; runs until `stop` is set or the parent
+    # process goes away
+    poll_seconds = poll_seconds or app.config['JOBS_POLL_SECONDS']
+    # connections must not be shared with the parent process
+    db.engine.dispose()
+    # ctrl-c / SIGTERM stop the pool through `stop`, after the current job
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    last_purge = 0
+    while not stop.is_set() and os.getppid() == parent:
+        try:
+            if time.time() - last_purge > 60:
+                purge_finished()
+                last_purge = time.time()
+            job = run_one()
+        except Exception:
+            # e.g. the database was locked for longer than busy_timeout
+            app.logger.exception('job worker')
+            job = None
+        if job is None:
+            stop.wait(poll_seconds)
+
+
+def run_workers(count=None):
+    count = count or app.config['JOBS_WORKERS']
+    stop = multiprocessing.Event()
+    # a signal handler must not call stop.set(): it may interrupt a wait on
+    # the same event and block on its lock
+    signals = []
+    signal.signal(signal.SIGTERM, lambda signum, frame: signals.append(signum))
+    processes = [multiprocessing.Process(target=work, args=(stop, os.getpid()),
+                                         name='job-worker-{0}'.format(i))
+                 for i in range(count)]
+    for process in processes:
+        process.start()
+    try:
+        while not signals and any(process.is_alive() for process in processes):
+            time.sleep(0.5)
+    except KeyboardInterrupt:
+        pass
+    stop.set()
+    for process in processes:
+        process.join()
+
+
+def job_to_dict(job):
+    return dict(
+        job_id=job.id,
+        kind=job.kind,
+        status=job.status,
+        attempts=job.attempts,
+        created=job.created.isoformat(),
+        finished=job.finished.isoformat() if job.finished else None,
+        result=json.loads(job.result) if job.result else None,
+        error=job.last_error
+    )
+
+
+# handlers: called as handler(job, payload) inside an app context; the
+# return value is stored as the job's JSON result
+
+@handler('export_tasks')
+def export_tasks_job(job, payload):
+    # payload: format, gzip, user_id (None for every task)
+    fmt = payload.get('format', 'csv')
+    compress = bool(payload.get('gzip'))
+    directory = app.config['JOBS_OUTPUT_DIR']
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    filename = 'tasks-{0}.{1}{2}'.format(job.id, fmt, '.gz' if compress else '')
+    path = os.path.join(directory, filename)
+    # written under a name of this attempt's own, so neither a partial file
+    # nor a lapsed attempt still writing ever takes the final name
+    part = '{0}.{1}.part'.format(path, job.attempts)
+    try:
+        with open(part, 'wb') as out:
+            for chunk in export_tasks(fmt, payload.get('user_id'), compress):
+                out.write(chunk)
+        if not holds_claim(job):
+            raise ClaimLost('job {0} attempt {1} lost its claim'.format(job.id, job.attempts))
+        os.rename(part, path)
+    except Exception:
+        if os.path.exists(part):
+            os.remove(part)
+        raise
+    return dict(file=filename, bytes=os.path.getsize(path))
+
+@handler('rebuild_search_index')
+def rebuild_search_index_job(job, payload):
+    rebuild_search_index(db.engine)
+    return {}
+
+@handler('reconcile_counts')
+def reconcile_counts_job(job, payload):
+    return dict(drifted=len(reconcile_counts(db.engine)))
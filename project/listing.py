@@ -0,0 +1,125 @@
+# project/listing.py
+
+
+import datetime
+
+from sqlalchemy.orm import joinedload
+
+from project import db
+from project.models import Task, User
+
+
+# filtered and sorted task listings
+#
+# every accepted combination of filters and sort is answered by walking a
+# single index: the equality filters (status, plus the owner when given) are
+# its leading columns and the sort key follows them. A range filter is only
+# accepted on the column being sorted by, where it becomes a seek into the
+# index rather than a test applied to row after row. Anything else raises
+# ListingError instead of quietly scanning the table.
+
+SORTS = {
+    'due': (Task.due_date, Task.task_id),
+    'priority': (Task.priority, Task.task_id),
+    'posted': (Task.posted_date, Task.task_id),
+}
+
+# (filtered by owner, sort) -> the index that serves it
+INDEXES = {
+    (False, 'due'): 'ix_tasks_status_due_date_task_id',
+    (False, 'priority'): 'ix_tasks_status_priority_task_id',
+    (False, 'posted'): 'ix_tasks_status_posted_date_task_id',
+    (True, 'due'): 'ix_tasks_user_id_status_due_date_task_id',
+    (True, 'priority'): 'ix_tasks_user_id_status_priority_task_id',
+    (True, 'posted'): 'ix_tasks_user_id_status_posted_date_task_id',
+}
+
+# range filters: parameter -> (the sort it needs, lower or upper bound)
+RANGES = {
+    'due_after': ('due', 'low'),
+    'due_before': ('due', 'high'),
+    'priority_min': ('priority', 'low'),
+    'priority_max': ('priority', 'high'),
+}
+
+
+class ListingError(ValueError):
+    pass
+
+
+class TaskListing(object):
+
+    def __init__(self, status, owner_id=None, sort='due', descending=False, ranges=None):
+        if sort not in SORTS:
+            raise ListingError('sort must be one of: {0}.'.format(', '.join(sorted(SORTS))))
+        ranges = ranges or {}
+        for name in ranges:
+            if RANGES[name][0] != sort:
+                raise ListingError('{0} can only be used with sort={1}.'.format(
+                    name, RANGES[name][0]))
+        self.status = status
+        self.owner_id = owner_id
+        self.sort = sort
+        self.descending = descending
+        self.ranges = ranges
+        self.columns = SORTS[sort]
+        self.index = INDEXES[(owner_id is not None, sort)]
+
+    def for_status(self, status):
+        return TaskListing(status, self.owner_id, self.sort, self.descending, self.ranges)
+
+    def filtered(self, query):
+        query = query.filter(Task.status == self.status)
+        if self.owner_id is not None:
+            query = query.filter(Task.user_id == self.owner_id)
+        column = self.columns[0]
+        for name, value in sorted(self.ranges.items()):
+            if RANGES[name][1] == 'low':
+                query = query.filter(column >= value)
+            else:
+                query = query.filter(column <= value)
+        return query
+
+    def query(self):
+        # the listings join the poster in the same SELECT so that rendering
+        # `task.poster.name` doesn't cost one extra query per row
+        query = self.filtered(db.session.query(Task).options(joinedload(Task.poster)))
+        return query.order_by(*[column.desc() if self.descending else column.asc()
+                                for column in self.columns])
+
+    def cache_key(self):
+        return '{0}:{1}:{2}:{3}:{4}'.format(
+            self.status, self.owner_id, self.sort, int(self.descending),
+            ','.join('{0}={1}'.format(name, value) for name, value in sorted(self.ranges.items())))
+
+
+def parse_range(name, value):
+    if name.startswith('due_'):
+        return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+    return int(value)
+
+
+def parse_listing(args, status):
+    # builds a TaskListing from query string arguments: owner (a user name),
+    # sort (due, priority or posted), order (asc or desc) and the RANGES
+    order = args.get('order') or 'asc'
+    if order not in ('asc', 'desc'):
+        raise ListingError("order must be 'asc' or 'desc'.")
+    owner_id = None
+    owner = args.get('owner')
+    if owner:
+        row = db.session.query(User.id).filter_by(name=owner).first()
+        if row is None:
+            raise ListingError('There is no user called {0}.'.format(owner))
+        owner_id = row.id
+    ranges = {}
+    for name in RANGES:
+        value = args.get(name)
+        if not value:
+            continue
+        try:
+            ranges[name] = parse_range(name, value)
+        except ValueError:
+            raise ListingError('{0} must be {1}.'.format(
+                name, 'a date (YYYY-MM-DD)' if name.startswith('due_') else 'a number'))
+    return TaskListing(status, owner_id, args.get('sort') or 'due', order == 'desc', ranges)
@@ -0,0 +1,272 @@
+# project/migrations.py
+
+
+import datetime
+import os
+import shutil
+import tempfile
+import time
+
+from sqlalchemy import create_engine, func, select, text
+from sqlalchemy.sql import column, table
+
+from project import app, db
+from project.auth import invalidate_all_principals
+from project.counters import reconcile_counts
+from project.models import Job, SchemaVersion, Task, TaskCount, seed_data_versions
+from project.schema import add_missing_columns, create_missing_indexes
+from project.search import rebuild_search_index
+
+
+# versioned migrations
+#
+# MIGRATIONS is an ordered list; schema_versions records which have been
+# applied. Each migration is a list of steps. Plain steps run once. Batched
+# steps walk a table by its integer key in MIGRATION_BATCH_SIZE ranges, each
+# range in its own short transaction together with a checkpoint, so no lock
+# is held for long, memory doesn't grow with the table, and an interrupted
+# run picks up after the last committed range. A plain step may be re-run
+# if the process dies right after it, so plain steps must be idempotent.
+
+
+class Statement(object):
+
+    def __init__(self, description, action):
+        # `action` is SQL text or a callable taking the engine
+        self.description = description
+        self.action = action
+
+    def pending_rows(self, engine, checkpoint):
+        return None
+
+    def run(self, runner, checkpoint):
+        if callable(self.action):
+            self.action(runner.engine)
+        else:
+            runner.engine.execute(text(self.action))
+
+
+class Batched(object):
+
+    def __init__(self, description, table_name, key, dialect=None):
+        # with `dialect` the step only runs on that database
+        self.description = description
+        self.table = table(table_name, column(key))
+        self.key = self.table.c[key]
+        self.dialect = dialect
+
+    def skipped(self, engine):
+        return self.dialect is not None and engine.dialect.name != self.dialect
+
+    def pending_rows(self, engine, checkpoint):
+        if self.skipped(engine):
+            return 0
+        query = select([func.count()]).select_from(self.table)
+        if checkpoint is not None:
+            query = query.where(self.key > checkpoint)
+        return engine.execute(query).scalar()
+
+    def run(self, runner, checkpoint):
+        engine = runner.engine
+        if self.skipped(engine):
+            return
+        low = checkpoint
+        if low is None:
+            first = engine.execute(select([func.min(self.key)])).scalar()
+            if first is None:
+                return
+            low = first - 1
+        while True:
+            # the key `batch_size` rows on, or the last key for the final range
+            high = engine.execute(
+                select([self.key]).where(self.key > low).order_by(self.key)
+                .offset(runner.batch_size - 1).limit(1)
+            ).scalar()
+            rows = runner.batch_size
+            if high is None:
+                high, rows = engine.execute(
+                    select([func.max(self.key), func.count()]).where(self.key > low)).first()
+                if high is None:
+                    return
+            with engine.begin() as connection:
+                self.apply(connection, low, high)
+                runner.checkpoint(connection, high)
+            runner.advance(rows)
+            low = high
+
+    def apply(self, connection, low, high):
+        raise NotImplementedError
+
+
+class BatchedUpdate(Batched):
+
+    def __init__(self, description, table_name, key, assignments, where=None, dialect=None):
+        Batched.__init__(self, description, table_name, key, dialect)
+        self.sql = 'UPDATE {0} SET {1} WHERE {2} > :low AND {2} <= :high{3}'.format(
+            table_name, assignments, key, ' AND ({0})'.format(where) if where else '')
+
+    def apply(self, connection, low, high):
+        connection.execute(text(self.sql), low=low, high=high)
+
+
+class CopyRows(Batched):
+
+    # copies source into target range by range; `columns` is a list of
+    # (target column, source SQL expression) pairs
+
+    def __init__(self, description, source, target, columns, key, dialect=None):
+        Batched.__init__(self, description, source, key, dialect)
+        self.sql = 'INSERT INTO {0} ({1}) SELECT {2} FROM {3} WHERE {4} > :low AND {4} <= :high'.format(
+            target, ', '.join(name for name, _ in columns),
+            ', '.join(expression for _, expression in columns), source, key)
+
+    def apply(self, connection, low, high):
+        connection.execute(text(self.sql), low=low, high=high)
+
+
+class Migration(object):
+
+    def __init__(self, version, name, steps):
+        self.version = version
+        self.name = name
+        self.steps = steps
+
+
+MIGRATIONS = [
+    Migration(1, 'create tables', [
+        Statement('create missing tables', lambda engine: db.metadata.create_all(engine)),
+    ]),
+    Migration(2, 'add missing columns', [
+        Statement('add model columns missing from existing tables',
+                  lambda engine: add_missing_columns(engine, db.metadata)),
+        # as db_migrate.py did when it added users.role
+        Statement("give users without a role the 'user' role",
+                  "UPDATE users SET role = 'user' WHERE role IS NULL"),
+    ]),
+    Migration(3, 'task status as integers', [
+        # see normalize_task_status() for why this is SQLite only
+        BatchedUpdate(
+            "rewrite '0' / '1' statuses as integers", 'tasks', 'task_id',
+            "status = CASE WHEN status = '0' THEN {0} ELSE {1} END".format(
+                Task.CLOSED, Task.OPEN),
+            where="typeof(status) = 'text' AND status IN ('0', '1')",
+            dialect='sqlite'
+        ),
+    ]),
+    Migration(4, 'create missing indexes', [
+        Statement('create model indexes missing from the database',
+                  lambda engine: create_missing_indexes(engine, db.metadata)),
+    ]),
+    Migration(5, 'task search index', [
+        Statement('build the full-text index over task names', rebuild_search_index),
+    ]),
+    Migration(6, 'task listing indexes', [
+        # superseded by ix_tasks_user_id_status_due_date_task_id, which has
+        # the same leading columns
+        Statement('drop ix_tasks_user_id_status', 'DROP INDEX IF EXISTS ix_tasks_user_id_status'),
+        Statement('create the filter / sort indexes',
+                  lambda engine: create_missing_indexes(engine, db.metadata)),
+    ]),
+    Migration(7, 'per-user task counts', [
+        Statement('create task_counts',
+                  lambda engine: TaskCount.__table__.create(engine, checkfirst=True)),
+        Statement("count every user's tasks", reconcile_counts),
+    ]),
+    Migration(8, 'job queue', [
+        Statement('create jobs', lambda engine: Job.__table__.create(engine, checkfirst=True)),
+    ]),
+    Migration(9, 'seed data versions', [
+        Statement('insert missing data_versions rows', seed_data_versions),
+    ]),
+]
+
+
+class MigrationRunner(object):
+
+    def __init__(self, engine, migrations=None, batch_size=None, progress=None):
+        self.engine = engine
+        self.migrations = MIGRATIONS if migrations is None else migrations
+        self.batch_size = batch_size or app.config['MIGRATION_BATCH_SIZE']
+        # called as progress(migration, step, done, total, elapsed)
+        self.progress = progress
+        # (version, step description, rows, seconds) for every step run
+        self.timings = []
+        self.versions = SchemaVersion.__table__
+
+    def states(self):
+        self.versions.create(self.engine, checkfirst=True)
+        rows = self.engine.execute(select([self.versions])).fetchall()
+        return dict((row.version, row) for row in rows)
+
+    def pending(self):
+        states = self.states()
+        return [migration for migration in self.migrations
+                if migration.version not in states or states[migration.version].applied is None]
+
+    def run(self, target=None):
+        applied = []
+        states = self.states()
+        for migration in self.pending():
+            if target is not None and migration.version > target:
+                break
+            self.run_migration(migration, states.get(migration.version))
+            applied.append(migration.version)
+        if applied:
+            # migrations write users with raw SQL
+            invalidate_all_principals()
+        return applied
+
+    def run_migration(self, migration, state):
+        self.migration = migration
+        if state is None:
+            self.engine.execute(self.versions.insert().values(
+                version=migration.version, name=migration.name, step=0,
+                started=datetime.datetime.utcnow()))
+            first_step, checkpoint = 0, None
+        else:
+            first_step, checkpoint = state.step, state.checkpoint
+        for index in range(first_step, len(migration.steps)):
+            step = migration.steps[index]
+            self.step_index, self.step = index, step
+            self.done = 0
+            self.total = step.pending_rows(self.engine, checkpoint)
+            self.started = time.time()
+            step.run(self, checkpoint)
+            self.timings.append((migration.version, step.description, self.total,
+                                 time.time() - self.started))
+            self.save(self.engine, step=index + 1, checkpoint=None)
+            checkpoint = None
+        self.save(self.engine, applied=datetime.datetime.utcnow())
+
+    def save(self, connection, **values):
+        connection.execute(self.versions.update().where(
+            self.versions.c.version == self.migration.version).values(**values))
+
+    def checkpoint(self, connection, key):
+        self.save(connection, step=self.step_index, checkpoint=key)
+
+    def advance(self, rows):
+        self.done += rows
+        if self.progress is not None:
+            self.progress(self.migration, self.step, self.done, self.total,
+                          time.time() - self.started)
+
+
+def dry_run(engine, batch_size=None, progress=None):
+    # runs the pending migrations against a copy of a SQLite database and
+    # returns the per-step timings, to size a maintenance window
+    if engine.dialect.name != 'sqlite' or not engine.url.database:
+        raise RuntimeError('dry runs need a SQLite database file to copy')
+    # fold the write-ahead log into the main file so the copy is complete
+    engine.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    directory = tempfile.mkdtemp(prefix='flasktaskr-migrate-')
+    copy = os.path.join(directory, 'dry-run.db')
+    try:
+        shutil.copyfile(engine.url.database, copy)
+        copy_engine = create_engine('sqlite:///' + copy)
+        runner = MigrationRunner(copy_engine, batch_size=batch_size, progress=progress)
+        runner.run()
+        copy_engine.dispose()
+        return runner.timings
+    finally:
+        shutil.rmtree(directory)
@@ -1,6 +1,8 @@
 # project/models.py
 
 
+from sqlalchemy import event
+
 from project import db
 
 import datetime
@@ -10,12 +12,31 @@ class Task(db.Model):
 
     __tablename__ = "tasks"
 
+    # status values
+    CLOSED = 0
+    OPEN = 1
+
+    __table_args__ = (
+        # the open/closed listings filter on status (and optionally the
+        # owner) and page by one of the sort keys; see project/listing.py
+        db.Index('ix_tasks_status_due_date_task_id', 'status', 'due_date', 'task_id'),
+        db.Index('ix_tasks_status_priority_task_id', 'status', 'priority', 'task_id'),
+        db.Index('ix_tasks_status_posted_date_task_id', 'status', 'posted_date', 'task_id'),
+        # these also serve ownership checks and per-user lookups
+        db.Index('ix_tasks_user_id_status_due_date_task_id',
+                 'user_id', 'status', 'due_date', 'task_id'),
+        db.Index('ix_tasks_user_id_status_priority_task_id',
+                 'user_id', 'status', 'priority', 'task_id'),
+        db.Index('ix_tasks_user_id_status_posted_date_task_id',
+                 'user_id', 'status', 'posted_date', 'task_id'),
+    )
+
     task_id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String, nullable=False)
     due_date = db.Column(db.Date, nullable=False)
     priority = db.Column(db.Integer, nullable=False)
     posted_date = db.Column(db.Date, default=datetime.datetime.now())
-    status = db.Column(db.Integer)
+    status = db.Column(db.SmallInteger, default=OPEN)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
 
     def __init__(self, name, due_date, priority, posted_date, status, user_id):
@@ -29,6 +50,130 @@ class Task(db.Model):
     def __repr__(self):
         return '<name {0}>'.format(self.name)
 
+class TaskTerm(db.Model):
+
+    # inverted index of task names, used for search where FTS5 isn't
+    # available (see project/search.py)
+
+    __tablename__ = 'task_terms'
+
+    term = db.Column(db.String, primary_key=True)
+    task_id = db.Column(db.Integer, primary_key=True, autoincrement=False, index=True)
+
+
+class TaskCount(db.Model):
+
+    # each user's task totals, kept in step with every write (see
+    # project/counters.py); `overdue` counts the open tasks due before
+    # `overdue_as_of`
+
+    __tablename__ = 'task_counts'
+
+    user_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    open = db.Column(db.Integer, nullable=False, default=0)
+    closed = db.Column(db.Integer, nullable=False, default=0)
+    overdue = db.Column(db.Integer, nullable=False, default=0)
+    overdue_as_of = db.Column(db.Date, nullable=False)
+
+
+class Job(db.Model):
+
+    # a unit of deferred work, run by db_worker.py (see project/jobs.py)
+
+    __tablename__ = 'jobs'
+
+    # status values
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    __table_args__ = (
+        # workers claim the oldest due job: status IN (...) AND run_at <= now
+        db.Index('ix_jobs_status_run_at', 'status', 'run_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String, nullable=False)
+    payload = db.Column(db.Text, nullable=False)
+    # who asked for it, for jobs whose result belongs to a user
+    user_id = db.Column(db.Integer, index=True)
+    status = db.Column(db.String, nullable=False, default=QUEUED)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False)
+    # seconds a claimed job stays invisible to other workers
+    timeout = db.Column(db.Integer, nullable=False)
+    # when a queued job may next run; for a running job, when its claim lapses
+    run_at = db.Column(db.DateTime, nullable=False)
+    created = db.Column(db.DateTime, nullable=False)
+    finished = db.Column(db.DateTime)
+    result = db.Column(db.Text)
+    last_error = db.Column(db.Text)
+
+
+class UserSession(db.Model):
+
+    # server-side session data, used when SESSION_BACKEND = 'database'
+
+    __tablename__ = 'sessions'
+
+    sid = db.Column(db.String, primary_key=True)
+    user_id = db.Column(db.Integer, index=True)
+    data = db.Column(db.Text, nullable=False)
+    expires = db.Column(db.DateTime, nullable=False, index=True)
+
+
+class DataVersion(db.Model):
+
+    # one row per dataset, bumped by every write to it; lets a view tell
+    # whether anything changed without touching the dataset itself
+
+    __tablename__ = 'data_versions'
+
+    # every dataset's row is seeded with the table (and by migration 9 on
+    # older databases), so bumping a version is always a plain UPDATE
+    NAMES = ('tasks',)
+
+    name = db.Column(db.String, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated = db.Column(db.DateTime, nullable=False)
+
+    def __init__(self, name, version, updated):
+        self.name = name
+        self.version = version
+        self.updated = updated
+
+    def __repr__(self):
+        return '<DataVersion {0} {1}>'.format(self.name, self.version)
+
+def seed_data_versions(connection):
+    table = DataVersion.__table__
+    existing = set(row[0] for row in connection.execute(db.select([table.c.name])))
+    now = datetime.datetime.utcnow().replace(microsecond=0)
+    missing = [dict(name=name, version=0, updated=now)
+               for name in DataVersion.NAMES if name not in existing]
+    if missing:
+        connection.execute(table.insert(), missing)
+
+@event.listens_for(DataVersion.__table__, 'after_create')
+def data_versions_created(target, connection, **kw):
+    seed_data_versions(connection)
+
+
+class SchemaVersion(db.Model):
+
+    # one row per migration (see project/migrations.py); `step` and
+    # `checkpoint` record how far an unfinished migration got
+
+    __tablename__ = 'schema_versions'
+
+    version = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    name = db.Column(db.String, nullable=False)
+    step = db.Column(db.Integer, nullable=False, default=0)
+    checkpoint = db.Column(db.Integer)
+    started = db.Column(db.DateTime, nullable=False)
+    applied = db.Column(db.DateTime)
+
 class User(db.Model):
 
     __tablename__ = 'users'
@@ -39,6 +184,8 @@ class User(db.Model):
     password = db.Column(db.String, nullable=False)
     tasks = db.relationship('Task', backref='poster')
     role = db.Column(db.String, default='user')
+    # cleared to ban a user without deleting their tasks
+    active = db.Column(db.Boolean, nullable=False, default=True, server_default=db.true())
 
     def __init__(self, name=None, email=None, password=None, role=None):
         self.name = name
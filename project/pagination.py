@@ -0,0 +1,106 @@
+# project/pagination.py
+
+
+import datetime
+
+from sqlalchemy import and_, or_
+
+
+# keyset (cursor) pagination
+#
+# instead of OFFSET, each page remembers the sort key of its first and last
+# row; the next page is simply "rows whose key is greater than the last one",
+# which an index on the key columns answers without scanning skipped rows
+
+
+def encode_cursor(values):
+    parts = []
+    for value in values:
+        if isinstance(value, (datetime.date, datetime.datetime)):
+            value = value.isoformat()
+        parts.append(str(value))
+    return '_'.join(parts)
+
+
+def decode_cursor(cursor, columns):
+    # returns None for anything malformed so a bad link falls back to page one
+    if not cursor:
+        return None
+    parts = cursor.split('_')
+    if len(parts) != len(columns):
+        return None
+    values = []
+    try:
+        for part, column in zip(parts, columns):
+            python_type = column.type.python_type
+            if python_type is datetime.date:
+                value = datetime.datetime.strptime(part, '%Y-%m-%d').date()
+            elif python_type is datetime.datetime:
+                value = datetime.datetime.strptime(part, '%Y-%m-%dT%H:%M:%S')
+            else:
+                value = python_type(part)
+            values.append(value)
+    except (ValueError, NotImplementedError):
+        return None
+    return values
+
+
+def _keyset_condition(columns, values, forward):
+    # (a, b) > (x, y) expanded to: a >= x AND (a > x OR b > y); the redundant
+    # a >= x gives the planner a range to seek to on the leading index column
+    column, value = columns[0], values[0]
+    beyond = column > value if forward else column < value
+    if len(columns) == 1:
+        return beyond
+    reached = column >= value if forward else column <= value
+    return and_(
+        reached,
+        or_(beyond, _keyset_condition(columns[1:], values[1:], forward))
+    )
+
+
+class KeysetPage(object):
+
+    def __init__(self, items, columns, has_next, has_prev):
+        self.items = items
+        self.has_next = has_next
+        self.has_prev = has_prev
+        self.next_cursor = None
+        self.prev_cursor = None
+        if items and has_next:
+            self.next_cursor = encode_cursor(
+                [getattr(items[-1], column.key) for column in columns])
+        if items and has_prev:
+            self.prev_cursor = encode_cursor(
+                [getattr(items[0], column.key) for column in columns])
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def keyset_paginate(query, columns, after=None, before=None, per_page=25, descending=False):
+    # `columns` is the full, unique sort key, e.g. (Task.due_date, Task.task_id);
+    # with `descending` every column sorts high to low
+    query = query.order_by(None)
+    after_values = decode_cursor(after, columns)
+    before_values = decode_cursor(before, columns)
+    forwards = [c.desc() if descending else c.asc() for c in columns]
+    backwards = [c.asc() if descending else c.desc() for c in columns]
+
+    if before_values is not None and after_values is None:
+        query = query.filter(_keyset_condition(columns, before_values, descending))
+        rows = query.order_by(*backwards).limit(per_page + 1).all()
+        has_prev = len(rows) > per_page
+        items = list(reversed(rows[:per_page]))
+        return KeysetPage(items, columns, has_next=True, has_prev=has_prev)
+
+    if after_values is not None:
+        query = query.filter(_keyset_condition(columns, after_values, not descending))
+    rows = query.order_by(*forwards).limit(per_page + 1).all()
+    has_next = len(rows) > per_page
+    items = rows[:per_page]
+    return KeysetPage(items, columns, has_next=has_next,
+                      has_prev=after_values is not None)
@@ -0,0 +1,237 @@
+# project/profiling.py
+
+
+import cProfile
+import os
+import random
+import threading
+import time
+from collections import defaultdict, deque
+
+from flask import Response, abort, g, has_request_context, jsonify, request
+from jinja2 import Template
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from project import app
+from project.auth import is_admin
+
+
+# request instrumentation
+#
+# off unless PROFILING_ENABLED is set. While on, every request records its
+# wall time, the number and total time of its SQL statements and the time
+# spent rendering templates; statements slower than PROFILING_SLOW_QUERY_MS
+# are kept as samples, with their parameters redacted. Totals are served from
+# /metrics in the Prometheus text format, the slow-query samples from
+# /metrics/slow-queries (admins only), and a PROFILING_CPROFILE_RATE
+# fraction of requests is run under cProfile with the stats written to
+# PROFILING_CPROFILE_DIR.
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+def redact(parameters):
+    # bound values can be password hashes, session data or what somebody
+    # searched for, so a sample keeps only their shape
+    if isinstance(parameters, dict):
+        return dict((key, '?') for key in parameters)
+    if isinstance(parameters, (list, tuple)):
+        if parameters and isinstance(parameters[0], (dict, list, tuple)):
+            # executemany: one row's shape and the number of rows
+            return [redact(parameters[0]), len(parameters)]
+        return ['?'] * len(parameters)
+    return '?'
+
+
+class Metrics(object):
+
+    def __init__(self, slow_query_samples=50):
+        self._lock = threading.Lock()
+        self.slow_queries = deque(maxlen=slow_query_samples)
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.requests = defaultdict(int)
+            self.buckets = defaultdict(lambda: [0] * len(DURATION_BUCKETS))
+            self.request_seconds = defaultdict(float)
+            self.sql_queries = defaultdict(int)
+            self.sql_seconds = defaultdict(float)
+            self.template_seconds = defaultdict(float)
+            self.slow_queries.clear()
+
+    def observe(self, endpoint, method, status, seconds, sql_queries, sql_seconds,
+                template_seconds):
+        with self._lock:
+            self.requests[(endpoint, method, status)] += 1
+            buckets = self.buckets[endpoint]
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if seconds <= bound:
+                    buckets[i] += 1
+            self.request_seconds[endpoint] += seconds
+            self.sql_queries[endpoint] += sql_queries
+            self.sql_seconds[endpoint] += sql_seconds
+            self.template_seconds[endpoint] += template_seconds
+
+    def slow_query(self, endpoint, statement, parameters, seconds):
+        with self._lock:
+            self.slow_queries.append(dict(
+                endpoint=endpoint,
+                statement=statement,
+                parameters=repr(redact(parameters)),
+                ms=round(seconds * 1000, 3)
+            ))
+
+    def render(self):
+        lines = []
+
+        def family(name, kind, help_text):
+            lines.append('# HELP {0} {1}'.format(name, help_text))
+            lines.append('# TYPE {0} {1}'.format(name, kind))
+
+        with self._lock:
+            family('flasktaskr_requests_total', 'counter', 'Requests handled.')
+            for (endpoint, method, status), count in sorted(self.requests.items()):
+                lines.append('flasktaskr_requests_total{{endpoint="{0}",method="{1}",status="{2}"}} {3}'
+                             .format(endpoint, method, status, count))
+
+            family('flasktaskr_request_duration_seconds', 'histogram', 'Request wall time.')
+            for endpoint in sorted(self.buckets):
+                for bound, count in zip(DURATION_BUCKETS, self.buckets[endpoint]):
+                    lines.append('flasktaskr_request_duration_seconds_bucket{{endpoint="{0}",le="{1}"}} {2}'
+                                 .format(endpoint, bound, count))
+                total = sum(n for key, n in self.requests.items() if key[0] == endpoint)
+                lines.append('flasktaskr_request_duration_seconds_bucket{{endpoint="{0}",le="+Inf"}} {1}'
+                             .format(endpoint, total))
+                lines.append('flasktaskr_request_duration_seconds_sum{{endpoint="{0}"}} {1:.6f}'
+                             .format(endpoint, self.request_seconds[endpoint]))
+                lines.append('flasktaskr_request_duration_seconds_count{{endpoint="{0}"}} {1}'
+                             .format(endpoint, total))
+
+            for name, values, help_text, fmt in (
+                ('flasktaskr_sql_queries_total', self.sql_queries,
+                 'SQL statements executed.', '{0}'),
+                ('flasktaskr_sql_seconds_total', self.sql_seconds,
+                 'Time spent in SQL statements.', '{0:.6f}'),
+                ('flasktaskr_template_seconds_total', self.template_seconds,
+                 'Time spent rendering templates.', '{0:.6f}'),
+            ):
+                family(name, 'counter', help_text)
+                for endpoint in sorted(values):
+                    lines.append('{0}{{endpoint="{1}"}} {2}'
+                                 .format(name, endpoint, fmt.format(values[endpoint])))
+        return '\n'.join(lines) + '\n'
+
+
+def enabled():
+    return app.config.get('PROFILING_ENABLED')
+
+def metrics():
+    return app.extensions['metrics']
+
+def recording():
+    return has_request_context() and 'profile_start' in g
+
+def endpoint_label():
+    return request.endpoint or 'unmatched'
+
+
+@app.before_request
+def start_request_profile():
+    if not enabled() or request.endpoint in ('metrics', 'slow_queries'):
+        return
+    g.profile_start = time.time()
+    g.profile_sql_queries = 0
+    g.profile_sql_seconds = 0.0
+    g.profile_template_seconds = 0.0
+    g.profile_template_depth = 0
+    rate = app.config.get('PROFILING_CPROFILE_RATE')
+    if rate and random.random() < rate:
+        g.profiler_start = g.profile_start
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+
+@app.after_request
+def finish_request_profile(response):
+    if not recording():
+        return response
+    seconds = time.time() - g.profile_start
+    metrics().observe(
+        endpoint_label(), request.method, response.status_code, seconds,
+        g.profile_sql_queries, g.profile_sql_seconds, g.profile_template_seconds
+    )
+    del g.profile_start
+    return response
+
+
+@app.teardown_request
+def finish_cprofile(exception):
+    # here rather than in after_request, which is skipped when the view
+    # raises and would leave the profiler running
+    if 'profiler' not in g:
+        return
+    g.profiler.disable()
+    seconds = time.time() - g.profiler_start
+    directory = app.config['PROFILING_CPROFILE_DIR']
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    g.profiler.dump_stats(os.path.join(directory, '{0}-{1}-{2:.0f}ms.prof'.format(
+        endpoint_label(), int(g.profiler_start * 1000), seconds * 1000)))
+    del g.profiler
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_statement_timer(conn, cursor, statement, parameters, context, executemany):
+    if recording():
+        conn.info.setdefault('profile_started', []).append(time.time())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def stop_statement_timer(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get('profile_started')
+    if not started or not recording():
+        return
+    seconds = time.time() - started.pop()
+    g.profile_sql_queries += 1
+    g.profile_sql_seconds += seconds
+    if seconds * 1000 >= app.config['PROFILING_SLOW_QUERY_MS']:
+        metrics().slow_query(endpoint_label(), statement, parameters, seconds)
+
+
+class TimedTemplate(Template):
+
+    # only the outermost render is timed, so templates rendered from inside
+    # another one (the task row fragments) are not counted twice
+
+    def render(self, *args, **kwargs):
+        if not recording():
+            return Template.render(self, *args, **kwargs)
+        g.profile_template_depth += 1
+        start = time.time()
+        try:
+            return Template.render(self, *args, **kwargs)
+        finally:
+            g.profile_template_depth -= 1
+            if not g.profile_template_depth:
+                g.profile_template_seconds += time.time() - start
+
+app.jinja_env.template_class = TimedTemplate
+
+
+@app.route('/metrics', endpoint='metrics')
+def metrics_view():
+    if not enabled():
+        abort(404)
+    return Response(metrics().render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/metrics/slow-queries')
+def slow_queries():
+    # parameters are redacted, but statements still show what users were
+    # doing, so only admins get to see them
+    if not enabled():
+        abort(404)
+    if not is_admin():
+        abort(403)
+    return jsonify(slow_queries=list(metrics().slow_queries))
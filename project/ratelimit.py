@@ -0,0 +1,124 @@
+# project/ratelimit.py
+
+
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from project.cache import make_cache
+
+
+# token bucket rate limiting
+#
+# every key gets a bucket of `capacity` tokens that refills completely over
+# `refill_seconds`; each hit takes `cost` tokens (0 just checks) and is
+# refused when less than one is left. A bucket is just (tokens, last update),
+# and one that hasn't been touched for refill_seconds is full again, so it
+# can be forgotten.
+
+
+def _take(state, capacity, refill_seconds, now, cost=1):
+    rate = capacity / float(refill_seconds)
+    tokens, stamp = state if state is not None else (capacity, now)
+    tokens = min(capacity, tokens + max(0, now - stamp) * rate)
+    if tokens >= 1:
+        return (tokens - cost, now), 0
+    return (tokens, now), (1 - tokens) / rate
+
+
+class LocalBucketStore(object):
+
+    # in-process buckets, ordered by last use so idle ones expire from the
+    # front in O(1); max_keys bounds memory even under a flood of new keys
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, capacity, refill_seconds, now=None, cost=1):
+        now = time.time() if now is None else now
+        with self._lock:
+            state, retry_after = _take(
+                self._buckets.pop(key, None), capacity, refill_seconds, now, cost)
+            self._buckets[key] = state
+            while self._buckets:
+                oldest_key = next(iter(self._buckets))
+                idle = now - self._buckets[oldest_key][1]
+                if idle < refill_seconds and len(self._buckets) <= self.max_keys:
+                    break
+                del self._buckets[oldest_key]
+        return retry_after
+
+    def reset(self):
+        with self._lock:
+            self._buckets.clear()
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class CacheBucketStore(object):
+
+    # buckets kept in a project.cache backend (e.g. RedisCache) of their own,
+    # so several processes share them; the read-modify-write isn't atomic, so
+    # concurrent hits on one key may occasionally let an extra attempt through
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    def take(self, key, capacity, refill_seconds, now=None, cost=1):
+        now = time.time() if now is None else now
+        state, retry_after = _take(self.cache.get(key), capacity, refill_seconds, now, cost)
+        if cost:
+            self.cache.set(key, state, ttl=int(math.ceil(refill_seconds)))
+        return retry_after
+
+    def reset(self):
+        # the cache holds nothing but buckets
+        self.cache.clear()
+
+
+class LoginLimiter(object):
+
+    def __init__(self, store, user_burst, ip_burst, refill_seconds):
+        self.store = store
+        self.user_burst = user_burst
+        self.ip_burst = ip_burst
+        self.refill_seconds = refill_seconds
+
+    def retry_after(self, username, address):
+        # seconds until another attempt is allowed, 0 if this one may go
+        # ahead; checking uses nothing up, only failed() does
+        return max(
+            self.store.take(self.user_key(username), self.user_burst, self.refill_seconds, cost=0),
+            self.store.take(self.ip_key(address), self.ip_burst, self.refill_seconds, cost=0)
+        )
+
+    def failed(self, username, address):
+        # charges a failed attempt to the username and the address
+        self.store.take(self.user_key(username), self.user_burst, self.refill_seconds)
+        self.store.take(self.ip_key(address), self.ip_burst, self.refill_seconds)
+
+    def user_key(self, username):
+        return 'user:' + username[:100]
+
+    def ip_key(self, address):
+        return 'ip:' + (address or '')
+
+    def reset(self):
+        self.store.reset()
+
+
+def make_login_limiter(config):
+    if config['LOGIN_LIMIT_STORAGE'] == 'cache':
+        store = CacheBucketStore(make_cache(config, prefix='flasktaskr-ratelimit:'))
+    else:
+        store = LocalBucketStore(config['LOGIN_LIMIT_MAX_KEYS'])
+    return LoginLimiter(
+        store,
+        config['LOGIN_LIMIT_USER_BURST'],
+        config['LOGIN_LIMIT_IP_BURST'],
+        config['LOGIN_LIMIT_REFILL_SECONDS']
+    )
@@ -0,0 +1,80 @@
+# project/schema.py
+
+
+from sqlalchemy import and_, case, func, inspect
+from sqlalchemy.schema import CreateColumn
+
+from project.models import Task
+
+
+# index management
+#
+# `db.create_all()` only creates tables that don't exist yet, so indexes added
+# to a model later never reach an existing database; these helpers compare the
+# declared indexes against the live schema and build whatever is missing
+
+
+def missing_indexes(engine, metadata):
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    missing = []
+    for table in metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing = set(index['name'] for index in inspector.get_indexes(table.name))
+        for index in sorted(table.indexes, key=lambda index: index.name):
+            if index.name not in existing:
+                missing.append(index)
+    return missing
+
+
+def create_missing_indexes(engine, metadata):
+    created = []
+    for index in missing_indexes(engine, metadata):
+        index.create(engine)
+        created.append(index.name)
+    return created
+
+
+# columns added to a model after its table was created; they need a server
+# default (or to be nullable) so that existing rows get a value
+
+def missing_columns(engine, metadata):
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    missing = []
+    for table in metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing = set(column['name'] for column in inspector.get_columns(table.name))
+        missing.extend(column for column in table.columns if column.name not in existing)
+    return missing
+
+
+def add_missing_columns(engine, metadata):
+    added = []
+    for column in missing_columns(engine, metadata):
+        engine.execute('ALTER TABLE {0} ADD COLUMN {1}'.format(
+            column.table.name, CreateColumn(column).compile(dialect=engine.dialect)))
+        added.append('{0}.{1}'.format(column.table.name, column.name))
+    return added
+
+
+# data fixes
+
+
+def normalize_task_status(engine):
+    # older code wrote the status as the strings '1' / '0'; rewrite every such
+    # row to the integer Task.OPEN / Task.CLOSED in a single UPDATE. Only
+    # SQLite can hold both in one column: it keeps a value's own type when
+    # the column has no affinity, and typeof() tells the two apart. Other
+    # databases enforce the declared type, so there is nothing to rewrite
+    if engine.dialect.name != 'sqlite':
+        return 0
+    tasks = Task.__table__
+    result = engine.execute(
+        tasks.update()
+        .where(and_(func.typeof(tasks.c.status) == 'text', tasks.c.status.in_(['0', '1'])))
+        .values(status=case([(tasks.c.status == '0', Task.CLOSED)], else_=Task.OPEN))
+    )
+    return result.rowcount
@@ -0,0 +1,239 @@
+# project/search.py
+
+
+import re
+import sqlite3
+
+from sqlalchemy import event, inspect, text
+from sqlalchemy.orm import joinedload
+
+from project import app, db
+from project.models import Task, TaskTerm
+
+
+# full-text search over task names
+#
+# on SQLite the names are indexed by an FTS5 table kept in sync with tasks
+# by triggers, so every write path (views, API, bulk actions, the importer)
+# is covered, and the newest matches are ranked by bm25. Other databases (or
+# a SQLite built without FTS5) fall back to the task_terms inverted index:
+# one row per (word, task) written from mapper events, with matches listed
+# newest first. Either way a task matches only if its name has every searched
+# word. Bulk Core inserts bypass the mapper, so run index_tasks_after() (or
+# rebuild_search_index()) after them, and call unindex_tasks() before a bulk
+# Query.delete(). Terms left behind by raw SQL are dropped from results by
+# joining back to tasks, and replaced if SQLite hands their id out again.
+
+WORD = re.compile(r'\w+', re.UNICODE)
+
+# a search word, optionally ending in * to match it as a prefix
+SEARCH_WORD = re.compile(r'(\w+)(\*?)', re.UNICODE)
+
+
+def words(value):
+    return [word.lower() for word in WORD.findall(value or '')]
+
+def search_terms(query):
+    # [(word, is_prefix), ...]; prefixes are opt-in because expanding one
+    # reads every posting under it, which is slow for common words
+    return [(word.lower(), bool(star)) for word, star in SEARCH_WORD.findall(query or '')]
+
+
+def fts5_available():
+    try:
+        sqlite3.connect(':memory:').execute('CREATE VIRTUAL TABLE probe USING fts5(x)')
+    except sqlite3.OperationalError:
+        return False
+    return True
+
+
+class Fts5Index(object):
+
+    DDL = [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS tasks_fts USING fts5("
+        "name, content='tasks', content_rowid='task_id', prefix='2 3')",
+        "CREATE TRIGGER IF NOT EXISTS tasks_fts_insert AFTER INSERT ON tasks BEGIN "
+        "INSERT INTO tasks_fts (rowid, name) VALUES (new.task_id, new.name); END",
+        "CREATE TRIGGER IF NOT EXISTS tasks_fts_delete AFTER DELETE ON tasks BEGIN "
+        "INSERT INTO tasks_fts (tasks_fts, rowid, name) VALUES ('delete', old.task_id, old.name); END",
+        "CREATE TRIGGER IF NOT EXISTS tasks_fts_update AFTER UPDATE OF name ON tasks BEGIN "
+        "INSERT INTO tasks_fts (tasks_fts, rowid, name) VALUES ('delete', old.task_id, old.name); "
+        "INSERT INTO tasks_fts (rowid, name) VALUES (new.task_id, new.name); END",
+    ]
+
+    def create(self, connection):
+        for statement in self.DDL:
+            connection.execute(statement)
+
+    def drop(self, connection):
+        for name in ('tasks_fts_insert', 'tasks_fts_delete', 'tasks_fts_update'):
+            connection.execute('DROP TRIGGER IF EXISTS ' + name)
+        connection.execute('DROP TABLE IF EXISTS tasks_fts')
+
+    def rebuild(self, connection):
+        connection.execute("INSERT INTO tasks_fts (tasks_fts) VALUES ('rebuild')")
+
+    def search(self, terms, limit, offset):
+        # every word must match: "bank" "dep"*. Only the newest
+        # SEARCH_RANK_CANDIDATES matches are scored: walking the index by
+        # rowid is cheap, but scoring every row of a word that half the tasks
+        # contain is not. Older matches follow the scored ones, newest first
+        query = ' '.join('"{0}"{1}'.format(word, '*' if prefix else '')
+                         for word, prefix in terms)
+        candidates = app.config['SEARCH_RANK_CANDIDATES']
+        ids = []
+        if offset < candidates:
+            rows = db.session.execute(text(
+                'SELECT rowid FROM ('
+                'SELECT rowid, rank FROM tasks_fts WHERE tasks_fts MATCH :query '
+                'ORDER BY rowid DESC LIMIT :candidates'
+                ') ORDER BY rank, rowid DESC LIMIT :limit OFFSET :offset'
+            ), dict(query=query, candidates=candidates, limit=limit, offset=offset))
+            ids = [row[0] for row in rows]
+        if len(ids) < limit:
+            rows = db.session.execute(text(
+                'SELECT rowid FROM tasks_fts WHERE tasks_fts MATCH :query '
+                'ORDER BY rowid DESC LIMIT :limit OFFSET :offset'
+            ), dict(query=query, limit=limit - len(ids),
+                    offset=candidates + max(offset - candidates, 0)))
+            ids.extend(row[0] for row in rows)
+        return ids
+
+
+class TermIndex(object):
+
+    def create(self, connection):
+        pass
+
+    def drop(self, connection):
+        pass
+
+    def rebuild(self, connection):
+        connection.execute(TaskTerm.__table__.delete())
+        self.index_after(connection, 0)
+
+    def index_after(self, connection, last_id):
+        # indexes the tasks with ids above `last_id`, 10000 at a time
+        tasks = Task.__table__
+        while True:
+            rows = connection.execute(
+                db.select([tasks.c.task_id, tasks.c.name]).where(tasks.c.task_id > last_id)
+                .order_by(tasks.c.task_id).limit(10000)
+            ).fetchall()
+            if not rows:
+                return
+            index_names(connection, rows)
+            last_id = rows[-1].task_id
+
+    def search(self, terms, limit, offset):
+        # every word must match, each its own indexed lookup; newest first
+        query = db.session.query(Task.task_id)
+        for word, prefix in terms:
+            if prefix:
+                match = TaskTerm.term.like(word.replace('_', '\\_') + '%', escape='\\')
+            else:
+                match = TaskTerm.term == word
+            query = query.filter(Task.task_id.in_(
+                db.session.query(TaskTerm.task_id).filter(match)))
+        rows = query.order_by(Task.task_id.desc()).limit(limit).offset(offset)
+        return [task_id for task_id, in rows]
+
+
+def index_names(connection, rows):
+    terms = TaskTerm.__table__
+    values = [dict(term=word, task_id=task_id)
+              for task_id, name in rows for word in set(words(name))]
+    if values:
+        connection.execute(terms.insert(), values)
+
+
+_indexes = {}
+
+def search_index(dialect_name=None):
+    dialect_name = dialect_name or db.engine.dialect.name
+    choice = app.config['SEARCH_BACKEND']
+    key = (dialect_name, choice)
+    if key not in _indexes:
+        if choice == 'auto':
+            choice = 'fts5' if dialect_name == 'sqlite' and fts5_available() else 'terms'
+        _indexes[key] = Fts5Index() if choice == 'fts5' else TermIndex()
+    return _indexes[key]
+
+
+def search_tasks(query, page=1, per_page=25):
+    # returns (tasks in rank order, has_next)
+    terms = search_terms(query)[:app.config['SEARCH_MAX_TERMS']]
+    if not terms:
+        return [], False
+    ids = search_index().search(terms, per_page + 1, (page - 1) * per_page)
+    has_next = len(ids) > per_page
+    ids = ids[:per_page]
+    if not ids:
+        return [], False
+    tasks = db.session.query(Task).options(joinedload(Task.poster)).filter(
+        Task.task_id.in_(ids)).all()
+    position = dict((task_id, i) for i, task_id in enumerate(ids))
+    return sorted(tasks, key=lambda task: position[task.task_id]), has_next
+
+
+def index_tasks_after(engine, last_id):
+    # for tasks added by Core inserts, whose ids are all above `last_id`;
+    # the FTS5 triggers have already seen them
+    index = search_index(engine.dialect.name)
+    if isinstance(index, TermIndex):
+        with engine.begin() as connection:
+            index.index_after(connection, last_id)
+
+
+def rebuild_search_index(engine):
+    with engine.begin() as connection:
+        index = search_index(engine.dialect.name)
+        index.create(connection)
+        index.rebuild(connection)
+
+
+# keep the index's own tables in step with the tasks table
+
+@event.listens_for(Task.__table__, 'after_create')
+def create_search_index(target, connection, **kw):
+    search_index(connection.dialect.name).create(connection)
+
+@event.listens_for(Task.__table__, 'before_drop')
+def drop_search_index(target, connection, **kw):
+    search_index(connection.dialect.name).drop(connection)
+
+
+# the inverted index follows ORM writes
+
+def term_index_in_use(connection):
+    return isinstance(search_index(connection.dialect.name), TermIndex)
+
+@event.listens_for(Task, 'after_insert')
+def index_new_task(mapper, connection, target):
+    if term_index_in_use(connection):
+        # SQLite reuses the largest deleted task_id, which may have stale terms
+        connection.execute(TaskTerm.__table__.delete().where(
+            TaskTerm.task_id == target.task_id))
+        index_names(connection, [(target.task_id, target.name)])
+
+@event.listens_for(Task, 'after_update')
+def reindex_task(mapper, connection, target):
+    if term_index_in_use(connection) and \
+            inspect(target).attrs.name.history.has_changes():
+        connection.execute(TaskTerm.__table__.delete().where(
+            TaskTerm.task_id == target.task_id))
+        index_names(connection, [(target.task_id, target.name)])
+
+def unindex_tasks(query):
+    # Query.delete() skips the mapper events; call this just before it, with
+    # the same query, to drop the doomed tasks' terms in the same transaction
+    if isinstance(search_index(), TermIndex):
+        doomed = query.with_entities(Task.task_id).subquery()
+        db.session.query(TaskTerm).filter(TaskTerm.task_id.in_(doomed)).delete(
+            synchronize_session=False)
+
+@event.listens_for(Task, 'after_delete')
+def unindex_task(mapper, connection, target):
+    if term_index_in_use(connection):
+        connection.execute(TaskTerm.__table__.delete().where(
+            TaskTerm.task_id == target.task_id))
@@ -0,0 +1,256 @@
+# project/sessions.py
+
+
+import binascii
+import datetime
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from flask.sessions import SecureCookieSessionInterface, SessionInterface, SessionMixin, \
+    session_json_serializer
+from itsdangerous import BadSignature
+from werkzeug.datastructures import CallbackDict
+
+from project import app, db
+from project.models import UserSession
+
+
+# server-side sessions
+#
+# instead of signing the whole session into the cookie, the cookie carries a
+# random session id and the data lives in a store. That makes sessions
+# revocable (one, or all of a user's at once) and drops the per-request
+# signing. Expiry is sliding: every request pushes it SESSION_IDLE_SECONDS
+# into the future, but the store is only written when the data changed or
+# the stored expiry is more than SESSION_REFRESH_SECONDS old.
+#
+# Only logged-in sessions are stored. Anonymous ones (a CSRF token, a flashed
+# message) stay in a signed cookie as before, so anonymous traffic can't
+# evict logged-in sessions from the store or grow the sessions table.
+
+
+class ServerSession(CallbackDict, SessionMixin):
+
+    def __init__(self, initial=None, sid=None, new=False, expires=None):
+        def on_update(self):
+            self.modified = True
+        CallbackDict.__init__(self, initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.expires = expires
+        self.modified = False
+        self.regenerated = False
+
+    def regenerate(self):
+        # the data moves to a fresh id when the response is saved and the old
+        # id is deleted, so an id known before login (or logout) is useless
+        self.regenerated = True
+        self.modified = True
+
+
+class ServerSessionInterface(SessionInterface):
+
+    def __init__(self, store, idle_seconds=7200, refresh_seconds=60):
+        self.store = store
+        self.idle_seconds = idle_seconds
+        self.refresh_seconds = refresh_seconds
+        self.cookie_sessions = SecureCookieSessionInterface()
+
+    def new_sid(self):
+        return binascii.hexlify(os.urandom(24)).decode('ascii')
+
+    def open_session(self, app, request):
+        value = request.cookies.get(app.session_cookie_name)
+        if value and '.' in value:
+            # signed anonymous session; a session id never contains a dot
+            try:
+                data, signed = self.cookie_sessions.get_signing_serializer(app).loads(
+                    value, max_age=self.idle_seconds, return_timestamp=True)
+            except BadSignature:
+                pass
+            else:
+                expires = (signed - datetime.datetime(1970, 1, 1)).total_seconds() + \
+                    self.idle_seconds
+                return ServerSession(data, sid=self.new_sid(), new=True, expires=expires)
+        elif value:
+            found = self.store.load(value, time.time())
+            if found is not None:
+                data, expires = found
+                return ServerSession(data, sid=value, expires=expires)
+        return ServerSession(sid=self.new_sid(), new=True)
+
+    def save_session(self, app, session, response):
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if not session:
+            if not session.new:
+                self.store.delete(session.sid)
+            if session.modified or not session.new:
+                response.delete_cookie(app.session_cookie_name, domain=domain, path=path)
+            return
+        now = time.time()
+        stale = session.expires is None or \
+            session.expires - now < self.idle_seconds - self.refresh_seconds
+        user_id = session.get('user_id')
+        if user_id is None:
+            # leaves the store, if it was in it, for a signed cookie
+            if not session.new:
+                self.store.delete(session.sid)
+            elif not (session.modified or stale):
+                return
+            value = self.cookie_sessions.get_signing_serializer(app).dumps(dict(session))
+        else:
+            if session.regenerated:
+                if not session.new:
+                    self.store.delete(session.sid)
+                session.sid = self.new_sid()
+                session.regenerated = False
+            if not (session.modified or session.new or stale):
+                return
+            self.store.save(session.sid, dict(session), user_id, now + self.idle_seconds)
+            value = session.sid
+        expires = now + self.idle_seconds
+        response.set_cookie(
+            app.session_cookie_name, value,
+            expires=datetime.datetime.utcfromtimestamp(expires),
+            httponly=self.get_cookie_httponly(app),
+            domain=domain, path=path,
+            secure=self.get_cookie_secure(app)
+        )
+
+
+class MemorySessionStore(object):
+
+    # in-process LRU: fine for a single worker, lost on restart
+
+    def __init__(self, max_entries=100000):
+        self.max_entries = max_entries
+        self._sessions = OrderedDict()
+        self._by_user = {}
+        self._lock = threading.Lock()
+
+    def load(self, sid, now):
+        with self._lock:
+            entry = self._sessions.pop(sid, None)
+            if entry is None:
+                return None
+            if entry[2] < now:
+                self._forget(sid, entry)
+                return None
+            self._sessions[sid] = entry
+            return dict(entry[0]), entry[2]
+
+    def save(self, sid, data, user_id, expires):
+        with self._lock:
+            old = self._sessions.pop(sid, None)
+            if old is not None:
+                self._forget(sid, old)
+            self._sessions[sid] = (data, user_id, expires)
+            if user_id is not None:
+                self._by_user.setdefault(user_id, set()).add(sid)
+            while len(self._sessions) > self.max_entries:
+                oldest_sid, oldest = self._sessions.popitem(last=False)
+                self._forget(oldest_sid, oldest)
+
+    def delete(self, sid):
+        with self._lock:
+            entry = self._sessions.pop(sid, None)
+            if entry is not None:
+                self._forget(sid, entry)
+
+    def revoke_user(self, user_id):
+        with self._lock:
+            sids = self._by_user.pop(user_id, set())
+            for sid in sids:
+                self._sessions.pop(sid, None)
+            return len(sids)
+
+    def sweep(self, now=None):
+        now = time.time() if now is None else now
+        with self._lock:
+            expired = [(sid, entry) for sid, entry in self._sessions.items() if entry[2] < now]
+            for sid, entry in expired:
+                del self._sessions[sid]
+                self._forget(sid, entry)
+            return len(expired)
+
+    def _forget(self, sid, entry):
+        sids = self._by_user.get(entry[1])
+        if sids is not None:
+            sids.discard(sid)
+            if not sids:
+                del self._by_user[entry[1]]
+
+
+class DatabaseSessionStore(object):
+
+    # rows in the sessions table, written through the engine on their own
+    # connection so they never mix with the request's ORM transaction
+
+    def __init__(self):
+        self.table = UserSession.__table__
+
+    def load(self, sid, now):
+        row = db.engine.execute(
+            db.select([self.table.c.data, self.table.c.expires])
+            .where(self.table.c.sid == sid)
+            .where(self.table.c.expires >= datetime.datetime.utcfromtimestamp(now))
+        ).first()
+        if row is None:
+            return None
+        expires = (row.expires - datetime.datetime(1970, 1, 1)).total_seconds()
+        return session_json_serializer.loads(row.data), expires
+
+    def save(self, sid, data, user_id, expires):
+        values = dict(
+            data=session_json_serializer.dumps(data),
+            user_id=user_id,
+            expires=datetime.datetime.utcfromtimestamp(expires)
+        )
+        updated = db.engine.execute(
+            self.table.update().where(self.table.c.sid == sid).values(**values)).rowcount
+        if not updated:
+            db.engine.execute(self.table.insert().values(sid=sid, **values))
+
+    def delete(self, sid):
+        db.engine.execute(self.table.delete().where(self.table.c.sid == sid))
+
+    def revoke_user(self, user_id):
+        return db.engine.execute(
+            self.table.delete().where(self.table.c.user_id == user_id)).rowcount
+
+    def sweep(self, now=None):
+        now = time.time() if now is None else now
+        return db.engine.execute(self.table.delete().where(
+            self.table.c.expires < datetime.datetime.utcfromtimestamp(now))).rowcount
+
+
+def start_sweeper(store, interval):
+    # daemon thread that deletes expired sessions every `interval` seconds
+    def sweep_forever():
+        while True:
+            time.sleep(interval)
+            try:
+                store.sweep()
+            except Exception:
+                app.logger.exception('session sweep failed')
+    thread = threading.Thread(target=sweep_forever, name='session-sweeper')
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+def make_session_interface(config):
+    if config['SESSION_BACKEND'] == 'database':
+        store = DatabaseSessionStore()
+    else:
+        store = MemorySessionStore(config['SESSION_MAX_ENTRIES'])
+    if config['SESSION_SWEEP_SECONDS']:
+        start_sweeper(store, config['SESSION_SWEEP_SECONDS'])
+    return ServerSessionInterface(
+        store,
+        idle_seconds=config['SESSION_IDLE_SECONDS'],
+        refresh_seconds=config['SESSION_REFRESH_SECONDS']
+    )
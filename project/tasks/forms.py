@@ -5,6 +5,8 @@ from flask_wtf import Form
 from wtforms import StringField, DateField, IntegerField, SelectField
 from wtforms.validators import DataRequired
 
+from project.models import Task
+
 
 class AddTaskForm(Form):
     task_id = IntegerField()
@@ -25,4 +27,12 @@ class AddTaskForm(Form):
             ('9', '9'), ('10', '10')
         ]
     )
-    status = IntegerField('Status')
\ No newline at end of file
+    status = IntegerField('Status', default=Task.OPEN)
+
+
+class BulkTaskForm(Form):
+    action = SelectField(
+        'Action',
+        validators=[DataRequired()],
+        choices=[('complete', 'Mark as Complete'), ('delete', 'Delete')]
+    )
\ No newline at end of file
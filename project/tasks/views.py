@@ -6,12 +6,23 @@
 #################
 
 import datetime
-from functools import wraps
-from flask import flash, redirect, render_template, request, session, url_for, Blueprint
+import hashlib
+import time
+from flask import flash, jsonify, make_response, redirect, render_template, request, session, \
+    stream_with_context, url_for, Blueprint, Response
+from jinja2 import Markup
+from werkzeug.http import is_resource_modified
 
-from .forms import AddTaskForm
-from project import db
-from project.models import Task
+from .forms import AddTaskForm, BulkTaskForm
+from project import app, db
+from project.auth import current_principal, is_admin, login_required
+from project.counters import task_added, task_summary, tasks_changing, tasks_completed, \
+    tasks_deleted
+from project.exporter import export_tasks
+from project.listing import ListingError, TaskListing, parse_listing
+from project.models import DataVersion, Task
+from project.pagination import keyset_paginate
+from project.search import search_tasks, unindex_tasks
 
 
 ################
@@ -20,26 +31,236 @@ from project.models import Task
 
 tasks_blueprint = Blueprint('tasks', __name__)
 
+BULK_RESULTS = {'complete': 'completed', 'delete': 'deleted'}
+
 
 ##########################
 #### helper functions ####
 ##########################
 
-def login_required(test):
-    @wraps(test)
-    def wrap(*args, **kwargs):
-        if 'logged_in' in session:
-            return test(*args, **kwargs)
-        else:
-            flash('You need to login first.')
-            return redirect(url_for('users.login'))
-    return wrap
-
 def open_tasks():
-    return db.session.query(Task).filter_by(status='1').order_by(Task.due_date.asc())
+    return TaskListing(Task.OPEN).query()
 
 def closed_tasks():
-    return db.session.query(Task).filter_by(status='0').order_by(Task.due_date.asc())
+    return TaskListing(Task.CLOSED).query()
+
+# the ownership check is part of the UPDATE/DELETE itself, so a write is a
+# single statement and its rowcount tells us whether it was allowed
+def writable(query):
+    if not is_admin():
+        query = query.filter(Task.user_id == current_principal().id)
+    return query
+
+def writable_task(task_id):
+    return writable(db.session.query(Task).filter(Task.task_id == task_id))
+
+def complete_tasks(query):
+    # only open tasks are closed, so a task completed twice, or by two
+    # requests at once, is counted once; returns how many were closed
+    query = query.filter(Task.status == Task.OPEN)
+    changes = tasks_changing(query)
+    completed = query.update({'status': Task.CLOSED}, synchronize_session=False)
+    tasks_completed(changes, completed)
+    return completed
+
+def delete_tasks(query):
+    # returns how many were deleted
+    changes = tasks_changing(query)
+    unindex_tasks(query)
+    deleted = query.delete(synchronize_session=False)
+    tasks_deleted(changes, deleted)
+    return deleted
+
+def task_exists(task_id):
+    return db.session.query(Task.task_id).filter_by(task_id=task_id).first() is not None
+
+def task_writable(task_id):
+    return writable_task(task_id).with_entities(Task.task_id).first() is not None
+
+def apply_bulk_action(action, task_ids):
+    # one SELECT to find the ids we may touch, one set-based UPDATE/DELETE,
+    # and a single commit; returns a result per requested id
+    task_ids = set(task_ids)
+    allowed = set(row.task_id for row in writable(
+        db.session.query(Task.task_id).filter(Task.task_id.in_(task_ids))))
+    refused = task_ids - allowed
+    existing = set()
+    if refused:
+        existing = set(row.task_id for row in
+            db.session.query(Task.task_id).filter(Task.task_id.in_(refused)))
+    if allowed:
+        query = writable(db.session.query(Task).filter(Task.task_id.in_(allowed)))
+        if action == 'complete':
+            complete_tasks(query)
+        else:
+            delete_tasks(query)
+        commit_task_changes('open', 'closed')
+    results = {}
+    for task_id in task_ids:
+        if task_id in allowed:
+            results[task_id] = BULK_RESULTS[action]
+        elif task_id in existing:
+            results[task_id] = 'forbidden'
+        else:
+            results[task_id] = 'not found'
+    return results
+
+def flash_bulk_results(results):
+    counts = {}
+    for result in results.values():
+        counts[result] = counts.get(result, 0) + 1
+    for result in ('completed', 'deleted'):
+        if result in counts:
+            flash('{0} task(s) {1}.'.format(counts[result], result))
+    if 'forbidden' in counts:
+        flash('{0} task(s) skipped: you can only change tasks that belong to you.'.format(
+            counts['forbidden']))
+    if 'not found' in counts:
+        flash('{0} task(s) skipped: they no longer exist.'.format(counts['not found']))
+
+def wants_json():
+    return request.accept_mimetypes.best == 'application/json'
+
+def per_page():
+    try:
+        size = int(request.args.get('per_page', app.config['TASKS_PER_PAGE']))
+    except ValueError:
+        size = app.config['TASKS_PER_PAGE']
+    return max(1, min(size, app.config['TASKS_MAX_PER_PAGE']))
+
+def task_cache():
+    return app.extensions['task_cache']
+
+def task_row(task):
+    # plain values only, so a cached page doesn't hold on to ORM objects
+    return dict(
+        task_id=task.task_id,
+        name=task.name,
+        due_date=task.due_date,
+        posted_date=task.posted_date,
+        priority=task.priority,
+        poster_name=task.poster.name if task.poster else None
+    )
+
+def task_page(listing, prefix):
+    # each list keeps its own cursor, e.g. ?open_after=...&closed_before=...
+    after = request.args.get(prefix + '_after')
+    before = request.args.get(prefix + '_before')
+    size = per_page()
+    cache = task_cache()
+    key = 'tasks:{0}:{1}:{2}:{3}:{4}:{5}'.format(
+        prefix, cache.counter('tasks:' + prefix), listing.cache_key(),
+        after or '', before or '', size)
+    page = cache.get(key)
+    if page is None:
+        page = keyset_paginate(
+            listing.query(),
+            listing.columns,
+            after=after,
+            before=before,
+            per_page=size,
+            descending=listing.descending
+        )
+        page.items = [task_row(task) for task in page.items]
+        cache.set(key, page)
+    return page
+
+def invalidate_task_lists(*lists):
+    # bumping a list's generation orphans every cached page of it
+    cache = task_cache()
+    for name in lists:
+        cache.incr('tasks:' + name)
+
+def bump_version(name):
+    now = datetime.datetime.utcnow().replace(microsecond=0)
+    updated = db.session.query(DataVersion).filter_by(name=name).update(
+        {'version': DataVersion.version + 1, 'updated': now},
+        synchronize_session=False
+    )
+    if not updated:
+        # the rows are seeded, never inserted here, where two writers could race
+        raise LookupError('no data_versions row for {0!r}; run db_migrate.py'.format(name))
+
+def commit_task_changes(*lists):
+    # the version stamp is bumped in the same transaction as the write
+    bump_version('tasks')
+    db.session.commit()
+    invalidate_task_lists(*lists)
+
+def listing_validators():
+    # ETag / Last-Modified for the tasks page, from one primary key lookup.
+    # The page also embeds a CSRF token that expires, so validators roll over
+    # every half WTF_CSRF_TIME_LIMIT to make sure stale tokens get replaced.
+    row = db.session.query(DataVersion.version, DataVersion.updated).filter_by(
+        name='tasks').first()
+    version, updated = row if row is not None else (0, None)
+    window = max(1, app.config.get('WTF_CSRF_TIME_LIMIT', 3600) // 2)
+    epoch = int(time.time()) // window
+    epoch_start = datetime.datetime.utcfromtimestamp(epoch * window)
+    last_modified = max(updated, epoch_start) if updated else epoch_start
+    etag = hashlib.md5('{0}:{1}:{2}:{3}:{4}'.format(
+        version, epoch, current_principal().id, current_principal().role,
+        request.query_string.decode('utf-8')
+    ).encode('utf-8')).hexdigest()
+    return etag, last_modified
+
+def set_validators(response, etag, last_modified):
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.vary.add('Cookie')
+    return response
+
+def render_task_rows(page, kind):
+    # each <tr> is cached under the row's own values, so a row is only
+    # rendered again (url_for calls included) after the task itself changes
+    use_cache = app.config['TASK_ROW_CACHE']
+    cache = app.extensions['task_row_cache']
+    template = None
+    rows = []
+    for task in page:
+        key = (kind, task['task_id'], task['name'], task['due_date'],
+               task['posted_date'], task['priority'], task['poster_name'])
+        html = cache.get(key) if use_cache else None
+        if html is None:
+            if template is None:
+                template = app.jinja_env.get_template('_task_row.html')
+            html = template.render(task=task, kind=kind)
+            if use_cache:
+                cache.set(key, html)
+        rows.append(html)
+    return Markup(''.join(rows))
+
+def page_url(prefix, direction, cursor):
+    args = request.args.to_dict()
+    args.pop(prefix + '_after', None)
+    args.pop(prefix + '_before', None)
+    args[prefix + '_' + direction] = cursor
+    return url_for('tasks.tasks', **args)
+
+def task_listings():
+    # the filters and sort in the query string apply to both lists; a
+    # combination that isn't supported falls back to the default listing
+    try:
+        listing = parse_listing(request.args, Task.OPEN)
+        return listing, listing.for_status(Task.CLOSED), None
+    except ListingError as e:
+        return TaskListing(Task.OPEN), TaskListing(Task.CLOSED), str(e)
+
+def render_tasks(form, error=None):
+    open_listing, closed_listing, listing_error = task_listings()
+    return render_template(
+        'tasks.html',
+        form=form,
+        error=error,
+        listing_error=listing_error,
+        counts=task_summary(current_principal().id),
+        open_tasks=task_page(open_listing, 'open'),
+        closed_tasks=task_page(closed_listing, 'closed'),
+        bulk_form=BulkTaskForm(),
+        render_task_rows=render_task_rows,
+        page_url=page_url
+    )
 
 
 ################
@@ -49,12 +270,13 @@ def closed_tasks():
 @tasks_blueprint.route('/tasks/')
 @login_required
 def tasks():
-    return render_template(
-        'tasks.html',
-        form=AddTaskForm(request.form),
-        open_tasks=open_tasks(),
-        closed_tasks=closed_tasks()
-    )
+    etag, last_modified = listing_validators()
+    # pending flash messages must be rendered, so never answer 304 with them
+    if '_flashes' not in session and not is_resource_modified(
+            request.environ, etag=etag, last_modified=last_modified):
+        return set_validators(Response(status=304), etag, last_modified)
+    response = make_response(render_tasks(AddTaskForm(request.form)))
+    return set_validators(response, etag, last_modified)
 
 @tasks_blueprint.route('/add/', methods=['GET', 'POST'])
 @login_required
@@ -68,45 +290,104 @@ def new_task():
                 form.due_date.data,
                 form.priority.data,
                 datetime.datetime.utcnow(),
-                '1',
-                session['user_id']
+                Task.OPEN,
+                current_principal().id
             )
             db.session.add(new_task)
-            db.session.commit()
+            db.session.flush()
+            task_added(new_task)
+            commit_task_changes('open')
             flash('New entry was successfully posted. Thanks.')
             return redirect(url_for('tasks.tasks'))
-    return render_template(
-        'tasks.html',
-        form=form,
-        error=error,
-        open_tasks=open_tasks(),
-        closed_tasks=closed_tasks()
-    )
+    return render_tasks(form, error)
 
 @tasks_blueprint.route('/complete/<int:task_id>/')
 @login_required
 def complete(task_id):
-    new_id = task_id
-    task = db.session.query(Task).filter_by(task_id=new_id)
-    if session['user_id'] == task.first().user_id or session['role'] == 'admin':
-        task.update({'status': '0'})
-        db.session.commit()
+    # the per-user counts change in the same transaction as the task
+    if complete_tasks(writable_task(task_id)):
+        commit_task_changes('open', 'closed')
         flash('The task is complete! Nice.')
-        return redirect(url_for('tasks.tasks'))
-    else:
+    elif task_writable(task_id):
+        # already closed
+        flash('The task is complete! Nice.')
+    elif task_exists(task_id):
         flash('You can only update tasks that belong to you.')
-        return redirect(url_for('tasks.tasks'))
+    else:
+        flash('That task does not exist.')
+    return redirect(url_for('tasks.tasks'))
 
 @tasks_blueprint.route('/delete/<int:task_id>/')
 @login_required
 def delete_entry(task_id):
-    new_id = task_id
-    task = db.session.query(Task).filter_by(task_id=new_id)
-    if session['user_id'] == task.first().user_id or session['role'] == 'admin':
-        task.delete()
-        db.session.commit()
+    if delete_tasks(writable_task(task_id)):
+        commit_task_changes('open', 'closed')
         flash('The task was deleted.')
-        return redirect(url_for('tasks.tasks'))
-    else:
+    elif task_exists(task_id):
         flash('You can only delete tasks that belong to you.')
-        return redirect(url_for('tasks.tasks'))
\ No newline at end of file
+    else:
+        flash('That task does not exist.')
+    return redirect(url_for('tasks.tasks'))
+
+@tasks_blueprint.route('/bulk/', methods=['POST'])
+@login_required
+def bulk():
+    form = BulkTaskForm(request.form)
+    task_ids = request.form.getlist('task_ids', type=int)
+    if not form.validate_on_submit() or not task_ids:
+        error = 'Select at least one task and an action.'
+    elif len(task_ids) > app.config['TASKS_MAX_BULK']:
+        error = 'You can change at most {0} tasks at once.'.format(
+            app.config['TASKS_MAX_BULK'])
+    else:
+        error = None
+    if error is not None:
+        if wants_json():
+            return jsonify(error=error), 400
+        flash(error)
+        return redirect(url_for('tasks.tasks'))
+    results = apply_bulk_action(form.action.data, task_ids)
+    if wants_json():
+        return jsonify(results=[
+            dict(task_id=task_id, result=results[task_id]) for task_id in sorted(results)
+        ])
+    flash_bulk_results(results)
+    return redirect(url_for('tasks.tasks'))
+
+@tasks_blueprint.route('/tasks/export/')
+@login_required
+def export():
+    # admins get every task, everyone else their own
+    fmt = request.args.get('format', 'csv')
+    if fmt not in ('csv', 'jsonl'):
+        fmt = 'csv'
+    compress = request.args.get('gzip') == '1'
+    user_id = None if is_admin() else current_principal().id
+    filename = 'tasks.' + fmt + ('.gz' if compress else '')
+    mimetype = 'application/gzip' if compress else \
+        'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    response = Response(
+        stream_with_context(export_tasks(fmt, user_id, compress)), mimetype=mimetype)
+    response.headers['Content-Disposition'] = 'attachment; filename=' + filename
+    return response
+
+@tasks_blueprint.route('/tasks/search/')
+@login_required
+def search():
+    query = request.args.get('q', '').strip()
+    page = request.args.get('page', 1, type=int)
+    page = max(1, min(page, app.config['SEARCH_MAX_PAGE']))
+    size = per_page()
+    tasks, has_next = search_tasks(query, page, size)
+    if wants_json():
+        return jsonify(
+            query=query, page=page, has_next=has_next,
+            tasks=[dict(task_row(task), due_date=task.due_date.isoformat(),
+                        posted_date=task.posted_date.isoformat() if task.posted_date else None,
+                        status='open' if task.status == Task.OPEN else 'closed')
+                   for task in tasks]
+        )
+    return render_template(
+        'search.html', query=query, tasks=tasks, page=page, has_next=has_next,
+        per_page=size, OPEN=Task.OPEN
+    )
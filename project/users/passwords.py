@@ -0,0 +1,84 @@
+# project/users/passwords.py
+
+
+import multiprocessing
+
+from werkzeug.security import check_password_hash, generate_password_hash, safe_str_cmp
+
+from project import app, db
+from project.models import User
+
+
+# password hashing
+#
+# hashes are stored as werkzeug's "method$salt$hash", where the method
+# carries the work factor, e.g. "pbkdf2:sha256:50000". Changing
+# PASSWORD_HASH_METHOD only affects new hashes; existing ones are upgraded the
+# next time their owner logs in. Rows that still hold a plaintext password
+# (from before hashing existed) keep working until hash_plaintext_passwords()
+# or a login converts them.
+
+
+def hash_with(method, salt_length, password):
+    return generate_password_hash(password, method=method, salt_length=salt_length)
+
+def hash_password(password):
+    return hash_with(
+        app.config['PASSWORD_HASH_METHOD'], app.config['PASSWORD_SALT_LENGTH'], password)
+
+def is_hashed(stored):
+    return stored.startswith('pbkdf2:') and stored.count('$') == 2
+
+def verify_password(stored, password):
+    if is_hashed(stored):
+        return check_password_hash(stored, password)
+    return safe_str_cmp(stored, password)
+
+def needs_rehash(stored):
+    return not is_hashed(stored) or \
+        stored.split('$', 1)[0] != app.config['PASSWORD_HASH_METHOD']
+
+
+# bulk conversion of plaintext passwords
+
+def _hash_row(args):
+    user_id, password, method, salt_length = args
+    return dict(user_id=user_id, old_password=password,
+                new_password=hash_with(method, salt_length, password))
+
+def hash_plaintext_passwords(batch_size=1000, processes=None):
+    # walks the users table by id in batches; each batch is hashed on a
+    # process pool and written back with one executemany. The update only
+    # matches the password that was read, so a password changed in between
+    # is left alone rather than overwritten with the hash of the old one
+    method = app.config['PASSWORD_HASH_METHOD']
+    salt_length = app.config['PASSWORD_SALT_LENGTH']
+    users = User.__table__
+    update = users.update().where(db.and_(
+        users.c.id == db.bindparam('user_id'),
+        users.c.password == db.bindparam('old_password'),
+    )).values(password=db.bindparam('new_password'))
+    pool = multiprocessing.Pool(processes)
+    converted = 0
+    last_id = 0
+    try:
+        while True:
+            rows = db.engine.execute(
+                db.select([users.c.id, users.c.password])
+                .where(users.c.id > last_id)
+                .order_by(users.c.id)
+                .limit(batch_size)
+            ).fetchall()
+            if not rows:
+                break
+            last_id = rows[-1].id
+            work = [(row.id, row.password, method, salt_length)
+                    for row in rows if not is_hashed(row.password)]
+            if work:
+                hashed = pool.map(_hash_row, work)
+                db.engine.execute(update, hashed)
+                converted += len(hashed)
+    finally:
+        pool.close()
+        pool.join()
+    return converted
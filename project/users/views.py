@@ -5,12 +5,14 @@
 #### imports ####
 #################
 
-from functools import wraps
-from flask import flash, redirect, render_template, request, session, url_for, Blueprint
+import math
+from flask import flash, redirect, render_template, request, url_for, Blueprint
 from sqlalchemy.exc import IntegrityError
 
 from .forms import RegisterForm, LoginForm
-from project import db
+from .passwords import hash_password, needs_rehash, verify_password
+from project import app, db
+from project.auth import log_in, log_out, login_required
 from project.models import User
 
 
@@ -25,15 +27,16 @@ users_blueprint = Blueprint('users', __name__)
 #### helper functions ####
 ##########################
 
-def login_required(test):
-    @wraps(test)
-    def wrap(*args, **kwargs):
-        if 'logged_in' in session:
-            return test(*args, **kwargs)
-        else:
-            flash('You need to login first.')
-            return redirect(url_for('users.login'))
-    return wrap
+def login_retry_after():
+    if not app.config['LOGIN_LIMIT_ENABLED']:
+        return 0
+    return app.extensions['login_limiter'].retry_after(
+        request.form.get('name', ''), request.remote_addr)
+
+def login_failed():
+    if app.config['LOGIN_LIMIT_ENABLED']:
+        app.extensions['login_limiter'].failed(
+            request.form.get('name', ''), request.remote_addr)
 
 
 ################
@@ -43,9 +46,7 @@ def login_required(test):
 @users_blueprint.route('/logout/')
 @login_required
 def logout():
-    session.pop('logged_in', None)
-    session.pop('user_id', None)
-    session.pop('role', None)
+    log_out()
     flash('Goodbye!')
     return redirect(url_for('users.login'))
 
@@ -54,15 +55,24 @@ def login():
     error = None
     form = LoginForm(request.form)
     if request.method == 'POST':
+        # throttled before the form is even looked up in the database
+        retry_after = login_retry_after()
+        if retry_after:
+            error = 'Too many login attempts. Please try again in {0} seconds.'.format(
+                int(math.ceil(retry_after)))
+            return render_template('login.html', form=form, error=error), 429
         if form.validate_on_submit():
             user = User.query.filter_by(name=request.form['name']).first()
-            if user is not None and user.password == request.form['password']:
-                session['logged_in'] = True
-                session['user_id'] = user.id
-                session['role'] = user.role
+            if user is not None and user.active and \
+                    verify_password(user.password, request.form['password']):
+                if needs_rehash(user.password):
+                    user.password = hash_password(request.form['password'])
+                    db.session.commit()
+                log_in(user)
                 flash('Welcome!')
                 return redirect(url_for('tasks.tasks'))
             else:
+                login_failed()
                 error = 'Invalid username or password.'
     return render_template('login.html', form=form, error=error)
 
@@ -75,7 +85,7 @@ def register():
             new_user = User(
                 form.name.data,
                 form.email.data,
-                form.password.data,
+                hash_password(form.password.data),
             )
             try:
                 db.session.add(new_user)
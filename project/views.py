@@ -1,7 +1,6 @@
 # project/views.py
 
 
-from functools import wraps
 import datetime
 
 from flask import Flask, flash, redirect, render_template, request, session, url_for
@@ -11,6 +10,7 @@ from sqlalchemy.exc import IntegrityError
 from forms import AddTaskForm, RegisterForm, LoginForm
 
 from project import app, db
+from project.auth import login_required
 
 # config
 
@@ -19,21 +19,11 @@ from models import Task, User
 
 # helper functions
 
-def login_required(test):
-    @wraps(test)
-    def wrap(*args, **kwargs):
-        if 'logged_in' in session:
-            return test(*args, **kwargs)
-        else:
-            flash('You need to login first.')
-            return redirect(url_for('login'))
-    return wrap
-
 def open_tasks():
-    return db.session.query(Task).filter_by(status='1').order_by(Task.due_date.asc())
+    return db.session.query(Task).filter_by(status=Task.OPEN).order_by(Task.due_date.asc())
 
 def closed_tasks():
-    return db.session.query(Task).filter_by(status='0').order_by(Task.due_date.asc())
+    return db.session.query(Task).filter_by(status=Task.CLOSED).order_by(Task.due_date.asc())
 
 
 # route handlers
@@ -108,7 +98,7 @@ def new_task():
                 form.due_date.data,
                 form.priority.data,
                 datetime.datetime.now(),
-                '1',
+                Task.OPEN,
                 session['user_id']
             )
             db.session.add(new_task)
@@ -130,7 +120,7 @@ def complete(task_id):
     new_id = task_id
     task = db.session.query(Task).filter_by(task_id=new_id)
     if session['user_id'] == task.first().user_id or session['role'] == 'admin':
-        task.update({"status":"0"})
+        task.update({"status": Task.CLOSED})
         db.session.commit()
         flash('The task is complete! Nice.')
         return redirect(url_for('tasks'))
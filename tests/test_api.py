@@ -0,0 +1,179 @@
+# tests/test_api.py
+
+
+import json
+import os
+import unittest
+from datetime import date
+
+from project import app, db
+from project._config import basedir
+from project.models import Task, User
+
+TEST_DB = 'test.db'
+
+
+class AllTests(unittest.TestCase):
+
+    ############################
+    #### setup and teardown ####
+    ############################
+
+    # executed prior to each test
+    def setUp(self):
+        app.config['TESTING'] = True
+        app.config['WTF_CSRF_ENABLED'] = False
+        app.config['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256:1000'
+        app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get(
+            'TEST_DATABASE_URL', 'sqlite:///' + os.path.join(basedir, TEST_DB))
+        self.app = app.test_client()
+        app.extensions['task_cache'].clear()
+        app.extensions['login_limiter'].reset()
+        app.extensions['principal_cache'].clear()
+        db.create_all()
+
+    # executed after each test
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+
+
+    ############################
+    ##### helper functions #####
+    ############################
+
+    def login(self, name, password):
+        return self.app.post('/', data=dict(name=name, password=password), follow_redirects=True)
+
+    def create_user(self, name, email, password, role=None):
+        new_user = User(name=name, email=email, password=password, role=role)
+        db.session.add(new_user)
+        db.session.commit()
+
+    def create_tasks(self, count, status=Task.OPEN, user_id=1):
+        for i in range(count):
+            db.session.add(Task(
+                'Task {0:03d}'.format(i), date(2014, 2, 1 + i % 28), 1,
+                date(2014, 1, 1), status, user_id
+            ))
+        db.session.commit()
+
+    def post_json(self, url, data):
+        return self.app.post(url, data=json.dumps(data), content_type='application/json')
+
+    def load(self, response):
+        return json.loads(response.data.decode('utf-8'))
+
+
+    ############################
+    ######## dummy data ########
+    ############################
+
+    michael_create_user = ['Michael', 'michael@realpython.com', 'python']
+    michael_login = ['Michael', 'python']
+
+    fletcher_create_user = ['Fletcher', 'fletcher@realpython.com', 'python']
+
+
+    ############################
+    ######### the tests ########
+    ############################
+
+    def test_api_requires_login(self):
+        response = self.app.get('api/tasks/')
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(self.load(response), dict(error='You need to login first.'))
+
+    def test_tasks_are_streamed_as_json_lines(self):
+        self.create_user(*self.michael_create_user)
+        self.login(*self.michael_login)
+        self.create_tasks(3)
+        self.create_tasks(2, status=Task.CLOSED)
+        response = self.app.get('api/tasks/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        lines = response.data.decode('utf-8').splitlines()
+        self.assertEqual(len(lines), 5)
+        first = json.loads(lines[0])
+        self.assertEqual(first['name'], 'Task 000')
+        self.assertEqual(first['due_date'], '2014-02-01')
+        self.assertEqual(first['poster'], 'Michael')
+        response = self.app.get('api/tasks/?status=closed')
+        lines = response.data.decode('utf-8').splitlines()
+        self.assertEqual([json.loads(line)['status'] for line in lines], ['closed', 'closed'])
+
+    def test_task_listings_can_be_filtered_and_sorted(self):
+        self.create_user(*self.michael_create_user)
+        self.create_user(*self.fletcher_create_user)
+        self.login(*self.michael_login)
+        for name, priority, user_id in [('a', 3, 1), ('b', 7, 1), ('c', 9, 2), ('d', 5, 1)]:
+            db.session.add(Task(name, date(2014, 2, 1), priority, date(2014, 1, 1),
+                                Task.OPEN, user_id))
+        db.session.commit()
+        response = self.app.get(
+            'api/tasks/?status=open&owner=Michael&sort=priority&order=desc&priority_min=4')
+        self.assertEqual([json.loads(line)['name'] for line in response.data.decode('utf-8').splitlines()],
+                         ['b', 'd'])
+        # a range on one column while sorting by another would need a scan
+        response = self.app.get('api/tasks/?status=open&priority_min=4')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.load(response),
+                         dict(error='priority_min can only be used with sort=priority.'))
+        response = self.app.get('api/tasks/?sort=priority')
+        self.assertEqual(response.status_code, 400)
+
+    def test_users_can_create_and_get_tasks(self):
+        self.create_user(*self.michael_create_user)
+        self.login(*self.michael_login)
+        response = self.post_json('api/tasks/', dict(
+            name='Go to the bank', due_date='2014-02-05', priority=1))
+        self.assertEqual(response.status_code, 201)
+        task_id = self.load(response)['task_id']
+        response = self.app.get('api/tasks/{0}/'.format(task_id))
+        self.assertEqual(self.load(response)['name'], 'Go to the bank')
+        self.assertEqual(self.load(response)['status'], 'open')
+
+    def test_invalid_tasks_are_rejected(self):
+        self.create_user(*self.michael_create_user)
+        self.login(*self.michael_login)
+        response = self.post_json('api/tasks/', dict(name='Go to the bank', priority=1))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(db.session.query(Task).count(), 0)
+
+    def test_users_can_complete_and_delete_their_tasks(self):
+        self.create_user(*self.michael_create_user)
+        self.login(*self.michael_login)
+        self.create_tasks(1)
+        response = self.app.post('api/tasks/1/complete/')
+        self.assertEqual(self.load(response), dict(task_id=1, result='completed'))
+        response = self.app.delete('api/tasks/1/')
+        self.assertEqual(self.load(response), dict(task_id=1, result='deleted'))
+        response = self.app.get('api/tasks/1/')
+        self.assertEqual(response.status_code, 404)
+
+    def test_writes_need_the_csrf_token(self):
+        self.create_user(*self.michael_create_user)
+        self.login(*self.michael_login)
+        self.create_tasks(2)
+        app.config['WTF_CSRF_ENABLED'] = True
+        # what a form on another site could send along with the cookie
+        self.assertEqual(self.app.post('api/tasks/1/complete/').status_code, 400)
+        self.assertEqual(self.app.delete('api/tasks/2/').status_code, 400)
+        self.assertEqual(db.session.query(Task).filter_by(status=Task.OPEN).count(), 2)
+        token = self.load(self.app.get('api/csrf-token/'))['csrf_token']
+        headers = {'X-CSRFToken': token}
+        self.assertEqual(self.app.post('api/tasks/1/complete/', headers=headers).status_code, 200)
+        self.assertEqual(self.app.delete('api/tasks/2/', headers=headers).status_code, 200)
+
+    def test_users_cannot_change_tasks_not_created_by_them(self):
+        self.create_user(*self.michael_create_user)
+        self.create_user(*self.fletcher_create_user)
+        self.login(*self.michael_login)
+        self.create_tasks(1, user_id=2)
+        self.assertEqual(self.app.post('api/tasks/1/complete/').status_code, 403)
+        self.assertEqual(self.app.delete('api/tasks/1/').status_code, 403)
+        self.assertEqual(self.app.delete('api/tasks/2/').status_code, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+# tests/test_cache.py
+
+
+import fnmatch
+import time
+import unittest
+
+from project.cache import LocalCache, RedisCache
+
+
+class FakeRedis(object):
+
+    # just enough of redis-py's client for RedisCache
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        value, expires = self.data.get(key, (None, None))
+        if expires is not None and expires < time.time():
+            return None
+        return value
+
+    def set(self, key, value, ex=None):
+        self.data[key] = (value, time.time() + ex if ex else None)
+
+    def incr(self, key):
+        value = int(self.get(key) or 0) + 1
+        self.data[key] = (str(value).encode('ascii'), None)
+        return value
+
+    def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+
+    def scan_iter(self, match='*'):
+        return [key for key in list(self.data) if fnmatch.fnmatch(key, match)]
+
+
+class AllTests(unittest.TestCase):
+
+    def check_backend(self, cache):
+        self.assertIsNone(cache.get('missing'))
+        cache.set('page', {'items': [1, 2]})
+        self.assertEqual(cache.get('page'), {'items': [1, 2]})
+        cache.set('gone', 1)
+        cache.delete('gone')
+        self.assertIsNone(cache.get('gone'))
+        self.assertEqual(cache.counter('tasks:open'), 0)
+        self.assertEqual(cache.incr('tasks:open'), 1)
+        self.assertEqual(cache.counter('tasks:open'), 1)
+        cache.set('short', 'value', ttl=-1)
+        self.assertIsNone(cache.get('short'))
+        cache.clear()
+        self.assertIsNone(cache.get('page'))
+        self.assertEqual(cache.counter('tasks:open'), 0)
+
+    def test_local_cache(self):
+        self.check_backend(LocalCache())
+
+    def test_redis_cache(self):
+        self.check_backend(RedisCache(FakeRedis()))
+
+    def test_local_cache_evicts_least_recently_used(self):
+        cache = LocalCache(max_entries=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), 3)
+
+    def test_local_cache_never_evicts_counters(self):
+        cache = LocalCache(max_entries=1)
+        cache.incr('tasks:open')
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(cache.counter('tasks:open'), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+# tests/test_database.py
+
+
+import os
+import unittest
+
+from sqlalchemy import create_engine
+from sqlalchemy.pool import QueuePool
+
+from project import app, db
+from project._config import basedir
+
+TEST_DB = 'test.db'
+
+
+class AllTests(unittest.TestCase):
+
+    ############################
+    #### setup and teardown ####
+    ############################
+
+    # executed prior to each test
+    def setUp(self):
+        app.config['TESTING'] = True
+        app.config['WTF_CSRF_ENABLED'] = False
+        app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get(
+            'TEST_DATABASE_URL', 'sqlite:///' + os.path.join(basedir, TEST_DB))
+        self.app = app.test_client()
+        db.create_all()
+
+    # executed after each test
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+
+
+    ############################
+    ######### the tests ########
+    ############################
+
+    def test_sqlite_pragmas_are_applied_to_new_connections(self):
+        if db.engine.dialect.name != 'sqlite':
+            raise unittest.SkipTest('SQLite only')
+        connection = db.engine.connect()
+        try:
+            pragma = lambda name: connection.execute('PRAGMA ' + name).scalar()
+            self.assertEqual(pragma('journal_mode'), 'wal')
+            self.assertEqual(pragma('busy_timeout'), 5000)
+            self.assertEqual(pragma('synchronous'), 1)
+            self.assertEqual(pragma('cache_size'), -20000)
+        finally:
+            connection.close()
+
+    def test_pre_ping_replaces_dead_pooled_connections(self):
+        engine = create_engine(
+            app.config['SQLALCHEMY_DATABASE_URI'], poolclass=QueuePool, pool_size=1,
+            pool_reset_on_return=None)
+        app.config['DATABASE_POOL_PRE_PING'] = True
+        try:
+            connection = engine.connect()
+            connection.connection.connection.close()
+            connection.close()
+            connection = engine.connect()
+            self.assertEqual(connection.execute('SELECT 1').scalar(), 1)
+            connection.close()
+        finally:
+            app.config['DATABASE_POOL_PRE_PING'] = False
+            engine.dispose()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,143 @@
+# tests/test_importer.py
+
+
+import datetime
+import io
+import os
+import unittest
+
+from project import app, db
+from project._config import basedir
+from project.counters import task_summary
+from project.importer import import_tasks, import_users, read_records
+from project.models import Task, TaskTerm, User
+from project.search import search_tasks
+from project.users.passwords import verify_password
+
+TEST_DB = 'test.db'
+
+USERS_CSV = u"""name,email,password,role
+Michael,michael@realpython.com,python,
+Fletcher,fletcher@realpython.com,python,admin
+Nobody,,python,
+Imposter,michael@realpython.com,python,
+Fletcher,someone@realpython.com,python,
+"""
+
+TASKS_JSONL = u"""{"name": "Run around in circles", "due_date": "2016-03-01", "priority": 1, "poster": "Michael"}
+{"name": "Purchase Real Python", "due_date": "03/02/2016", "priority": "10", "poster": "Fletcher", "status": "closed"}
+
+{"name": "Ghost task", "due_date": "2016-03-03", "priority": 1, "poster": "Casper"}
+{"name": "Bad date", "due_date": "soon", "priority": 1, "poster": "Michael"}
+{"name": "By id", "due_date": "2016-03-04", "priority": 5, "user_id": 1, "status": 0, "posted_date": "2016-01-01"}
+{"name": "Listed date", "due_date": ["2016-03-05"], "priority": 1, "poster": "Michael"}
+{"name": "Urgent", "due_date": "2016-03-05", "priority": 11, "poster": "Michael"}
+"""
+
+MALFORMED_JSONL = u"""not json
+[1, 2]
+{"name": 123, "due_date": "2016-03-01", "priority": 1, "poster": "Michael"}
+{"name": "Listed poster", "due_date": "2016-03-01", "priority": 1, "poster": ["a"]}
+{"name": "Float status", "due_date": "2016-03-01", "priority": 1, "poster": "Michael", "status": 1.0}
+{"name": "Listed id", "due_date": "2016-03-01", "priority": 1, "user_id": [1]}
+{"name": "Still imported", "due_date": "2016-03-01", "priority": 1, "poster": "Michael"}
+"""
+
+
+class AllTests(unittest.TestCase):
+
+    ############################
+    #### setup and teardown ####
+    ############################
+
+    # executed prior to each test
+    def setUp(self):
+        app.config['TESTING'] = True
+        app.config['WTF_CSRF_ENABLED'] = False
+        app.config['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256:1000'
+        app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get(
+            'TEST_DATABASE_URL', 'sqlite:///' + os.path.join(basedir, TEST_DB))
+        self.app = app.test_client()
+        db.create_all()
+
+    # executed after each test
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+
+
+    ############################
+    ##### helper functions #####
+    ############################
+
+    def import_users(self):
+        lines = io.StringIO(USERS_CSV)
+        if str is bytes:
+            lines = io.BytesIO(USERS_CSV.encode('utf-8'))
+        return import_users(read_records(lines, 'csv'), chunk_size=2)
+
+    def import_tasks(self, **kwargs):
+        return import_tasks(read_records(io.StringIO(TASKS_JSONL), 'jsonl'), chunk_size=2, **kwargs)
+
+
+    ###############
+    #### tests ####
+    ###############
+
+    def test_users_are_imported_with_hashed_passwords(self):
+        result = self.import_users()
+        self.assertEqual(result.imported, 2)
+        # the duplicates are rejected without losing the rest of their chunk
+        self.assertEqual([number for number, reason in result.errors], [3, 4, 5])
+        self.assertEqual(result.errors[0][1], 'name, email and password are required')
+        fletcher = User.query.filter_by(name='Fletcher').one()
+        self.assertEqual(fletcher.role, 'admin')
+        self.assertEqual(User.query.filter_by(name='Michael').one().role, 'user')
+        self.assertTrue(verify_password(fletcher.password, 'python'))
+        self.assertNotEqual(fletcher.password, 'python')
+
+    def test_tasks_are_imported_and_posters_resolved(self):
+        self.import_users()
+        result = self.import_tasks()
+        self.assertEqual(result.imported, 3)
+        self.assertEqual([number for number, reason in result.errors], [3, 4, 6, 7])
+        self.assertIn('Casper', result.errors[0][1])
+        self.assertIn('bad date', result.errors[2][1])
+        self.assertIn('bad priority', result.errors[3][1])
+        tasks = Task.query.order_by(Task.task_id).all()
+        self.assertEqual([task.poster.name for task in tasks], ['Michael', 'Fletcher', 'Michael'])
+        self.assertEqual([task.status for task in tasks], [Task.OPEN, Task.CLOSED, Task.CLOSED])
+        self.assertEqual(tasks[1].due_date, datetime.date(2016, 3, 2))
+        self.assertEqual(tasks[1].priority, 10)
+        self.assertEqual(tasks[2].posted_date, datetime.date(2016, 1, 1))
+
+    def test_malformed_records_are_rejected(self):
+        self.import_users()
+        result = import_tasks(read_records(io.StringIO(MALFORMED_JSONL), 'jsonl'), chunk_size=2)
+        self.assertEqual(result.imported, 1)
+        self.assertEqual([number for number, reason in result.errors], [1, 2, 3, 4, 5, 6])
+        self.assertIn('bad JSON', result.errors[0][1])
+        self.assertIn('not an object', result.errors[1][1])
+        self.assertIn('bad user_id', result.errors[5][1])
+        # the import ran to the end, so the counts were brought up to date
+        self.assertEqual(task_summary(1)['open'], 1)
+
+    def test_imported_tasks_are_searchable_with_the_term_index(self):
+        app.config['SEARCH_BACKEND'] = 'terms'
+        self.addCleanup(app.config.__setitem__, 'SEARCH_BACKEND', 'auto')
+        self.import_users()
+        self.import_tasks()
+        self.assertEqual([task.name for task in search_tasks('purchase')[0]],
+                         ['Purchase Real Python'])
+        self.assertEqual(TaskTerm.query.filter_by(task_id=1).count(), 4)
+
+    def test_deferred_indexes_are_rebuilt(self):
+        self.import_users()
+        self.import_tasks(defer_indexes=True)
+        indexes = set(index['name'] for index in db.inspect(db.engine).get_indexes('tasks'))
+        self.assertEqual(indexes, set(index.name for index in Task.__table__.indexes))
+        self.assertEqual(Task.query.count(), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
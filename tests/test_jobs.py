@@ -0,0 +1,200 @@
+# tests/test_jobs.py
+
+
+import datetime
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from project import app, db
+from project._config import basedir
+from project.jobs import ClaimLost, claim, enqueue, export_tasks_job, finish, handler, run_one
+from project.models import Job, Task, User
+
+TEST_DB = 'test.db'
+
+
+@handler('test.echo')
+def echo(job, payload):
+    return dict(echo=payload['value'])
+
+@handler('test.flaky')
+def flaky(job, payload):
+    # fails until its `succeed_on`th attempt
+    if job.attempts < payload['succeed_on']:
+        raise RuntimeError('boom')
+    return {}
+
+@handler('test.slow')
+def slow(job, payload):
+    # reports whether its claim was extended while it ran
+    def lapse():
+        return db.session.query(Job.run_at).filter_by(id=job.id).scalar()
+    first = lapse()
+    time.sleep(payload['seconds'])
+    db.session.remove()
+    return dict(extended=lapse() > first)
+
+
+class AllTests(unittest.TestCase):
+
+    ############################
+    #### setup and teardown ####
+    ############################
+
+    # executed prior to each test
+    def setUp(self):
+        app.config['TESTING'] = True
+        app.config['WTF_CSRF_ENABLED'] = False
+        app.config['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256:1000'
+        app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get(
+            'TEST_DATABASE_URL', 'sqlite:///' + os.path.join(basedir, TEST_DB))
+        self.output_dir = app.config['JOBS_OUTPUT_DIR']
+        app.config['JOBS_OUTPUT_DIR'] = tempfile.mkdtemp(prefix='flasktaskr-jobs-')
+        self.app = app.test_client()
+        app.extensions['task_cache'].clear()
+        app.extensions['login_limiter'].reset()
+        app.extensions['principal_cache'].clear()
+        db.create_all()
+        self.now = datetime.datetime(2016, 1, 1, 12, 0, 0)
+
+    # executed after each test
+    def tearDown(self):
+        shutil.rmtree(app.config['JOBS_OUTPUT_DIR'])
+        app.config['JOBS_OUTPUT_DIR'] = self.output_dir
+        db.session.remove()
+        db.drop_all()
+
+
+    ############################
+    ##### helper functions #####
+    ############################
+
+    def login(self, name, password):
+        return self.app.post('/', data=dict(name=name, password=password), follow_redirects=True)
+
+    def create_user(self, name, email, password, role=None):
+        new_user = User(name=name, email=email, password=password, role=role)
+        db.session.add(new_user)
+        db.session.commit()
+
+    def queue(self, kind, payload, **options):
+        job = enqueue(kind, payload, **options)
+        job.run_at = job.created = self.now
+        db.session.commit()
+        return job.id
+
+    def job(self, job_id):
+        db.session.remove()
+        return db.session.query(Job).get(job_id)
+
+    def later(self, seconds):
+        return self.now + datetime.timedelta(seconds=seconds)
+
+    def load(self, response):
+        return json.loads(response.data.decode('utf-8'))
+
+
+    ###############
+    #### tests ####
+    ###############
+
+    def test_jobs_are_only_queued_when_the_request_commits(self):
+        enqueue('test.echo', dict(value=1))
+        db.session.rollback()
+        self.assertIsNone(run_one(self.now))
+        job_id = self.queue('test.echo', dict(value=2))
+        self.assertEqual(run_one(self.now).id, job_id)
+        job = self.job(job_id)
+        self.assertEqual((job.status, job.attempts), (Job.DONE, 1))
+        self.assertEqual(json.loads(job.result), dict(echo=2))
+        self.assertIsNone(run_one(self.now))
+
+    def test_failed_jobs_are_retried_with_backoff(self):
+        job_id = self.queue('test.flaky', dict(succeed_on=3))
+        run_one(self.now)
+        job = self.job(job_id)
+        self.assertEqual((job.status, job.attempts, job.last_error),
+                         (Job.QUEUED, 1, 'RuntimeError: boom'))
+        # JOBS_RETRY_BASE_SECONDS, less up to half for jitter
+        base = app.config['JOBS_RETRY_BASE_SECONDS']
+        self.assertTrue(self.later(base / 2.0) <= job.run_at <= self.later(base))
+        self.assertIsNone(run_one(self.now))
+        run_one(self.later(base))
+        # the second wait is twice as long
+        self.assertTrue(self.job(job_id).run_at >= self.later(base + base))
+        run_one(self.later(3 * base))
+        job = self.job(job_id)
+        self.assertEqual((job.status, job.attempts), (Job.DONE, 3))
+
+    def test_jobs_fail_once_out_of_attempts(self):
+        job_id = self.queue('test.flaky', dict(succeed_on=10), max_attempts=2)
+        run_one(self.now)
+        run_one(self.later(3600))
+        job = self.job(job_id)
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, 2))
+        self.assertIsNone(run_one(self.later(7200)))
+
+    def test_lapsed_claims_are_run_again(self):
+        job_id = self.queue('test.echo', dict(value=3), timeout=60)
+        # a worker claims the job and dies
+        lost = claim(self.now)
+        self.assertIsNone(run_one(self.later(30)))
+        self.assertEqual(run_one(self.later(61)).id, job_id)
+        job = self.job(job_id)
+        self.assertEqual((job.status, job.attempts), (Job.DONE, 2))
+        # the first worker's claim is gone, so it can't record an outcome
+        self.assertEqual(finish(lost, Job.FAILED, self.later(62), error='late'), 0)
+        self.assertEqual(self.job(job_id).status, Job.DONE)
+
+    def test_running_jobs_keep_their_claim(self):
+        job_id = self.queue('test.slow', dict(seconds=0.8), timeout=1)
+        db.session.query(Job).filter_by(id=job_id).update(dict(run_at=datetime.datetime.utcnow()))
+        db.session.commit()
+        run_one()
+        job = self.job(job_id)
+        self.assertEqual((job.status, json.loads(job.result)), (Job.DONE, dict(extended=True)))
+
+    def test_exports_from_a_lapsed_claim_are_discarded(self):
+        self.queue('export_tasks', dict(format='csv'), timeout=60)
+        lost = claim(self.now)
+        current = claim(self.later(61))
+        with self.assertRaises(ClaimLost):
+            export_tasks_job(lost, json.loads(lost.payload))
+        self.assertEqual(os.listdir(app.config['JOBS_OUTPUT_DIR']), [])
+        result = export_tasks_job(current, json.loads(current.payload))
+        self.assertEqual(os.listdir(app.config['JOBS_OUTPUT_DIR']), [result['file']])
+
+    def test_exports_run_in_the_background(self):
+        self.create_user('Michael', 'michael@realpython.com', 'python')
+        self.create_user('Fletcher', 'fletcher@realpython.com', 'python')
+        db.session.add(Task('Buy milk', datetime.date(2016, 1, 2), 1,
+                            datetime.date(2016, 1, 1), Task.OPEN, 1))
+        db.session.commit()
+        self.login('Michael', 'python')
+        response = self.app.post('api/tasks/export/', data=json.dumps(dict(format='csv')),
+                                 content_type='application/json')
+        self.assertEqual(response.status_code, 202)
+        location = response.headers['Location']
+        self.assertEqual(self.load(self.app.get(location))['status'], Job.QUEUED)
+        self.assertIsNotNone(run_one())
+        status = self.load(self.app.get(location))
+        self.assertEqual(status['status'], Job.DONE)
+        response = self.app.get(status['download'])
+        self.assertEqual(response.status_code, 200)
+        lines = response.data.decode('utf-8').splitlines()
+        self.assertTrue(lines[0].startswith('task_id,name'))
+        self.assertIn('Buy milk', lines[1])
+        # other users can't see the job
+        self.app.get('logout/')
+        self.login('Fletcher', 'python')
+        self.assertEqual(self.app.get(location).status_code, 404)
+        self.assertEqual(self.app.post('api/jobs/', data=json.dumps(dict(kind='reconcile_counts')),
+                                       content_type='application/json').status_code, 403)
+
+
+if __name__ == '__main__':
+    unittest.main()
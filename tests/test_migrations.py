@@ -0,0 +1,161 @@
+# tests/test_migrations.py
+
+
+import os
+import unittest
+
+from sqlalchemy import Column, Integer, MetaData, String, Table
+
+from project import app, db
+from project._config import basedir
+from project.migrations import MIGRATIONS, BatchedUpdate, CopyRows, Migration, \
+    MigrationRunner, dry_run
+from project.models import SchemaVersion, Task, User
+
+TEST_DB = 'test.db'
+
+
+class Interrupted(Exception):
+    pass
+
+
+class FailingUpdate(BatchedUpdate):
+
+    # dies on the third range, as if the process had been killed
+    def apply(self, connection, low, high):
+        self.ranges = getattr(self, 'ranges', 0) + 1
+        if self.ranges == 3:
+            raise Interrupted()
+        BatchedUpdate.apply(self, connection, low, high)
+
+
+class AllTests(unittest.TestCase):
+
+    ############################
+    #### setup and teardown ####
+    ############################
+
+    # executed prior to each test
+    def setUp(self):
+        app.config['TESTING'] = True
+        app.config['WTF_CSRF_ENABLED'] = False
+        app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get(
+            'TEST_DATABASE_URL', 'sqlite:///' + os.path.join(basedir, TEST_DB))
+        self.app = app.test_client()
+        db.create_all()
+
+    # executed after each test
+    def tearDown(self):
+        db.session.remove()
+        db.engine.execute('DROP TABLE IF EXISTS old_users')
+        db.drop_all()
+
+
+    ############################
+    ##### helper functions #####
+    ############################
+
+    def create_old_users(self, count):
+        old_users = Table('old_users', MetaData(),
+                          Column('id', Integer, primary_key=True), Column('name', String),
+                          Column('email', String), Column('password', String))
+        old_users.create(db.engine)
+        db.engine.execute(old_users.insert(), [
+            dict(id=i, name='user{0}'.format(i), email='user{0}@example.com'.format(i),
+                 password='python')
+            for i in range(1, count + 1)])
+
+    def create_legacy_tasks(self):
+        if db.engine.dialect.name != 'sqlite':
+            raise unittest.SkipTest('SQLite only')
+        # an old tasks table whose status has no type, so SQLite keeps '0'
+        # and '1' as text instead of converting them
+        Task.__table__.drop(db.engine)
+        db.engine.execute('CREATE TABLE tasks (task_id INTEGER PRIMARY KEY, name VARCHAR NOT NULL, '
+                          'due_date DATE NOT NULL, priority INTEGER NOT NULL, posted_date DATE, '
+                          'status, user_id INTEGER)')
+
+    def bump_password(self, step_class):
+        return step_class('append to passwords', 'old_users', 'id', "password = password || '!'")
+
+
+    ###############
+    #### tests ####
+    ###############
+
+    def test_migrations_apply_once_in_order(self):
+        db.drop_all()
+        runner = MigrationRunner(db.engine)
+        self.assertEqual(runner.run(), [m.version for m in MIGRATIONS])
+        self.assertEqual(MigrationRunner(db.engine).run(), [])
+        self.assertEqual([timing[0] for timing in runner.timings],
+                         [m.version for m in MIGRATIONS for step in m.steps])
+        self.assertTrue(all(row.applied for row in SchemaVersion.query.all()))
+
+    def test_data_versions_are_seeded(self):
+        db.engine.execute('DELETE FROM data_versions')
+        MigrationRunner(db.engine).run()
+        self.assertEqual([tuple(row) for row in db.engine.execute(
+            'SELECT name, version FROM data_versions')], [('tasks', 0)])
+
+    def test_users_without_a_role_get_the_user_role(self):
+        db.engine.execute(User.__table__.insert().values(
+            name='michael', email='michael@realpython.com', password='python', role=None))
+        MigrationRunner(db.engine).run()
+        self.assertEqual(User.query.one().role, 'user')
+
+    def test_text_statuses_are_normalized_in_batches(self):
+        self.create_legacy_tasks()
+        db.engine.execute(
+            "INSERT INTO tasks (name, due_date, priority, status, user_id) "
+            "VALUES ('a', '2016-01-01', 1, '0', 1), ('b', '2016-01-01', 1, '1', 1), "
+            "('c', '2016-01-01', 1, 0, 1)")
+        rows = db.engine.execute('SELECT typeof(status) FROM tasks ORDER BY task_id')
+        self.assertEqual([row[0] for row in rows], ['text', 'text', 'integer'])
+        MigrationRunner(db.engine, batch_size=2).run()
+        rows = db.engine.execute('SELECT typeof(status), status FROM tasks ORDER BY task_id')
+        self.assertEqual([tuple(row) for row in rows],
+                         [('integer', Task.CLOSED), ('integer', Task.OPEN), ('integer', Task.CLOSED)])
+
+    def test_rows_are_copied_in_batches(self):
+        self.create_old_users(25)
+        migration = Migration(10, 'copy old users', [CopyRows(
+            'copy old_users into users', 'old_users', 'users',
+            [('id', 'id'), ('name', 'name'), ('email', 'email'), ('password', 'password'),
+             ('role', "'user'"), ('active', '1 = 1')], 'id')])
+        progress = []
+        runner = MigrationRunner(db.engine, [migration], batch_size=10,
+                                 progress=lambda *args: progress.append(args[2:4]))
+        runner.run()
+        self.assertEqual(User.query.count(), 25)
+        self.assertEqual(User.query.get(25).role, 'user')
+        self.assertEqual(progress, [(10, 25), (20, 25), (25, 25)])
+
+    def test_interrupted_migrations_resume_from_the_checkpoint(self):
+        self.create_old_users(25)
+        failing = Migration(10, 'mark passwords', [self.bump_password(FailingUpdate)])
+        with self.assertRaises(Interrupted):
+            MigrationRunner(db.engine, [failing], batch_size=10).run()
+        state = SchemaVersion.query.get(10)
+        self.assertEqual((state.step, state.checkpoint, state.applied), (0, 20, None))
+        db.session.remove()
+
+        resumed = Migration(10, 'mark passwords', [self.bump_password(BatchedUpdate)])
+        runner = MigrationRunner(db.engine, [resumed], batch_size=10)
+        self.assertEqual(runner.run(), [10])
+        passwords = [row[0] for row in db.engine.execute('SELECT password FROM old_users')]
+        # every row was updated exactly once
+        self.assertEqual(set(passwords), set(['python!']))
+        self.assertIsNotNone(SchemaVersion.query.get(10).applied)
+
+    def test_dry_run_leaves_the_database_alone(self):
+        if db.engine.dialect.name != 'sqlite':
+            raise unittest.SkipTest('SQLite only')
+        timings = dry_run(db.engine, batch_size=10)
+        self.assertEqual([timing[0] for timing in timings],
+                         [m.version for m in MIGRATIONS for step in m.steps])
+        self.assertEqual(MigrationRunner(db.engine).states(), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
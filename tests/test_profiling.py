@@ -0,0 +1,138 @@
+# tests/test_profiling.py
+
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from project import app, db
+from project._config import basedir
+from project.models import User
+
+TEST_DB = 'test.db'
+
+
+class AllTests(unittest.TestCase):
+
+    ############################
+    #### setup and teardown ####
+    ############################
+
+    # executed prior to each test
+    def setUp(self):
+        app.config['TESTING'] = True
+        app.config['WTF_CSRF_ENABLED'] = False
+        app.config['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256:1000'
+        app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get(
+            'TEST_DATABASE_URL', 'sqlite:///' + os.path.join(basedir, TEST_DB))
+        app.config['PROFILING_ENABLED'] = True
+        self.app = app.test_client()
+        app.extensions['task_cache'].clear()
+        app.extensions['login_limiter'].reset()
+        app.extensions['principal_cache'].clear()
+        app.extensions['metrics'].reset()
+        db.create_all()
+
+    # executed after each test
+    def tearDown(self):
+        app.config['PROFILING_ENABLED'] = False
+        app.config['PROFILING_SLOW_QUERY_MS'] = 100
+        app.config['PROFILING_CPROFILE_RATE'] = 0
+        db.session.remove()
+        db.drop_all()
+
+
+    ############################
+    ##### helper functions #####
+    ############################
+
+    def login(self, name, password):
+        return self.app.post('/', data=dict(name=name, password=password), follow_redirects=True)
+
+    def create_user(self, name, email, password, role=None):
+        new_user = User(name=name, email=email, password=password, role=role)
+        db.session.add(new_user)
+        db.session.commit()
+
+    def metric(self, text, line_start):
+        for line in text.splitlines():
+            if line.startswith(line_start):
+                return float(line.rsplit(' ', 1)[1])
+
+
+    ###############
+    #### tests ####
+    ###############
+
+    def test_metrics_are_not_served_when_disabled(self):
+        app.config['PROFILING_ENABLED'] = False
+        self.assertEqual(self.app.get('metrics').status_code, 404)
+
+    def test_requests_sql_and_templates_are_recorded(self):
+        self.create_user('Michael', 'michael@realpython.com', 'python')
+        # the login redirects to the task list, so it is fetched twice
+        self.login('Michael', 'python')
+        self.app.get('tasks/')
+        response = self.app.get('metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith('text/plain'))
+        text = response.data.decode('utf-8')
+        self.assertEqual(self.metric(
+            text, 'flasktaskr_requests_total{endpoint="tasks.tasks",method="GET",status="200"}'), 2)
+        self.assertEqual(self.metric(
+            text, 'flasktaskr_request_duration_seconds_count{endpoint="tasks.tasks"}'), 2)
+        self.assertTrue(self.metric(text, 'flasktaskr_sql_queries_total{endpoint="tasks.tasks"}') > 0)
+        self.assertTrue(self.metric(text, 'flasktaskr_template_seconds_total{endpoint="tasks.tasks"}') > 0)
+        # the metrics endpoint does not count itself
+        self.assertNotIn('endpoint="metrics"', text)
+
+    def test_slow_queries_are_sampled_for_admins(self):
+        app.config['PROFILING_SLOW_QUERY_MS'] = 0
+        self.create_user('Michael', 'michael@realpython.com', 'python')
+        self.login('Michael', 'python')
+        self.assertEqual(self.app.get('metrics/slow-queries').status_code, 403)
+        self.app.get('logout/')
+        self.create_user('Superman', 'admin@realpython.com', 'allpowerful', role='admin')
+        self.login('Superman', 'allpowerful')
+        response = self.app.get('metrics/slow-queries')
+        self.assertEqual(response.status_code, 200)
+        sample = response.data.decode('utf-8')
+        self.assertIn('FROM users', sample)
+        # bound values, like the name and password hash, are not kept
+        self.assertNotIn('Superman', sample)
+        self.assertNotIn('pbkdf2', sample)
+        self.assertNotIn('allpowerful', sample)
+
+    def test_sampled_requests_are_profiled(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.addCleanup(app.config.__setitem__, 'PROFILING_CPROFILE_DIR',
+                        app.config['PROFILING_CPROFILE_DIR'])
+        app.config['PROFILING_CPROFILE_DIR'] = directory
+        app.config['PROFILING_CPROFILE_RATE'] = 1
+        self.app.get('/')
+        profiles = os.listdir(directory)
+        self.assertEqual(len(profiles), 1)
+        self.assertTrue(profiles[0].startswith('users.login-'))
+
+    def test_profiler_stops_when_the_view_raises(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.addCleanup(app.config.__setitem__, 'PROFILING_CPROFILE_DIR',
+                        app.config['PROFILING_CPROFILE_DIR'])
+        app.config['PROFILING_CPROFILE_DIR'] = directory
+        app.config['PROFILING_CPROFILE_RATE'] = 1
+        def broken():
+            raise RuntimeError('boom')
+        self.addCleanup(app.view_functions.__setitem__, 'users.login',
+                        app.view_functions['users.login'])
+        app.view_functions['users.login'] = broken
+        self.assertRaises(RuntimeError, self.app.get, '/')
+        self.assertIsNone(sys.getprofile())
+        self.assertEqual(len(os.listdir(directory)), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
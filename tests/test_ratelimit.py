@@ -0,0 +1,71 @@
+# tests/test_ratelimit.py
+
+
+import unittest
+
+from project import app
+from project.cache import LocalCache, make_cache
+from project.ratelimit import CacheBucketStore, LocalBucketStore, LoginLimiter, make_login_limiter
+
+
+class AllTests(unittest.TestCase):
+
+    def check_store(self, store):
+        # 3 tokens refilling over 30 seconds: one token every 10 seconds
+        for _ in range(3):
+            self.assertEqual(store.take('key', 3, 30, now=100), 0)
+        self.assertAlmostEqual(store.take('key', 3, 30, now=100), 10)
+        self.assertAlmostEqual(store.take('key', 3, 30, now=105), 5)
+        self.assertEqual(store.take('key', 3, 30, now=110), 0)
+        self.assertEqual(store.take('other', 3, 30, now=110), 0)
+        # a check costs nothing
+        for _ in range(5):
+            self.assertEqual(store.take('checked', 1, 30, now=110, cost=0), 0)
+        self.assertEqual(store.take('checked', 1, 30, now=110), 0)
+        self.assertAlmostEqual(store.take('checked', 1, 30, now=110, cost=0), 30)
+
+    def test_local_bucket_store(self):
+        self.check_store(LocalBucketStore())
+
+    def test_cache_bucket_store(self):
+        self.check_store(CacheBucketStore(LocalCache()))
+
+    def test_idle_buckets_expire(self):
+        store = LocalBucketStore()
+        store.take('a', 3, 30, now=100)
+        store.take('b', 3, 30, now=120)
+        store.take('c', 3, 30, now=140)
+        self.assertEqual(len(store), 2)
+
+    def test_bucket_count_is_bounded(self):
+        store = LocalBucketStore(max_keys=2)
+        for key in 'abcd':
+            store.take(key, 1, 30, now=100)
+        self.assertEqual(len(store), 2)
+        # 'd' is still empty, 'a' was forgotten and is full again
+        self.assertTrue(store.take('d', 1, 30, now=100) > 0)
+        self.assertEqual(store.take('a', 1, 30, now=100), 0)
+
+    def test_login_limiter_charges_failed_attempts(self):
+        limiter = LoginLimiter(LocalBucketStore(), user_burst=2, ip_burst=3, refill_seconds=60)
+        for address in ('10.0.0.1', '10.0.0.2'):
+            self.assertEqual(limiter.retry_after('michael', address), 0)
+            limiter.failed('michael', address)
+        self.assertTrue(limiter.retry_after('michael', '10.0.0.3') > 0)
+        self.assertEqual(limiter.retry_after('fletcher', '10.0.0.4'), 0)
+        for username in 'abc':
+            self.assertEqual(limiter.retry_after(username, '10.0.0.5'), 0)
+            limiter.failed(username, '10.0.0.5')
+        self.assertTrue(limiter.retry_after('d', '10.0.0.5') > 0)
+
+    def test_limiter_reset_leaves_other_caches_alone(self):
+        config = dict(app.config, TASK_CACHE='local', LOGIN_LIMIT_STORAGE='cache')
+        tasks = make_cache(config)
+        tasks.set('page', 'cached')
+        limiter = make_login_limiter(config)
+        limiter.failed('michael', '10.0.0.1')
+        limiter.reset()
+        self.assertEqual(tasks.get('page'), 'cached')
+
+if __name__ == '__main__':
+    unittest.main()
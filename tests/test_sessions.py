@@ -0,0 +1,176 @@
+# tests/test_sessions.py
+
+
+import os
+import time
+import unittest
+
+from project import app, db
+from project._config import basedir
+from project.models import User, UserSession
+from project.sessions import DatabaseSessionStore, MemorySessionStore, ServerSessionInterface
+
+TEST_DB = 'test.db'
+
+
+class AllTests(unittest.TestCase):
+
+    ############################
+    #### setup and teardown ####
+    ############################
+
+    # executed prior to each test
+    def setUp(self):
+        app.config['TESTING'] = True
+        app.config['WTF_CSRF_ENABLED'] = False
+        app.config['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256:1000'
+        app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get(
+            'TEST_DATABASE_URL', 'sqlite:///' + os.path.join(basedir, TEST_DB))
+        self.cookie_sessions = app.session_interface
+        self.app = app.test_client()
+        app.extensions['task_cache'].clear()
+        app.extensions['login_limiter'].reset()
+        app.extensions['principal_cache'].clear()
+        db.create_all()
+
+    # executed after each test
+    def tearDown(self):
+        app.session_interface = self.cookie_sessions
+        db.session.remove()
+        db.drop_all()
+
+
+    ############################
+    ##### helper functions #####
+    ############################
+
+    def use_store(self, store):
+        app.session_interface = ServerSessionInterface(store, idle_seconds=600, refresh_seconds=60)
+        return store
+
+    def login(self, client, name, password):
+        return client.post('/', data=dict(name=name, password=password), follow_redirects=True)
+
+    def create_user(self, name, email, password):
+        new_user = User(name=name, email=email, password=password)
+        db.session.add(new_user)
+        db.session.commit()
+        return new_user.id
+
+    def session_cookie(self, client):
+        for cookie in client.cookie_jar:
+            if cookie.name == app.session_cookie_name:
+                return cookie.value
+
+    def check_login_and_revoke(self, store):
+        user_id = self.create_user('Michael', 'michael@realpython.com', 'python')
+        laptop, phone = app.test_client(), app.test_client()
+        self.login(laptop, 'Michael', 'python')
+        self.login(phone, 'Michael', 'python')
+        self.assertEqual(laptop.get('tasks/').status_code, 200)
+        # the cookie is only an id, not the signed session data
+        self.assertNotIn('.', self.session_cookie(laptop))
+        self.assertNotEqual(self.session_cookie(laptop), self.session_cookie(phone))
+        self.assertEqual(store.revoke_user(user_id), 2)
+        self.assertEqual(laptop.get('tasks/').status_code, 302)
+        self.assertEqual(phone.get('tasks/').status_code, 302)
+
+
+    ###############
+    #### tests ####
+    ###############
+
+    def test_memory_store_login_and_revoke(self):
+        self.check_login_and_revoke(self.use_store(MemorySessionStore()))
+
+    def test_database_store_login_and_revoke(self):
+        self.check_login_and_revoke(self.use_store(DatabaseSessionStore()))
+
+    def test_banned_users_lose_their_sessions(self):
+        self.use_store(DatabaseSessionStore())
+        self.create_user('Michael', 'michael@realpython.com', 'python')
+        self.login(self.app, 'Michael', 'python')
+        user = User.query.first()
+        user.active = False
+        db.session.commit()
+        self.assertEqual(UserSession.query.count(), 0)
+        self.assertEqual(self.app.get('tasks/').status_code, 302)
+
+    def test_role_changes_revoke_sessions_but_other_updates_do_not(self):
+        store = self.use_store(MemorySessionStore())
+        self.create_user('Michael', 'michael@realpython.com', 'python')
+        self.login(self.app, 'Michael', 'python')
+        user = User.query.first()
+        user.email = 'michael@example.com'
+        db.session.commit()
+        self.assertEqual(len(store._sessions), 1)
+        user.role = 'admin'
+        db.session.commit()
+        self.assertEqual(len(store._sessions), 0)
+        self.assertEqual(self.app.get('tasks/').status_code, 302)
+
+    def test_anonymous_sessions_are_not_stored(self):
+        store = self.use_store(MemorySessionStore())
+        self.app.get('/')
+        self.app.post('register/', data=dict(
+            name='Michael', email='michael@realpython.com', password='python',
+            confirm='python'))
+        self.assertEqual(len(store._sessions), 0)
+        # the flashed message travels in a signed cookie instead
+        self.assertIn('.', self.session_cookie(self.app))
+        self.assertIn(b'Thanks for registering.', self.app.get('/').data)
+
+    def test_logout_deletes_the_stored_session(self):
+        self.use_store(DatabaseSessionStore())
+        self.create_user('Michael', 'michael@realpython.com', 'python')
+        self.login(self.app, 'Michael', 'python')
+        sid = self.session_cookie(self.app)
+        self.assertEqual(UserSession.query.filter_by(sid=sid).count(), 1)
+        self.app.get('logout/', follow_redirects=True)
+        self.assertEqual(UserSession.query.filter_by(sid=sid).count(), 0)
+        self.assertEqual(UserSession.query.filter(UserSession.user_id != None).count(), 0)
+
+    def test_login_issues_a_new_session_id(self):
+        store = self.use_store(DatabaseSessionStore())
+        self.create_user('Michael', 'michael@realpython.com', 'python')
+        # an id planted before login must not become the logged-in session
+        store.save('planted', {'seen': True}, None, time.time() + 600)
+        self.app.set_cookie('localhost', app.session_cookie_name, 'planted')
+        self.login(self.app, 'Michael', 'python')
+        self.assertNotEqual(self.session_cookie(self.app), 'planted')
+        self.assertIsNone(store.load('planted', time.time()))
+        self.assertEqual(self.app.get('tasks/').status_code, 200)
+
+    def test_expiry_slides_without_writing_every_request(self):
+        store = self.use_store(MemorySessionStore())
+        self.create_user('Michael', 'michael@realpython.com', 'python')
+        self.login(self.app, 'Michael', 'python')
+        sid = self.session_cookie(self.app)
+        first_expiry = store._sessions[sid][2]
+        self.app.get('tasks/')
+        self.assertEqual(store._sessions[sid][2], first_expiry)
+        # once the stored expiry is older than the refresh interval it moves
+        data, user_id, expires = store._sessions[sid]
+        store._sessions[sid] = (data, user_id, expires - 120)
+        self.app.get('tasks/')
+        self.assertTrue(store._sessions[sid][2] >= first_expiry)
+
+    def test_memory_store_is_bounded(self):
+        store = MemorySessionStore(max_entries=2)
+        for sid in 'abc':
+            store.save(sid, {'user_id': 1}, 1, time.time() + 60)
+        self.assertEqual(list(store._sessions), ['b', 'c'])
+        self.assertEqual(store.revoke_user(1), 2)
+
+    def test_sweep_removes_expired_sessions(self):
+        now = time.time()
+        for store in (MemorySessionStore(), DatabaseSessionStore()):
+            store.save('old', {'user_id': 1}, 1, now - 10)
+            store.save('new', {'user_id': 1}, 1, now + 600)
+            self.assertEqual(store.sweep(now), 1)
+            self.assertIsNone(store.load('old', now))
+            self.assertEqual(store.load('new', now)[0], {'user_id': 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
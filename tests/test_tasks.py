@@ -1,12 +1,25 @@
 # project/test.py
 
 
+import gzip
+import io
+import json
 import os
+import re
 import unittest
+from datetime import date
+
+from sqlalchemy import Column, MetaData, String, Table, event
 
 from project import app, db
 from project._config import basedir
-from project.models import Task, User
+from project.counters import reconcile_counts, task_summary, tasks_changing, tasks_completed, \
+    today
+from project.listing import INDEXES, TaskListing
+from project.models import DataVersion, Task, TaskCount, TaskTerm, User
+from project.schema import add_missing_columns, create_missing_indexes, missing_indexes, \
+    normalize_task_status
+from project.tasks.views import invalidate_task_lists
 
 TEST_DB = 'test.db'
 
@@ -21,8 +34,13 @@ class AllTests(unittest.TestCase):
     def setUp(self):
         app.config['TESTING'] = True
         app.config['WTF_CSRF_ENABLED'] = False
-        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(basedir, TEST_DB)
+        app.config['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256:1000'
+        app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get(
+            'TEST_DATABASE_URL', 'sqlite:///' + os.path.join(basedir, TEST_DB))
         self.app = app.test_client()
+        app.extensions['task_cache'].clear()
+        app.extensions['login_limiter'].reset()
+        app.extensions['principal_cache'].clear()
         db.create_all()
 
     # executed after each test
@@ -62,6 +80,39 @@ class AllTests(unittest.TestCase):
                 status='1'
             ), follow_redirects=True)
 
+    def create_tasks(self, count, status=Task.OPEN, user_id=1):
+        for i in range(count):
+            db.session.add(Task(
+                'Task {0:03d}'.format(i), date(2014, 2, 1 + i % 28), 1,
+                date(2014, 1, 1), status, user_id
+            ))
+        db.session.commit()
+        invalidate_task_lists('open', 'closed')
+
+    def record_statements(self, url):
+        return self.record_statements_with_headers(url, [])
+
+    def record_statements_with_headers(self, url, headers):
+        statements = []
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            response = self.app.get(url, headers=headers)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+        return response, statements
+
+    def count_queries(self, url):
+        response, statements = self.record_statements(url)
+        self.assertEqual(response.status_code, 200)
+        return len(statements)
+
+    def follow_link(self, response, text):
+        match = re.search(r'<a href="([^"]+)">' + text, response.data.decode('utf-8'))
+        self.assertIsNotNone(match)
+        return self.app.get(match.group(1).replace('&amp;', '&'))
+
 
     ############################
     ######## dummy data ########
@@ -184,6 +235,459 @@ class AllTests(unittest.TestCase):
         self.assertIn(b'The task was deleted.', response.data)
         self.assertNotIn(b'You can only delete tasks that belong to you.', response.data)
 
+    def test_task_lists_are_paginated(self):
+        self.create_user(*self.michael_create_user)
+        self.login(*self.michael_login)
+        self.create_tasks(5)
+        response = self.app.get('tasks/?per_page=2')
+        self.assertIn(b'Task 000', response.data)
+        self.assertIn(b'Task 001', response.data)
+        self.assertNotIn(b'Task 002', response.data)
+        self.assertNotIn(b'Previous', response.data)
+        response = self.follow_link(response, 'Next')
+        self.assertIn(b'Task 002', response.data)
+        self.assertIn(b'Task 003', response.data)
+        self.assertNotIn(b'Task 001', response.data)
+        response = self.follow_link(response, 'Next')
+        self.assertIn(b'Task 004', response.data)
+        self.assertNotIn(b'Next', response.data)
+        response = self.follow_link(response, '&laquo; Previous')
+        self.assertIn(b'Task 002', response.data)
+        self.assertIn(b'Task 003', response.data)
+        self.assertNotIn(b'Task 004', response.data)
+
+    def test_open_and_closed_lists_page_independently(self):
+        self.create_user(*self.michael_create_user)
+        self.login(*self.michael_login)
+        self.create_tasks(3, status=Task.OPEN)
+        response = self.app.get('tasks/?per_page=2&closed_after=garbage')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'open_after=', response.data)
+        self.assertNotIn(b'closed_after=2', response.data)
+
+    def test_task_lists_can_be_filtered_and_sorted(self):
+        self.create_user(*self.michael_create_user)
+        self.login(*self.michael_login)
+        self.create_tasks(5)
+        response = self.app.get('tasks/?sort=due&order=desc&due_after=2014-02-02&due_before=2014-02-04&per_page=2')
+        html = response.data.decode('utf-8')
+        self.assertLess(html.index('Task 003'), html.index('Task 002'))
+        self.assertNotIn('Task 004', html)
+        self.assertNotIn('Task 000', html)
+        response = self.follow_link(response, 'Next')
+        self.assertIn(b'Task 001', response.data)
+        self.assertNotIn(b'Task 002', response.data)
+
+    def test_unsupported_listings_are_refused(self):
+        self.create_user(*self.michael_create_user)
+        self.login(*self.michael_login)
+        self.create_tasks(2)
+        response = self.app.get('tasks/?sort=posted&due_after=2014-02-02')
+        self.assertIn(b'due_after can only be used with sort=due.', response.data)
+        # the default listing is shown instead
+        self.assertIn(b'Task 000', response.data)
+        response = self.app.get('tasks/?owner=Nobody')
+        self.assertIn(b'There is no user called Nobody.', response.data)
+
+    def test_every_listing_walks_its_index(self):
+        if db.engine.dialect.name != 'sqlite':
+            raise unittest.SkipTest('SQLite only')
+        self.create_tasks(1)
+        ranges = {'due': {'due_after': date(2014, 1, 1)}, 'priority': {'priority_max': 5},
+                  'posted': {}}
+        for (by_owner, sort), index in INDEXES.items():
+            listing = TaskListing(Task.OPEN, 1 if by_owner else None, sort, True, ranges[sort])
+            statements = []
+            def record(conn, cursor, statement, parameters, context, executemany):
+                statements.append((statement, parameters))
+            event.listen(db.engine, 'before_cursor_execute', record)
+            try:
+                listing.query().limit(10).all()
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', record)
+            statement, parameters = statements[0]
+            plan = ' '.join(row[3] for row in db.engine.execute(
+                'EXPLAIN QUERY PLAN ' + statement, parameters))
+            self.assertIn('USING INDEX ' + index, plan)
+            self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_task_list_query_count_does_not_grow_with_tasks(self):
+        self.create_user(*self.michael_create_user)
+        self.login(*self.michael_login)
+        for i in range(6):
+            self.create_user('user{0}'.format(i), 'user{0}@example.com'.format(i), 'python')
+        self.create_tasks(2, user_id=2)
+        self.create_tasks(2, status=Task.CLOSED, user_id=3)
+        few = self.count_queries('tasks/')
+        for user_id in range(4, 8):
+            self.create_tasks(1, user_id=user_id)
+            self.create_tasks(1, status=Task.CLOSED, user_id=user_id)
+        many = self.count_queries('tasks/')
+        self.assertEqual(few, many)
+
+    def test_missing_indexes_are_created_in_place(self):
+        self.assertEqual(missing_indexes(db.engine, db.metadata), [])
+        for index in Task.__table__.indexes:
+            index.drop(db.engine)
+        created = create_missing_indexes(db.engine, db.metadata)
+        self.assertEqual(sorted(created), sorted(index.name for index in Task.__table__.indexes))
+        self.assertEqual(missing_indexes(db.engine, db.metadata), [])
+
+    def test_task_status_is_stored_as_an_integer(self):
+        self.create_user(*self.michael_create_user)
+        self.login(*self.michael_login)
+        self.create_task()
+        self.assertEqual(db.session.query(Task).first().status, Task.OPEN)
+        self.app.get('complete/1/', follow_redirects=True)
+        db.session.remove()
+        self.assertEqual(db.session.query(Task).first().status, Task.CLOSED)
+
+    def test_legacy_text_statuses_are_normalized(self):
+        if db.engine.dialect.name != 'sqlite':
+            raise unittest.SkipTest('SQLite only')
+        # an old tasks table whose status has no type keeps '0' / '1' as text
+        Task.__table__.drop(db.engine)
+        db.engine.execute('CREATE TABLE tasks (task_id INTEGER PRIMARY KEY, name VARCHAR NOT NULL, '
+                          'due_date DATE NOT NULL, priority INTEGER NOT NULL, posted_date DATE, '
+                          'status, user_id INTEGER)')
+        db.engine.execute(Task.__table__.insert(), [
+            dict(name='open', due_date=date(2014, 2, 5), priority=1, status='1'),
+            dict(name='closed', due_date=date(2014, 2, 5), priority=1, status='0'),
+            dict(name='done', due_date=date(2014, 2, 5), priority=1, status=Task.CLOSED),
+        ])
+        self.assertEqual(db.engine.execute(
+            "SELECT count(*) FROM tasks WHERE typeof(status) = 'text'").scalar(), 2)
+        # the integer row is left alone
+        self.assertEqual(normalize_task_status(db.engine), 2)
+        self.assertEqual(db.engine.execute(
+            "SELECT count(*) FROM tasks WHERE typeof(status) = 'text'").scalar(), 0)
+        statuses = dict(db.session.query(Task.name, Task.status))
+        self.assertEqual(statuses, {'open': Task.OPEN, 'closed': Task.CLOSED, 'done': Task.CLOSED})
+
+    def test_users_cannot_complete_or_delete_missing_tasks(self):
+        self.create_user(*self.michael_create_user)
+        self.login(*self.michael_login)
+        response = self.app.get('complete/42/', follow_redirects=True)
+        self.assertIn(b'That task does not exist.', response.data)
+        response = self.app.get('delete/42/', follow_redirects=True)
+        self.assertIn(b'That task does not exist.', response.data)
+
+    def test_complete_never_loads_the_task(self):
+        self.create_user(*self.michael_create_user)
+        self.login(*self.michael_login)
+        self.create_task()
+        response, statements = self.record_statements('complete/1/')
+        # what the counts need, one conditional UPDATE, the counts and the
+        # listings' version stamp
+        self.assertEqual([' '.join(s.split()[:2]) for s in statements], [
+            'SELECT tasks.user_id', 'UPDATE tasks', 'UPDATE task_counts', 'UPDATE data_versions'])
+        self.assertTrue(statements[1].endswith('AND tasks.status = ?'))
+        # completing it again changes nothing
+        response, statements = self.record_statements('complete/1/')
+        self.assertEqual([s for s in statements if not s.startswith('SELECT')], ['UPDATE tasks '
+            'SET status=? WHERE tasks.task_id = ? AND tasks.user_id = ? AND tasks.status = ?'])
+
+    def test_counts_survive_a_task_completed_concurrently(self):
+        self.create_user(*self.michael_create_user)
+        self.login(*self.michael_login)
+        self.create_task()
+        self.create_task()
+        query = db.session.query(Task).filter(Task.user_id == 1, Task.status == Task.OPEN)
+        changes = tasks_changing(query)
+        # another request closes task 1, and counts it, between the read and
+        # the write
+        db.engine.execute(Task.__table__.update().where(Task.task_id == 1).values(status=Task.CLOSED))
+        db.engine.execute(TaskCount.__table__.update().values(
+            open=TaskCount.open - 1, closed=TaskCount.closed + 1))
+        completed = query.update({'status': Task.CLOSED}, synchronize_session=False)
+        self.assertEqual(completed, 1)
+        tasks_completed(changes, completed)
+        db.session.commit()
+        self.assertEqual(task_summary(1), dict(open=0, closed=2, overdue=0))
+
+    def test_task_counts_follow_every_write(self):
+        self.create_user(*self.michael_create_user)
+        self.login(*self.michael_login)
+        for _ in range(3):
+            self.create_task()
+        # the task is due in 2014, so it's overdue as soon as it's added
+        self.assertIn(b'<strong>3</strong> open,', self.app.get('tasks/').data)
+        self.app.get('complete/1/')
+        self.app.get('complete/1/')
+        self.app.get('delete/2/')
+        self.app.post('bulk/', data=dict(action='complete', task_ids=['1', '3']))
+        response = self.app.get('tasks/')
+        self.assertIn(b'<strong>0</strong> open,', response.data)
+        self.assertIn(b'<strong>2</strong> closed,', response.data)
+        self.assertIn(b'<strong>0</strong> overdue', response.data)
+        self.assertEqual(reconcile_counts(db.engine, fix=False), [])
+
+    def test_overdue_count_rolls_forward_with_the_date(self):
+        self.create_tasks(2)
+        db.session.add(TaskCount(user_id=1, open=2, closed=0, overdue=0,
+                                 overdue_as_of=date(2014, 2, 1)))
+        db.session.commit()
+        # both tasks fell due after 2014-02-01
+        self.assertEqual(task_summary(1), dict(open=2, closed=0, overdue=2))
+        self.assertEqual(reconcile_counts(db.engine, fix=False), [])
+        # checking leaves the row alone; fixing moves it forward
+        rows = db.engine.execute(db.select([TaskCount.overdue, TaskCount.overdue_as_of]))
+        self.assertEqual([tuple(row) for row in rows], [(0, date(2014, 2, 1))])
+        self.assertEqual(reconcile_counts(db.engine), [])
+        rows = db.engine.execute(db.select([TaskCount.overdue, TaskCount.overdue_as_of]))
+        self.assertEqual([tuple(row) for row in rows], [(2, today())])
+
+    def test_counts_are_created_with_the_user_and_read_without_writing(self):
+        self.create_user(*self.michael_create_user)
+        row = TaskCount.query.get(1)
+        self.assertEqual((row.open, row.closed, row.overdue), (0, 0, 0))
+        self.login(*self.michael_login)
+        self.create_task()
+        TaskCount.query.filter_by(user_id=1).update(dict(overdue=0, overdue_as_of=date(2014, 1, 1)))
+        db.session.commit()
+        response, statements = self.record_statements('tasks/')
+        self.assertIn(b'<strong>1</strong> overdue', response.data)
+        self.assertEqual([s for s in statements if not s.startswith('SELECT')], [])
+
+    def test_reconcile_reports_and_fixes_drift(self):
+        self.create_user(*self.michael_create_user)
+        self.login(*self.michael_login)
+        self.create_task()
+        # writes that bypass the views leave the counts behind
+        self.create_tasks(2, status=Task.CLOSED)
+        self.assertEqual(reconcile_counts(db.engine, fix=False), [(1, (1, 0, 1), (1, 2, 1))])
+        drift = reconcile_counts(db.engine)
+        self.assertEqual(drift, [(1, (1, 0, 1), (1, 2, 1))])
+        self.assertEqual(reconcile_counts(db.engine), [])
+        self.assertEqual(task_summary(1), dict(open=1, closed=2, overdue=1))
+
+    def test_users_can_complete_many_tasks_at_once(self):
+        self.create_user(*self.michael_create_user)
+        self.create_user(*self.fletcher_create_user)
+        self.create_tasks(3, user_id=1)
+        self.create_tasks(1, user_id=2)
+        self.login(*self.michael_login)
+        response = self.app.post('bulk/', data=dict(
+            action='complete', task_ids=['1', '2', '4', '99']
+        ), follow_redirects=True)
+        self.assertIn(b'2 task(s) completed.', response.data)
+        self.assertIn(b'1 task(s) skipped: you can only change tasks that belong to you.', response.data)
+        self.assertIn(b'1 task(s) skipped: they no longer exist.', response.data)
+        statuses = dict(db.session.query(Task.task_id, Task.status))
+        self.assertEqual(statuses, {
+            1: Task.CLOSED, 2: Task.CLOSED, 3: Task.OPEN, 4: Task.OPEN})
+
+    def test_bulk_delete_reports_per_task_results(self):
+        self.create_user(*self.michael_create_user)
+        self.create_user(*self.fletcher_create_user)
+        self.create_tasks(2, user_id=1)
+        self.create_tasks(1, user_id=2)
+        self.login(*self.michael_login)
+        response = self.app.post('bulk/', data=dict(
+            action='delete', task_ids=['1', '3', '7']
+        ), headers=[('Accept', 'application/json')])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data.decode('utf-8')), dict(results=[
+            dict(task_id=1, result='deleted'),
+            dict(task_id=3, result='forbidden'),
+            dict(task_id=7, result='not found'),
+        ]))
+        self.assertEqual(db.session.query(Task).count(), 2)
+
+    def test_bulk_requires_selected_tasks(self):
+        self.create_user(*self.michael_create_user)
+        self.login(*self.michael_login)
+        response = self.app.post('bulk/', data=dict(action='delete'), follow_redirects=True)
+        self.assertIn(b'Select at least one task and an action.', response.data)
+
+    def test_task_lists_are_served_from_the_cache(self):
+        self.create_user(*self.michael_create_user)
+        self.login(*self.michael_login)
+        self.create_tasks(2)
+        # the version and counts lookups plus the two listings, then the
+        # lookups alone
+        self.assertEqual(self.count_queries('tasks/'), 4)
+        self.assertEqual(self.count_queries('tasks/'), 2)
+
+    def test_writes_invalidate_the_cached_task_lists(self):
+        self.create_user(*self.michael_create_user)
+        self.login(*self.michael_login)
+        self.app.get('tasks/')
+        response = self.create_task()
+        self.assertIn(b'Go to the bank', response.data)
+        response = self.app.get('complete/1/', follow_redirects=True)
+        self.assertNotIn(b'Mark as Complete</a>', response.data)
+        self.assertIn(b'Go to the bank', response.data)
+        response = self.app.get('delete/1/', follow_redirects=True)
+        self.assertNotIn(b'Go to the bank', response.data)
+
+    def test_unchanged_task_page_answers_304(self):
+        self.create_user(*self.michael_create_user)
+        self.login(*self.michael_login)
+        response = self.app.get('tasks/')
+        etag = response.headers['ETag']
+        last_modified = response.headers['Last-Modified']
+        response, statements = self.record_statements_with_headers(
+            'tasks/', [('If-None-Match', etag)])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(len(statements), 1)
+        self.assertIn('data_versions', statements[0])
+        response = self.app.get('tasks/', headers=[
+            ('If-Modified-Since', last_modified)])
+        self.assertEqual(response.status_code, 304)
+
+    def test_every_write_bumps_the_tasks_version(self):
+        # the row exists from the start, so writes only ever UPDATE it
+        self.assertEqual(db.session.query(DataVersion.version).filter_by(name='tasks').scalar(), 0)
+        self.create_user(*self.michael_create_user)
+        self.login(*self.michael_login)
+        self.create_task()
+        self.create_task()
+        response, statements = self.record_statements('complete/1/')
+        self.app.get('delete/2/')
+        self.app.post('bulk/', data=dict(action='delete', task_ids=['1']))
+        self.assertEqual([s for s in statements if 'data_versions' in s and not s.startswith('UPDATE')], [])
+        db.session.remove()
+        self.assertEqual(db.session.query(DataVersion.version).filter_by(name='tasks').scalar(), 5)
+
+    def test_writes_change_the_task_page_etag(self):
+        self.create_user(*self.michael_create_user)
+        self.login(*self.michael_login)
+        etag = self.app.get('tasks/').headers['ETag']
+        self.create_task()
+        response = self.app.get('tasks/', headers=[('If-None-Match', etag)])
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'Go to the bank', response.data)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+    def test_task_rows_are_rendered_from_the_fragment_cache(self):
+        self.create_user(*self.michael_create_user)
+        self.login(*self.michael_login)
+        self.create_tasks(3)
+        row_cache = app.extensions['task_row_cache']
+        row_cache.clear()
+        first = self.app.get('tasks/').data
+        self.assertEqual(len(row_cache), 3)
+        self.create_tasks(1, status=Task.CLOSED)
+        second = self.app.get('tasks/').data
+        self.assertEqual(len(row_cache), 4)
+        self.assertEqual(first.count(b'Mark as Complete</a>'), 3)
+        self.assertEqual(second.count(b'Mark as Complete</a>'), 3)
+        self.assertEqual(second.count(b'Delete</a>'), 4)
+
+    def test_promoted_users_are_admins_without_logging_in_again(self):
+        self.create_user(*self.michael_create_user)
+        self.create_user(*self.fletcher_create_user)
+        self.create_tasks(1, user_id=1)
+        self.login(*self.fletcher_login)
+        response = self.app.get('complete/1/', follow_redirects=True)
+        self.assertIn(b'You can only update tasks that belong to you.', response.data)
+        fletcher = db.session.query(User).filter_by(name='Fletcher').one()
+        fletcher.role = 'admin'
+        db.session.commit()
+        response = self.app.get('complete/1/', follow_redirects=True)
+        self.assertIn(b'The task is complete! Nice.', response.data)
+
+    def test_missing_columns_are_added_in_place(self):
+        metadata = MetaData()
+        Table('users', metadata,
+              *[column.copy() for column in User.__table__.columns] +
+              [Column('nickname', String, server_default='none')])
+        self.assertEqual(add_missing_columns(db.engine, metadata), ['users.nickname'])
+        self.assertEqual(add_missing_columns(db.engine, metadata), [])
+
+    def test_users_export_their_own_tasks(self):
+        self.create_user(*self.michael_create_user)
+        self.create_user(*self.fletcher_create_user)
+        self.create_tasks(3, user_id=1)
+        self.create_tasks(2, status=Task.CLOSED, user_id=2)
+        self.login(*self.fletcher_login)
+        response = self.app.get('tasks/export/')
+        self.assertEqual(response.mimetype, 'text/csv')
+        self.assertIn('attachment', response.headers['Content-Disposition'])
+        lines = response.data.decode('utf-8').splitlines()
+        self.assertEqual(lines[0], 'task_id,name,due_date,priority,posted_date,status,poster')
+        self.assertEqual(lines[1:], [
+            '4,Task 000,2014-02-01,1,2014-01-01,closed,Fletcher',
+            '5,Task 001,2014-02-02,1,2014-01-01,closed,Fletcher',
+        ])
+
+    def search(self, query, **params):
+        params['q'] = query
+        response = self.app.get('tasks/search/', query_string=params,
+                                headers=[('Accept', 'application/json')])
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.data.decode('utf-8'))
+
+    def check_search_follows_writes(self):
+        self.create_user(*self.michael_create_user)
+        self.login(*self.michael_login)
+        for name in ('Go to the bank', 'Bank statement from the bank', 'Buy milk'):
+            self.app.post('add/', data=dict(name=name, due_date='02/05/2014', priority='1'))
+        results = self.search('bank')
+        self.assertEqual([task['name'] for task in results['tasks']],
+                         ['Bank statement from the bank', 'Go to the bank'])
+        self.assertEqual(results['tasks'][0]['poster_name'], 'Michael')
+        self.app.get('delete/2/')
+        self.assertEqual([task['task_id'] for task in self.search('bank')['tasks']], [1])
+        self.assertEqual(self.search('')['tasks'], [])
+        # all words must match; a trailing * matches a prefix
+        self.assertEqual(self.search('mil')['tasks'], [])
+        self.assertEqual([task['name'] for task in self.search('mil* BUY')['tasks']], ['Buy milk'])
+        self.assertEqual(self.search('milk bank')['tasks'], [])
+        self.assertEqual(self.search('mil* ban*')['tasks'], [])
+
+    def test_search_uses_the_fts_index(self):
+        self.check_search_follows_writes()
+
+    def test_search_falls_back_to_the_term_index(self):
+        app.config['SEARCH_BACKEND'] = 'terms'
+        self.addCleanup(app.config.__setitem__, 'SEARCH_BACKEND', 'auto')
+        self.check_search_follows_writes()
+        self.assertEqual(TaskTerm.query.filter_by(task_id=2).count(), 0)
+        # with tasks 2 and 3 gone SQLite hands id 2 out again
+        self.app.get('delete/3/')
+        self.app.post('add/', data=dict(name='Walk the dog', due_date='02/05/2014', priority='1'))
+        self.assertEqual([task['task_id'] for task in self.search('dog')['tasks']], [2])
+        self.assertEqual(self.search('milk')['tasks'], [])
+
+    def test_search_results_are_paginated(self):
+        self.create_user(*self.michael_create_user)
+        self.create_tasks(5)
+        self.login(*self.michael_login)
+        first = self.search('task', per_page=2)
+        self.assertTrue(first['has_next'])
+        last = self.search('task', per_page=2, page=3)
+        self.assertFalse(last['has_next'])
+        self.assertEqual(len(last['tasks']), 1)
+        response = self.app.get('tasks/search/?q=task&per_page=2')
+        self.assertIn(b'Task 004', response.data)
+        self.assertIn(b'Next', response.data)
+
+    def test_matches_beyond_the_ranked_candidates_are_found(self):
+        app.config['SEARCH_RANK_CANDIDATES'] = 3
+        self.addCleanup(app.config.__setitem__, 'SEARCH_RANK_CANDIDATES', 1000)
+        self.create_user(*self.michael_create_user)
+        self.create_tasks(5)
+        self.login(*self.michael_login)
+        found = []
+        for page in (1, 2, 3):
+            found.extend(task['task_id'] for task in self.search('task', per_page=2, page=page)['tasks'])
+        self.assertEqual(found, [5, 4, 3, 2, 1])
+
+    def test_admins_export_every_task_compressed(self):
+        self.create_user(*self.michael_create_user)
+        self.create_user(*self.admin_create_user)
+        self.create_tasks(3, user_id=1)
+        self.login(*self.admin_login)
+        response = self.app.get('tasks/export/?format=jsonl&gzip=1')
+        self.assertEqual(response.mimetype, 'application/gzip')
+        data = gzip.GzipFile(fileobj=io.BytesIO(response.data)).read().decode('utf-8')
+        tasks = [json.loads(line) for line in data.splitlines()]
+        self.assertEqual([task['task_id'] for task in tasks], [1, 2, 3])
+        self.assertEqual(tasks[0]['poster'], 'Michael')
+        self.assertEqual(tasks[0]['status'], 'open')
+
 
 
 if __name__ == '__main__':
@@ -4,9 +4,12 @@
 import os
 import unittest
 
+from sqlalchemy import event
+
 from project import app, db
 from project._config import basedir
 from project.models import Task, User
+from project.users.passwords import hash_plaintext_passwords, is_hashed
 
 TEST_DB = 'test.db'
 
@@ -21,8 +24,13 @@ class AllTests(unittest.TestCase):
     def setUp(self):
         app.config['TESTING'] = True
         app.config['WTF_CSRF_ENABLED'] = False
-        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(basedir, TEST_DB)
+        app.config['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256:1000'
+        app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get(
+            'TEST_DATABASE_URL', 'sqlite:///' + os.path.join(basedir, TEST_DB))
         self.app = app.test_client()
+        app.extensions['task_cache'].clear()
+        app.extensions['login_limiter'].reset()
+        app.extensions['principal_cache'].clear()
         db.create_all()
 
     # executed after each test
@@ -141,6 +149,151 @@ class AllTests(unittest.TestCase):
         for user in users:
             self.assertEqual(user.role, 'user')
 
+    def test_registered_passwords_are_hashed(self):
+        self.register(*self.michael_register)
+        user = db.session.query(User).first()
+        self.assertTrue(user.password.startswith('pbkdf2:sha256:1000$'))
+        response = self.login(*self.michael_login)
+        self.assertIn(b'Welcome!', response.data)
+
+    def test_passwords_are_rehashed_on_login_when_the_cost_changes(self):
+        self.create_user(*self.michael_create_user)
+        self.login(*self.michael_login)
+        self.logout()
+        self.assertTrue(db.session.query(User).first().password.startswith('pbkdf2:sha256:1000$'))
+        db.session.remove()
+        app.config['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256:2000'
+        response = self.login(*self.michael_login)
+        self.assertIn(b'Welcome!', response.data)
+        self.assertTrue(db.session.query(User).first().password.startswith('pbkdf2:sha256:2000$'))
+
+    def test_wrong_password_is_rejected_for_hashed_users(self):
+        self.register(*self.michael_register)
+        response = self.login('Michael', 'not-python')
+        self.assertIn(b'Invalid username or password.', response.data)
+
+    def test_plaintext_passwords_are_hashed_in_bulk(self):
+        self.create_user(*self.michael_create_user)
+        self.create_user(*self.fletcher_create_user)
+        self.assertEqual(hash_plaintext_passwords(batch_size=1, processes=2), 2)
+        self.assertEqual(hash_plaintext_passwords(batch_size=1, processes=2), 0)
+        for user in db.session.query(User):
+            self.assertTrue(is_hashed(user.password))
+        response = self.login(*self.fletcher_login)
+        self.assertIn(b'Welcome!', response.data)
+
+    def test_passwords_changed_during_the_bulk_hash_are_kept(self):
+        self.create_user(*self.michael_create_user)
+        self.create_user(*self.fletcher_create_user)
+        users = User.__table__
+        changed = []
+        def change_password(conn, cursor, statement, parameters, context, executemany):
+            if executemany and not changed:
+                changed.append(True)
+                db.engine.execute(users.update().where(users.c.name == 'Fletcher')
+                                  .values(password='changed'))
+        event.listen(db.engine, 'before_cursor_execute', change_password)
+        try:
+            hash_plaintext_passwords(processes=1)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', change_password)
+        self.assertEqual(changed, [True])
+        passwords = dict(db.engine.execute(db.select([users.c.name, users.c.password])).fetchall())
+        self.assertTrue(is_hashed(passwords['Michael']))
+        self.assertEqual(passwords['Fletcher'], 'changed')
+
+    def test_login_attempts_are_rate_limited(self):
+        self.register(*self.michael_register)
+        for _ in range(app.config['LOGIN_LIMIT_USER_BURST']):
+            response = self.login('Michael', 'wrong')
+            self.assertIn(b'Invalid username or password.', response.data)
+        statements = []
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            response = self.app.post('/', data=dict(name='Michael', password='python'))
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+        self.assertEqual(response.status_code, 429)
+        self.assertIn(b'Too many login attempts.', response.data)
+        self.assertEqual(statements, [])
+        # other usernames from the same address still get through
+        response = self.login('Fletcher', 'python')
+        self.assertIn(b'Invalid username or password.', response.data)
+
+    def test_successful_logins_are_not_rate_limited(self):
+        self.register(*self.michael_register)
+        for _ in range(app.config['LOGIN_LIMIT_USER_BURST'] + 1):
+            response = self.login(*self.michael_login)
+            self.assertIn(b'Welcome!', response.data)
+            self.app.get('logout/')
+
+    def test_inactive_users_cannot_login(self):
+        self.register(*self.michael_register)
+        user = db.session.query(User).first()
+        user.active = False
+        db.session.commit()
+        response = self.login(*self.michael_login)
+        self.assertIn(b'Invalid username or password.', response.data)
+
+    def test_banning_a_user_takes_effect_on_the_next_request(self):
+        self.register(*self.michael_register)
+        self.login(*self.michael_login)
+        self.assertEqual(self.app.get('tasks/').status_code, 200)
+        user = db.session.query(User).first()
+        user.active = False
+        db.session.commit()
+        response = self.app.get('tasks/', follow_redirects=True)
+        self.assertIn(b'You need to login first.', response.data)
+
+    def test_cached_users_are_dropped_when_the_change_commits(self):
+        self.register(*self.michael_register)
+        self.login(*self.michael_login)
+        self.assertEqual(self.app.get('tasks/').status_code, 200)
+        cache = app.extensions['principal_cache']
+        user = db.session.query(User).first()
+        user.active = False
+        db.session.flush()
+        # until the ban commits the cached (active) user still applies
+        self.assertTrue(cache.get(1).active)
+        db.session.commit()
+        self.assertIsNone(cache.get(1))
+        self.assertEqual(self.app.get('tasks/').status_code, 302)
+        # bulk updates through Query.update() count too
+        self.assertFalse(cache.get(1).active)
+        db.session.query(User).update({'active': True}, synchronize_session=False)
+        db.session.commit()
+        self.assertIsNone(cache.get(1))
+
+    def test_new_users_replace_a_cached_missing_user(self):
+        self.register(*self.michael_register)
+        with self.app.session_transaction() as session:
+            session['logged_in'] = True
+            session['user_id'] = 2
+        # nobody has id 2 yet, which is cached too
+        self.assertEqual(self.app.get('tasks/').status_code, 302)
+        with self.app.session_transaction() as session:
+            session['logged_in'] = True
+            session['user_id'] = 2
+        db.session.add(User('Fletcher', 'fletcher@realpython.com', 'python'))
+        db.session.commit()
+        self.assertEqual(self.app.get('tasks/').status_code, 200)
+
+    def test_logged_in_user_is_loaded_from_the_cache(self):
+        self.register(*self.michael_register)
+        self.login(*self.michael_login)
+        self.app.get('tasks/')
+        statements = []
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            self.app.get('tasks/')
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+        self.assertEqual([s for s in statements if 'FROM users' in s], [])
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file